@@ -0,0 +1,91 @@
+# 坐标转换性能测试
+#
+# 比较 CoordinateTransform（逐点）与 ArrayCoordinateTransform（向量化）在大量随机点上的速度，
+# 并检查两者结果的最大差异；最后比较 OffsetGrid（预计算网格插值）与公式在郑州范围内的速度和误差。
+#
+#     python bench/bench_coords_trans.py --points 2000000 --sample 100000
+
+import argparse
+import sys
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent / ".." / "post"))
+
+from coords_trans import ZHENGZHOU_BBOX, ArrayCoordinateTransform, CoordinateTransform, OffsetGrid
+
+TRANSFORMS = [
+    "gcj02_to_wgs84", "wgs84_to_gcj02", "gcj02_to_bd09", "bd09_to_gcj02",
+    "bd09_to_wgs84", "wgs84_to_bd09", "lonLat2Mercator", "Mercator2lonLat", "wmc2tile",
+]
+
+
+def make_points(n: int, rng: np.random.Generator):
+    """生成随机点，其中约 5% 位于国外，用于检查 out_of_china 的逐元素处理"""
+    lng = rng.uniform(73.0, 136.0, n)
+    lat = rng.uniform(3.0, 54.0, n)
+    abroad = rng.random(n) < 0.05
+    lng[abroad] = rng.uniform(-180.0, 70.0, abroad.sum())
+    return lng, lat
+
+
+def inputs(name: str, lng, lat):
+    if name == "Mercator2lonLat" or name == "wmc2tile":
+        return ArrayCoordinateTransform.lonLat2Mercator(lng, np.clip(lat, -85, 85))
+    return lng, lat
+
+
+def run(points: int, sample: int):
+    rng = np.random.default_rng(0)
+    lng, lat = make_points(points, rng)
+    print(f"{points} 个点（逐点版本使用前 {sample} 个点计时后按比例换算）")
+    print(f"{'transform':18s} {'scalar pts/s':>14s} {'array pts/s':>14s} {'speedup':>8s} {'max diff':>10s}")
+    for name in TRANSFORMS:
+        x, y = inputs(name, lng, lat)
+        start = perf_counter()
+        array_result = getattr(ArrayCoordinateTransform, name)(x, y)
+        array_rate = points / (perf_counter() - start)
+
+        scalar = getattr(CoordinateTransform, name)
+        xs, ys = x[:sample].tolist(), y[:sample].tolist()
+        start = perf_counter()
+        scalar_result = [scalar(u, v) for u, v in zip(xs, ys)]
+        scalar_rate = sample / (perf_counter() - start)
+
+        diff = max(
+            float(np.max(np.abs(np.asarray(array_result[i][:sample], dtype=np.float64) - np.array([r[i] for r in scalar_result], dtype=np.float64))))
+            for i in range(2)
+        )
+        print(f"{name:18s} {scalar_rate:14.0f} {array_rate:14.0f} {array_rate / scalar_rate:7.0f}x {diff:10.2e}")
+
+
+def run_grid(points: int, resolutions: list[float]):
+    rng = np.random.default_rng(0)
+    min_lng, min_lat, max_lng, max_lat = ZHENGZHOU_BBOX
+    lng = rng.uniform(min_lng, max_lng, points)
+    lat = rng.uniform(min_lat, max_lat, points)
+    start = perf_counter()
+    exact = ArrayCoordinateTransform.gcj02_to_wgs84(lng, lat)
+    exact_rate = points / (perf_counter() - start)
+    print(f"\n郑州范围内 gcj02_to_wgs84，公式: {exact_rate:.0f} pts/s")
+    print(f"{'resolution':>10s} {'grid':>12s} {'grid pts/s':>14s} {'speedup':>8s} {'max diff':>10s}")
+    for resolution in resolutions:
+        grid = OffsetGrid(ZHENGZHOU_BBOX, resolution)
+        start = perf_counter()
+        approx = grid.gcj02_to_wgs84(lng, lat)
+        grid_rate = points / (perf_counter() - start)
+        diff = max(float(np.max(np.abs(u - v))) for u, v in zip(exact, approx))
+        shape = f"{grid.shape[0]}x{grid.shape[1]}"
+        print(f"{resolution:10g} {shape:>12s} {grid_rate:14.0f} {grid_rate / exact_rate:7.1f}x {diff:10.2e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="坐标转换性能测试")
+    parser.add_argument("--points", type=int, default=2_000_000)
+    parser.add_argument("--sample", type=int, default=100_000)
+    parser.add_argument("--resolutions", type=float, nargs="+", default=[0.05, 0.01, 0.005, 0.001])
+    args = parser.parse_args()
+    run(args.points, args.sample)
+    run_grid(args.points, args.resolutions)
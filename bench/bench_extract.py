@@ -0,0 +1,150 @@
+# 详情页解析性能测试
+#
+# 对保存的详情页面逐个运行各个解析实现，报告每秒处理的页面数，
+# 并以原始实现（二手房为 parsel，新房为 BeautifulSoup）为准逐字段核对结果。
+#
+#     python bench/bench_extract.py pages/            # pages/old/*.htm 与 pages/new/*.htm
+#     python bench/bench_extract.py --synthetic 200   # 没有保存的页面时，使用生成的页面
+#     python bench/bench_extract.py --archive data/郑州/archive   # 响应存档中 community_info 的页面
+#
+# 页面的布局由所在目录名（old/new）决定，存档中的页面按信息区域的类名判断。
+# 新房的 "lxml" 与爬虫中的用法相同（extract_new），包括结构异常时退回 BeautifulSoup。
+# 生成的新房页面中约 10% 有未闭合的标签。
+
+import argparse
+import json
+import random
+import re
+import sys
+from collections import Counter
+from functools import partial
+from pathlib import Path
+from time import perf_counter
+
+from parsel import Selector
+from w3lib.encoding import html_to_unicode
+
+sys.path.insert(0, str(Path(__file__).parent / ".."))
+
+from project.archive import ResponseArchive
+from project.extract import extract_new, extract_new_bs4, extract_old
+
+
+def extract_old_parsel(html: str):
+    """二手房详情的原始实现（CommunityInfoSpider.parse 中的 response.css 版本）"""
+    info_dict: dict[str, str] = {}
+    village_info = Selector(text=html).css("div.village_info.base_info")
+    for part in village_info:
+        info = part.css("li")
+        for item in info:
+            info_key: str = item.css("li *:first-child::text").get()
+            if info_key is None:
+                continue
+            info_key = re.subn(r"\s", "", info_key)[0]
+            info_value: str = " ".join(item.css("li *:last-child *::text").getall())
+            if info_key in info_dict.keys():
+                info_key += "2"
+            info_dict[info_key] = info_value
+    return info_dict
+
+
+PARSERS = {
+    "old": {"parsel": extract_old_parsel, "lxml": extract_old},
+    "new": {"bs4": extract_new_bs4, "lxml": partial(extract_new, engine="lxml")},
+}
+REFERENCE = {"old": "parsel", "new": "bs4"}
+
+FIELDS = ["物业类别", "建筑类别", "建筑年代", "开发商", "楼盘地址", "小区地址", "总户数", "房屋总数", "停车位", "停车位描述", "物业费", "绿化率", "容积率"]
+
+
+def synthetic_page(layout: str, rng: random.Random):
+    """生成一个结构接近真实页面的详情页，包含无关的导航和脚本"""
+    filler = "".join(
+        f'<div class="nav"><a href="/x/{i}.htm">链接{i}</a><script>var a{i} = {i};</script></div>' for i in range(300)
+    )
+    items = [(name, f"{name}内容 {rng.randint(1, 5000)} 个") for name in rng.sample(FIELDS, 10)]
+    items.append(("停车位", f"地下{rng.randint(100, 900)}个"))
+    if layout == "old":
+        lis = "".join(f"<li><span>{k}</span><p><a>{v}</a></p></li>" for k, v in items)
+        body = f'<div class="village_info base_info"><ul>{lis}</ul></div>'
+    else:
+        unclosed = rng.random() < 0.1
+        lis = "".join(
+            f'<li><div class="list-left">{k}：</div><div class="list-right">{v}<!-- x -->'
+            + ("" if unclosed and i == 0 else "</div>") + "</li>"
+            for i, (k, v) in enumerate(items)
+        )
+        body = f'<div class="main-left"><div class="main-item"><h3>基本信息</h3><ul class="list">{lis}</ul></div></div>'
+    return f"<html><head><title>t</title></head><body>{filler}{body}{filler}</body></html>"
+
+
+def load_archive(directory: Path, corpus: dict[str, list[str]]):
+    """读取响应存档中 community_info 的详情页面"""
+    archive = ResponseArchive(directory)
+    cursor = archive.connection.execute(
+        "SELECT headers, body FROM responses WHERE spider = 'community_info' AND status = 200"
+    )
+    for headers, digest in cursor.fetchall():
+        content_type = dict((k.lower(), v) for k, v in json.loads(headers).items()).get("content-type", [None])[0]
+        html = html_to_unicode(content_type, archive.get_body(digest))[1]
+        if "main-left" in html:
+            corpus["new"].append(html)
+        elif "village_info" in html:
+            corpus["old"].append(html)
+    archive.close()
+
+
+def load_corpus(directory: Path | None, synthetic: int, archive: Path | None = None):
+    corpus: dict[str, list[str]] = {"old": [], "new": []}
+    if directory is not None:
+        for layout in corpus:
+            for path in sorted((directory / layout).glob("*.htm*")):
+                corpus[layout].append(path.read_text(encoding="UTF-8", errors="replace"))
+    if archive is not None:
+        load_archive(archive, corpus)
+    if synthetic > 0:
+        rng = random.Random(0)
+        for layout in corpus:
+            corpus[layout].extend(synthetic_page(layout, rng) for _ in range(synthetic))
+    return corpus
+
+
+def run(corpus: dict[str, list[str]]):
+    for layout, pages in corpus.items():
+        if len(pages) == 0:
+            continue
+        results: dict[str, list] = {}
+        print(f"[{layout}] {len(pages)} 个页面")
+        for name, parser in PARSERS[layout].items():
+            start = perf_counter()
+            results[name] = [parser(page) for page in pages]
+            elapsed = perf_counter() - start
+            print(f"  {name:8s} {len(pages) / elapsed:10.1f} 页/秒")
+        reference = results[REFERENCE[layout]]
+        for name, values in results.items():
+            if name == REFERENCE[layout]:
+                continue
+            mismatched = [i for i, (a, b) in enumerate(zip(reference, values)) if (a or {}) != (b or {})]
+            fields = sum(len(x or {}) for x in reference)
+            print(f"  {name} 与 {REFERENCE[layout]} 不一致的页面: {len(mismatched)}（共 {fields} 个字段）")
+            field_counts = Counter(
+                key
+                for i in mismatched
+                for key in (reference[i] or {}).keys() | (values[i] or {}).keys()
+                if (reference[i] or {}).get(key) != (values[i] or {}).get(key)
+            )
+            for key, count in field_counts.most_common(10):
+                print(f"    {key}: {count} 个页面不一致")
+            for i in mismatched[:5]:
+                print(f"    #{i}: {reference[i]} != {values[i]}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="详情页解析性能测试")
+    parser.add_argument("corpus", nargs="?", type=Path, help="保存的页面目录，包含 old/ 和 new/ 子目录")
+    parser.add_argument("--synthetic", type=int, default=0, help="每种布局额外生成的页面数量")
+    parser.add_argument("--archive", type=Path, help="响应存档目录，例如 data/郑州/archive")
+    args = parser.parse_args()
+    if args.corpus is None and args.archive is None and args.synthetic == 0:
+        args.synthetic = 200
+    run(load_corpus(args.corpus, args.synthetic, args.archive))
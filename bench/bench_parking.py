@@ -0,0 +1,204 @@
+# 停车位描述解析的回归测试与性能测试
+#
+# 回归语料 bench/corpus/parking.jsonl 每行一条停车位描述及期望的解析结果
+# [地上车位数, 地下车位数, 总车位数, 车位配比]。期望结果由 conv_community_shp.ipynb 中的原始实现得到，
+# 语料包括 notebook 输出中的真实描述以及房天下页面上常见的写法。
+#
+#     python bench/bench_parking.py                  # 核对语料并测试每秒处理的行数
+#     python bench/bench_parking.py --rows 1000000 --processes 4
+#     python bench/bench_parking.py --update          # 用原始实现重新生成期望结果
+#
+# 性能测试把语料中的数字随机替换后生成大表，分别用原始实现（逐行 apply）和 post/parking.py 处理，
+# 并确认两者结果相同。
+
+import argparse
+import json
+import random
+import re
+import sys
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent / ".." / "post"))
+
+from parking import PARKING_COLUMNS, clean_parking, parse_parking, parse_parking_column
+
+CORPUS = Path(__file__).parent / "corpus" / "parking.jsonl"
+
+
+def parse_parking_notebook(t):
+    """原始实现（conv_community_shp.ipynb）"""
+    under_num, upper_num, total_num, ratio = (None, None, None, None)
+    upper_regex = re.compile(r"((地上((停)?车位(数|共约?|为)?)?)(：|:)?(\d+)(元)?)|((\d+)((个|左右)?地上))")
+    upper_desc = re.findall(upper_regex, t)
+    if len(upper_desc) > 0:
+        upper_groups = [x for x in upper_desc[-1] if x != ""]
+        if upper_groups[-1] != '元':
+            upper_num = int([x for x in upper_groups if re.match(r"^\d+$", x) is not None][-1])
+    t_reduce = re.subn(upper_regex, "", t)[0]
+    under_desc = re.findall(r"((地下((停)?车位(数|共约?|为)?)?)(：|:)?(\d+)(元)?)|((\d+)((个|左右)?地下))", t_reduce)
+    if len(under_desc) > 0:
+        under_groups = [x for x in under_desc[-1] if x != ""]
+        if under_groups[-1] != '元':
+            under_num = int([x for x in under_groups if re.match(r"^\d+$", x) is not None][-1])
+    total_desc = re.findall(r"(((?<!非机动停车位)(共(有|设)?|(总数：)|约)(\d+))|(小区(共)?有(\d+))|((规划)(机动车|有)?(\d+))|(^(\d{1,})(.)?)|(;(\d+)(.)?)|((?<!非)(机动车停?车?(位|数量?|位数量?)(：|:)?)(\d+))|((?<![上下])停?车位数?(\d+))|((?<![上下])(\d+)个停?车位))(?!(\:|：))", t)
+    if len(total_desc) > 0:
+        total_groups = [x for x in total_desc[-1] if x != ""]
+        if total_groups[-1] != '-' and total_groups[-1] != '.':
+            total_nums = [x for x in total_groups if re.match(r"^\d+$", x) is not None]
+            if len(total_nums) > 0:
+                total_num = int(total_nums[0])
+                if re.search(r"全地下停车位", t) != None:
+                    under_num = total_num
+                elif re.search(r"全地上停车位", t) != None:
+                    upper_num = total_num
+                sum_under_upper = (under_num or 0) + (upper_num or 0)
+                if total_num < sum_under_upper:
+                    total_num = sum_under_upper
+    if total_num is None:
+        if under_num is not None or upper_num is not None:
+            total_num = (under_num or 0) + (upper_num or 0)
+    ratio_desc = re.search(r"(\d+)(：|:)(\d+(.\d+)?)", t)
+    if ratio_desc != None:
+        ratio = re.subn("：", ":", ratio_desc.group())[0]
+    return [upper_num, under_num, total_num, ratio]
+
+
+def clean_parking_notebook(community: pd.DataFrame):
+    """原始实现（conv_community_shp.ipynb 中“筛选需要的变量”一节）
+
+    pandas 3 按行 apply 时会把 pd.NA 转换为 NaN，所以 `x is not pd.NA` 改为 `not pd.isna(x)`。
+    """
+    def parse_properties(t):
+        prop_desc = t.总户数 if not pd.isna(t.总户数) else t.房屋总数
+        if not pd.isna(prop_desc):
+            prop_num_str = re.search(r"\d+", prop_desc)
+            if prop_num_str is not None:
+                return int(prop_num_str.group())
+        return None
+
+    community_park = community[['name', 'district', '停车位', '停车位2', '停车位描述', '建筑类型', '建筑类别', '总户数', '房屋总数', 'lon', 'lat']].copy()
+    community_park['building_type'] = community_park.apply(lambda x: x.建筑类型 if pd.isna(x.建筑类别) else x.建筑类别, axis=1)
+    community_park = community_park.map(lambda x: pd.NA if type(x) == str and re.match("暂无|待定", x) != None else x)
+    community_park['carpark_describe'] = community_park.apply(lambda r: ";".join([re.subn(r'\s', '', x)[0] for x in [r.停车位, r.停车位2, r.停车位描述] if not pd.isna(x)]), axis=1)
+    community_park = community_park.drop(columns=['停车位', '停车位2', '停车位描述', '建筑类型', '建筑类别'])
+    community_park['properties'] = community_park.apply(parse_properties, axis=1).tolist()
+    community_park = community_park.drop(columns=['总户数', '房屋总数'])
+    community_park[PARKING_COLUMNS] = community_park['carpark_describe'].apply(parse_parking_notebook).tolist()
+    return community_park
+
+
+def load_corpus(path: Path = CORPUS):
+    with open(path, encoding="UTF-8") as corpus:
+        return [json.loads(line) for line in corpus if line.strip()]
+
+
+def update_corpus(path: Path = CORPUS):
+    corpus = load_corpus(path)
+    with open(path, "w", encoding="UTF-8") as output:
+        for record in corpus:
+            record["expected"] = parse_parking_notebook(record["text"])
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+    print(f"更新了 {len(corpus)} 条期望结果")
+
+
+def check_corpus(corpus: list[dict]):
+    """逐条核对，返回不一致的数量"""
+    mismatches = 0
+    for record in corpus:
+        result = parse_parking(record["text"])
+        if result != record["expected"]:
+            mismatches += 1
+            print(f"不一致: {record['text']!r} 期望 {record['expected']} 得到 {result}")
+    print(f"语料 {len(corpus)} 条，不一致 {mismatches} 条")
+    return mismatches
+
+
+def vary(text: str, rng: random.Random):
+    """将描述中的数字随机替换，得到新的描述"""
+    return re.sub(r"\d+", lambda m: str(rng.randint(1, 5000)), text)
+
+
+def synthetic_community(corpus: list[dict], rows: int, seed: int = 0):
+    """生成与 community 表结构相同的大表"""
+    rng = random.Random(seed)
+    texts = [x["text"] for x in corpus]
+    missing = ["暂无资料", "待定", pd.NA, pd.NA]
+
+    def pick(p_missing: float):
+        if rng.random() < p_missing:
+            return rng.choice(missing)
+        return vary(rng.choice(texts), rng)
+
+    def column(values):
+        return pd.Series(values, dtype=object)  # 与 notebook 中 replace({np.nan: pd.NA}) 之后的表相同
+
+    return pd.DataFrame({
+        "name": column([f"小区{i}" for i in range(rows)]),
+        "district": column([rng.choice(["金水区", "中原区", "二七区"]) for _ in range(rows)]),
+        "停车位": column([pick(0.1) for _ in range(rows)]),
+        "停车位2": column([pick(0.2) for _ in range(rows)]),
+        "停车位描述": column([pick(0.8) for _ in range(rows)]),
+        "建筑类型": column([rng.choice(["板楼", "塔楼", pd.NA]) for _ in range(rows)]),
+        "建筑类别": column([rng.choice(["板塔结合", pd.NA, pd.NA]) for _ in range(rows)]),
+        "总户数": column([rng.choice([f"{rng.randint(100, 5000)}户", pd.NA, "暂无资料"]) for _ in range(rows)]),
+        "房屋总数": column([rng.choice([f"{rng.randint(100, 5000)}户", pd.NA]) for _ in range(rows)]),
+        "lon": np.random.default_rng(seed).uniform(113.4, 114.0, rows),
+        "lat": np.random.default_rng(seed + 1).uniform(34.6, 35.0, rows),
+    })
+
+
+def same_table(expected: pd.DataFrame, result: pd.DataFrame):
+    """按值比较两张表，缺失值（None/NA/NaN）视为相同"""
+    expected = expected.astype(object).where(expected.notna(), None)
+    result = result.astype(object).where(result.notna(), None)
+    for column in expected.columns:
+        for x, y in zip(expected[column], result[column]):
+            if x != y and not (isinstance(x, (int, float)) and isinstance(y, (int, float)) and float(x) == float(y)):
+                print(f"列 {column} 不一致: {x!r} != {y!r}")
+                return False
+    return list(expected.columns) == list(result.columns)
+
+
+def run(corpus: list[dict], rows: int, processes: int, reference_rows: int):
+    community = synthetic_community(corpus, rows)
+    sample = community.iloc[:reference_rows]
+
+    start = perf_counter()
+    expected = clean_parking_notebook(sample)
+    reference_rate = len(sample) / (perf_counter() - start)
+    print(f"原始实现:     {reference_rate:12.0f} 行/秒（{len(sample)} 行）")
+
+    start = perf_counter()
+    result = clean_parking(sample)
+    print(f"parking.py:   {len(sample) / (perf_counter() - start):12.0f} 行/秒（{len(sample)} 行）")
+    print("结果相同" if same_table(expected, result) else "结果不同")
+
+    for n in sorted({1, processes}):
+        start = perf_counter()
+        clean_parking(community, processes=n)
+        rate = rows / (perf_counter() - start)
+        print(f"parking.py:   {rate:12.0f} 行/秒（{rows} 行，{n} 个进程，{rate / reference_rate:.1f}x）")
+
+    describe = pd.Series([vary(x["text"], random.Random(i)) for i, x in enumerate(corpus * (rows // len(corpus)))])
+    start = perf_counter()
+    parse_parking_column(describe, processes=processes)
+    print(f"仅解析描述:   {len(describe) / (perf_counter() - start):12.0f} 行/秒（{len(describe)} 行，{processes} 个进程）")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="停车位描述解析的回归测试与性能测试")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--reference-rows", type=int, default=20_000, help="原始实现处理的行数")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--update", action="store_true", help="用原始实现重新生成期望结果")
+    args = parser.parse_args()
+    if args.update:
+        update_corpus()
+    else:
+        corpus = load_corpus()
+        if check_corpus(corpus) == 0:
+            run(corpus, args.rows, args.processes, args.reference_rows)
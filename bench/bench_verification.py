@@ -0,0 +1,113 @@
+# 验证页面识别的检查
+#
+# 按 settings.py 中下载中间件的实际顺序（process_response 从高优先级到低优先级），
+# 把构造的响应依次交给 Scrapy 的 HttpCompressionMiddleware 和 VerificationMiddleware，
+# 检查 gzip 压缩的验证页面在解压之后才被识别、正常页面不被误判，并报告每秒检查的响应数。
+#
+#     python bench/bench_verification.py
+#     python bench/bench_verification.py --repeat 2000
+
+import argparse
+import gzip
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+from scrapy import Spider
+from scrapy.http import HtmlResponse, Request
+from scrapy.utils.conf import build_component_list
+from scrapy.utils.misc import load_object
+from scrapy.utils.test import get_crawler
+
+sys.path.insert(0, str(Path(__file__).parent / ".."))
+
+from project import settings as project_settings
+from project.verification import VerificationRequired
+
+COMPRESSION = "scrapy.downloadermiddlewares.httpcompression.HttpCompressionMiddleware"
+VERIFICATION = "project.middlewares.VerificationMiddleware"
+
+
+class CheckSpider(Spider):
+    name = "bench_verification"
+    detect_verification = True
+
+
+def page(title: str, body: str, padding: int):
+    filler = "".join(f'<div class="nav"><a href="/x/{i}.htm">链接{i}</a></div>' for i in range(padding))
+    return f"<html><head><title>{title}</title></head><body>{body}{filler}</body></html>".encode("UTF-8")
+
+
+CASES = [
+    # (名称, 页面, 是否 gzip 压缩, 应识别的原因，None 表示正常页面)
+    ("marker", page("访问验证", "请输入验证码", 200), False, "marker"),
+    ("marker_gzip", page("访问验证", "请输入验证码", 200), True, "marker"),
+    ("short", page("t", "", 0), False, "size"),
+    ("short_gzip", page("t", "", 0), True, "size"),
+    ("normal", page("小区详情", '<ul class="list"><li>物业类别：住宅</li></ul>', 200), False, None),
+    ("normal_gzip", page("小区详情", '<ul class="list"><li>物业类别：住宅</li></ul>', 200), True, None),
+]
+
+
+def middleware_chain(settings: dict):
+    """按 process_response 的调用顺序构造解压和验证页面识别两个中间件"""
+    crawler = get_crawler(CheckSpider, settings)
+    order = build_component_list(crawler.settings.getwithbase("DOWNLOADER_MIDDLEWARES"))
+    chain = [load_object(path).from_crawler(crawler) for path in reversed(order) if path in (COMPRESSION, VERIFICATION)]
+    return chain
+
+
+def check(chain, spider, body: bytes, compressed: bool):
+    """
+    Returns:
+        str: 识别的原因
+        None: 没有识别为验证页面
+    """
+    url = "http://127.0.0.1/house/1/housedetail.htm"
+    headers = {"Content-Type": "text/html; charset=utf-8"}
+    if compressed:
+        body = gzip.compress(body)
+        headers["Content-Encoding"] = "gzip"
+    request = Request(url)
+    response = HtmlResponse(url, body=body, headers=headers, request=request)
+    try:
+        for middleware in chain:
+            response = middleware.process_response(request, response, spider)
+    except VerificationRequired as error:
+        return error.reason
+    return None
+
+
+def run(repeat: int):
+    with tempfile.TemporaryDirectory() as quarantine:
+        settings = {
+            "DOWNLOADER_MIDDLEWARES": project_settings.DOWNLOADER_MIDDLEWARES,
+            "VERIFICATION_ENABLED": True,
+            "VERIFICATION_QUARANTINE_DIR": quarantine,
+            "VERIFICATION_PAUSE": 0,
+            "VERIFICATION_MAX_PAUSE": 0,
+        }
+        chain = middleware_chain(settings)
+        print("process_response 顺序:", " -> ".join(type(x).__name__ for x in chain))
+        spider = CheckSpider()
+        failed = 0
+        for name, body, compressed, expected in CASES:
+            reason = check(chain, spider, body, compressed)
+            ok = reason == expected
+            failed += not ok
+            print(f"  {name:12s} {'通过' if ok else '失败'}  识别结果: {reason}")
+        start = perf_counter()
+        for _ in range(repeat):
+            for _, body, compressed, _ in CASES:
+                check(chain, spider, body, compressed)
+        elapsed = perf_counter() - start
+        print(f"  {repeat * len(CASES) / elapsed:10.1f} 响应/秒")
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="验证页面识别的检查")
+    parser.add_argument("--repeat", type=int, default=200, help="性能测试中每个页面重复的次数")
+    args = parser.parse_args()
+    sys.exit(1 if run(args.repeat) else 0)
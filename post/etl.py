@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+Introduction: 小区详情的流式整理（ETL）
+
+代替 conv_community_info.ipynb 中一次性读入全部数据的做法：按固定大小的块读取小区详情，
+逐块展开 info 字段并写出，内存占用只与块大小有关，与城市数量、数据总量无关。
+
+    python post/etl.py                                  # 读取 data/郑州/items.sqlite3 中 community_info 的数据
+    python post/etl.py --city 洛阳                      # 其他城市
+    python post/etl.py --jsonl community_info.jsonl     # 读取旧版 jsonl
+    python post/etl.py --format csv --chunk-size 5000
+
+输出（默认在城市目录 data/<城市> 中，地理编码爬虫从这里读取 community.csv）：
+
+- community_info.parquet: 每个小区一行，info 中的每项信息一列，没有 info 的小区不输出；
+  没有安装 pyarrow 时输出 community_info.csv；
+- community.csv: 地理编码使用的 uuid, name, address。
+
+uuid 由小区链接生成（uuid5），重复运行得到相同的 uuid，已有的地理编码结果仍然可以连接。
+输出比输入新时跳过，使用 --force 强制重新生成。
+"""
+import argparse
+import csv
+import json
+import logging
+import re
+import sys
+from itertools import islice
+from pathlib import Path
+from uuid import NAMESPACE_URL, uuid5
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+ROOT_DIR = Path(__file__).parent / ".."
+
+sys.path.insert(0, str(ROOT_DIR))
+
+from project.cities import DEFAULT_CITY
+from project.store import ItemStore
+
+logger = logging.getLogger(__name__)
+
+BASE_COLUMNS = ["uuid", "name", "link", "city", "district", "page_on_list"]
+ADDRESS_COLUMNS = ["楼盘地址", "小区地址"]  # 后面的优先
+MAP_SUFFIX = re.compile(r"地图$")
+
+
+def community_uuid(link: str):
+    """由小区链接生成固定的 uuid"""
+    return str(uuid5(NAMESPACE_URL, link))
+
+
+def read_jsonl(path: Path):
+    with open(path, encoding="UTF-8") as file:
+        for line in file:
+            if line.strip() != "":
+                yield json.loads(line)
+
+
+def read_store(path: Path, spider: str = "community_info"):
+    with ItemStore(path) as store:
+        yield from store.items(spider)
+
+
+def chunked(records, size: int):
+    records = iter(records)
+    while chunk := list(islice(records, size)):
+        yield chunk
+
+
+def scan_columns(records):
+    """第一遍扫描：按首次出现的顺序收集 info 中的全部信息名称"""
+    columns: dict[str, None] = {}
+    for record in records:
+        for key in (record.get("info") or {}):
+            columns.setdefault(key, None)
+    return list(columns)
+
+
+def flatten(record: dict):
+    """展开一条小区记录"""
+    row = {
+        "uuid": community_uuid(record["link"]),
+        "name": record.get("name"),
+        "link": record["link"],
+        "city": record.get("city"),
+        "district": record.get("district"),
+        "page_on_list": record.get("page_on_list"),
+    }
+    row.update(record.get("info") or {})
+    return row
+
+
+def community_address(row: dict):
+    address = ""
+    for column in ADDRESS_COLUMNS:
+        if row.get(column):
+            address = row[column]
+    return MAP_SUFFIX.sub("", address).strip()
+
+
+class CsvChunkWriter:
+    def __init__(self, path: Path, columns: list[str]):
+        self.file = open(path, "w", encoding="UTF-8", newline="")
+        self.writer = csv.DictWriter(self.file, fieldnames=columns, extrasaction="ignore")
+        self.writer.writeheader()
+
+    def write(self, rows: list[dict]):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetChunkWriter:
+    """每块数据写为一个 row group"""
+
+    def __init__(self, path: Path, columns: list[str]):
+        self.columns = columns
+        self.schema = pa.schema([
+            (name, pa.int64() if name == "page_on_list" else pa.string()) for name in columns
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+
+    def write(self, rows: list[dict]):
+        table = pa.Table.from_pylist(rows, schema=self.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        self.writer.close()
+
+
+WRITERS = {
+    "csv": CsvChunkWriter,
+    "parquet": ParquetChunkWriter,
+}
+
+
+def is_fresh(outputs: list[Path], sources: list[Path]):
+    """输出都存在且比输入新"""
+    if not all(x.exists() for x in outputs):
+        return False
+    source_time = max((x.stat().st_mtime for x in sources if x.exists()), default=float("inf"))
+    return min(x.stat().st_mtime for x in outputs) > source_time
+
+
+def run(read, sources: list[Path], output_dir: Path, fmt: str, chunk_size: int, force: bool = False):
+    """
+    :param read: 无参数函数，每次调用返回一个新的小区记录迭代器
+    :param sources: 输入文件，用于判断输出是否需要更新
+    :param output_dir: 输出目录
+    :param fmt: 小区详情的输出格式，"parquet" 或 "csv"
+    :param chunk_size: 每块的记录数
+    :param force: 输出比输入新时也重新生成
+    """
+    info_path = output_dir / f"community_info.{fmt}"
+    address_path = output_dir / "community.csv"
+    if not force and is_fresh([info_path, address_path], sources):
+        logger.info("%s 和 %s 已是最新", info_path, address_path)
+        return
+
+    columns = BASE_COLUMNS + scan_columns(read())
+    # 先写入临时文件，中断时不会留下看起来已是最新的半成品
+    info_temp = info_path.with_name(info_path.name + ".tmp")
+    address_temp = address_path.with_name(address_path.name + ".tmp")
+    info_writer = WRITERS[fmt](info_temp, columns)
+    address_writer = CsvChunkWriter(address_temp, ["uuid", "name", "address"])
+    count = 0
+    try:
+        for chunk in chunked(read(), chunk_size):
+            rows = [flatten(x) for x in chunk]
+            address_writer.write([
+                {"uuid": x["uuid"], "name": x["name"], "address": community_address(x)} for x in rows
+            ])
+            info_writer.write([x for x, record in zip(rows, chunk) if record.get("info")])
+            count += len(rows)
+            logger.debug("已处理 %d 条", count)
+    finally:
+        info_writer.close()
+        address_writer.close()
+    info_temp.replace(info_path)
+    address_temp.replace(address_path)
+    logger.info("共 %d 个小区，%d 项信息，输出 %s 和 %s", count, len(columns) - len(BASE_COLUMNS), info_path, address_path)
+
+
+def read_table(path: Path, columns: list[str] | None = None):
+    """读取 run 输出的小区详情"""
+    path = Path(path)
+    if path.suffix == ".parquet":
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_csv(path, usecols=columns, dtype=str, keep_default_na=False, na_values=[""])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="小区详情的流式整理")
+    source = parser.add_mutually_exclusive_group()
+    parser.add_argument("--city", default=DEFAULT_CITY, help="城市，决定默认的数据库和输出目录")
+    source.add_argument("--db", type=Path, help="爬虫数据库，默认为 data/<城市>/items.sqlite3")
+    source.add_argument("--jsonl", type=Path, help="旧版 jsonl 文件")
+    parser.add_argument("--spider", default="community_info", help="读取数据库中哪个爬虫的数据")
+    parser.add_argument("--output-dir", type=Path, help="输出目录，默认为 data/<城市>")
+    parser.add_argument("--format", choices=list(WRITERS), default="parquet" if pq is not None else "csv")
+    parser.add_argument("--chunk-size", type=int, default=2000)
+    parser.add_argument("--force", action="store_true", help="即使输出已是最新也重新生成")
+    args = parser.parse_args()
+    city_dir = ROOT_DIR / "data" / args.city
+    args.db = args.db or city_dir / "items.sqlite3"
+    args.output_dir = args.output_dir or city_dir
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.format == "parquet" and pq is None:
+        parser.error("输出 parquet 需要安装 pyarrow，或者使用 --format csv")
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    if args.jsonl is not None:
+        run(lambda: read_jsonl(args.jsonl), [args.jsonl], args.output_dir, args.format, args.chunk_size, args.force)
+    else:
+        sources = [args.db, args.db.with_name(args.db.name + "-wal")]
+        run(lambda: read_store(args.db, args.spider), sources, args.output_dir, args.format, args.chunk_size, args.force)
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Introduction: 小区停车位、户数描述的解析与清洗
+
+原先写在 conv_community_shp.ipynb 中，逐行 apply 并在每次调用时重新编译正则表达式。
+这里正则表达式只编译一次，表格清洗使用 pandas 的向量化字符串操作；
+停车位描述按不同取值只解析一次，数据量大时可以用多个进程解析。
+
+    from parking import clean_parking, parse_parking_column, parse_properties
+
+回归语料和性能测试见 bench/bench_parking.py。
+"""
+import logging
+import re
+from multiprocessing import Pool
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# 以“暂无”“待定”开头的信息视为缺失
+MISSING_VALUE = r"暂无|待定"
+WHITESPACE = r"\s"
+PROPERTIES_NUMBER = r"(\d+)"
+
+UPPER_REGEX = re.compile(r"((地上((停)?车位(数|共约?|为)?)?)(：|:)?(\d+)(元)?)|((\d+)((个|左右)?地上))")
+UNDER_REGEX = re.compile(r"((地下((停)?车位(数|共约?|为)?)?)(：|:)?(\d+)(元)?)|((\d+)((个|左右)?地下))")
+TOTAL_REGEX = re.compile(
+    r"(((?<!非机动停车位)(共(有|设)?|(总数：)|约)(\d+))|(小区(共)?有(\d+))|((规划)(机动车|有)?(\d+))|(^(\d{1,})(.)?)|(;(\d+)(.)?)"
+    r"|((?<!非)(机动车停?车?(位|数量?|位数量?)(：|:)?)(\d+))|((?<![上下])停?车位数?(\d+))|((?<![上下])(\d+)个停?车位))(?!(\:|：))"
+)
+RATIO_REGEX = re.compile(r"(\d+)(：|:)(\d+(.\d+)?)")
+ALL_UNDER_REGEX = re.compile(r"全地下停车位")
+ALL_UPPER_REGEX = re.compile(r"全地上停车位")
+DIGITS = re.compile(r"\d")
+
+PARKING_COLUMNS = ['park_upper', 'park_under', 'park_total', 'park_ratio']
+CARPARK_COLUMNS = ['停车位', '停车位2', '停车位描述']
+
+
+def last_number(matches):
+    """
+    取最后一个匹配中的最后一个数字，以“元”结尾（价格）时返回 None
+    """
+    groups = [x for x in matches[-1] if x != ""]
+    if groups[-1] == '元':
+        return None
+    return int([x for x in groups if x.isdecimal()][-1])
+
+
+def parse_parking(t: str):
+    """
+    从停车位描述中解析车位数量
+    :param t: 停车位描述，例如 "机动车位总数1540个；其中地上车位数160个，地下车位数1380个"
+    :return: [地上车位数, 地下车位数, 总车位数, 车位配比]，无法解析的项为 None
+    """
+    under_num, upper_num, total_num, ratio = (None, None, None, None)
+    if DIGITS.search(t) is None:
+        return [upper_num, under_num, total_num, ratio]
+    upper_desc = UPPER_REGEX.findall(t)
+    if len(upper_desc) > 0:
+        upper_num = last_number(upper_desc)
+    t_reduce = UPPER_REGEX.sub("", t)
+    under_desc = UNDER_REGEX.findall(t_reduce)
+    if len(under_desc) > 0:
+        under_num = last_number(under_desc)
+    total_desc = TOTAL_REGEX.findall(t)
+    if len(total_desc) > 0:
+        total_groups = [x for x in total_desc[-1] if x != ""]
+        if total_groups[-1] != '-' and total_groups[-1] != '.':
+            total_nums = [x for x in total_groups if x.isdecimal()]
+            if len(total_nums) > 0:
+                total_num = int(total_nums[0])
+                if ALL_UNDER_REGEX.search(t) is not None:
+                    under_num = total_num
+                elif ALL_UPPER_REGEX.search(t) is not None:
+                    upper_num = total_num
+                sum_under_upper = (under_num or 0) + (upper_num or 0)
+                if total_num < sum_under_upper:
+                    total_num = sum_under_upper
+            else:
+                logger.debug("no total: %s", total_groups)
+    if total_num is None:
+        if under_num is not None or upper_num is not None:
+            total_num = (under_num or 0) + (upper_num or 0)
+    ratio_desc = RATIO_REGEX.search(t)
+    if ratio_desc is not None:
+        ratio = ratio_desc.group().replace("：", ":")
+    return [upper_num, under_num, total_num, ratio]
+
+
+def parse_parking_column(describe: pd.Series, processes: int = 1, chunksize: int = 1000):
+    """
+    解析一列停车位描述
+    相同的描述只解析一次（大量小区的描述相同或为空）。
+    :param describe: 停车位描述
+    :param processes: 进程数，大于 1 时使用进程池解析
+    :param chunksize: 进程池每次分发的描述数量
+    :return: 与 describe 索引相同、列为 PARKING_COLUMNS 的 DataFrame
+    """
+    values = describe.dropna().unique().tolist()
+    if processes > 1 and len(values) > chunksize:
+        with Pool(processes) as pool:
+            results = pool.map(parse_parking, values, chunksize=chunksize)
+    else:
+        results = [parse_parking(x) for x in values]
+    table = pd.DataFrame(results, index=values, columns=PARKING_COLUMNS)
+    parsed = table.reindex(describe.to_numpy())
+    parsed.index = describe.index
+    for column in PARKING_COLUMNS[:3]:
+        parsed[column] = parsed[column].astype("Int64")
+    parsed['park_ratio'] = parsed['park_ratio'].astype(object).where(parsed['park_ratio'].notna(), None)
+    return parsed
+
+
+def parse_properties(households: pd.Series, houses: pd.Series):
+    """
+    解析户数，优先使用“总户数”，没有时使用“房屋总数”
+    :param households: 总户数，例如 "2253户"
+    :param houses: 房屋总数
+    :return: 户数（Int64），没有数字时为缺失值
+    """
+    desc = households.combine_first(houses)
+    number = desc.astype("string").str.extract(PROPERTIES_NUMBER, expand=False)
+    return pd.to_numeric(number).astype("Int64")
+
+
+def mask_missing(table: pd.DataFrame):
+    """
+    将以“暂无”“待定”开头的文本替换为缺失值
+    """
+    table = table.copy()
+    for column in table.columns:
+        if pd.api.types.is_numeric_dtype(table[column]):
+            continue
+        missing = table[column].astype("string").str.match(MISSING_VALUE).fillna(False).astype(bool)
+        table.loc[missing, column] = pd.NA
+    return table
+
+
+def join_carpark_describe(table: pd.DataFrame, columns=CARPARK_COLUMNS):
+    """
+    合并多列停车位描述：删除空白字符，跳过缺失值，以 ";" 连接
+    """
+    joined = pd.Series("", index=table.index, dtype=object)
+    for column in columns:
+        values = table[column]
+        part = values.astype("string").str.replace(WHITESPACE, "", regex=True)
+        joined = joined + (";" + part).fillna("").astype(object)
+    return joined.str[1:]
+
+
+def clean_parking(community: pd.DataFrame, processes: int = 1):
+    """
+    从小区信息中整理停车位相关的变量（conv_community_shp.ipynb 中“筛选需要的变量”一节）
+    :param community: 连接了坐标的小区信息
+    :param processes: 解析停车位描述的进程数
+    :return: 包含 name, district, lon, lat, building_type, carpark_describe, properties 与 PARKING_COLUMNS 的表
+    """
+    park = community[['name', 'district', *CARPARK_COLUMNS, '建筑类型', '建筑类别', '总户数', '房屋总数', 'lon', 'lat']].copy()
+    park['building_type'] = park['建筑类别'].where(park['建筑类别'].notna(), park['建筑类型'])
+    park = mask_missing(park)
+    park['carpark_describe'] = join_carpark_describe(park)
+    park = park.drop(columns=[*CARPARK_COLUMNS, '建筑类型', '建筑类别'])
+    park['properties'] = parse_properties(park['总户数'], park['房屋总数'])
+    park = park.drop(columns=['总户数', '房屋总数'])
+    park[PARKING_COLUMNS] = parse_parking_column(park['carpark_describe'], processes=processes)
+    return park
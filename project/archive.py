@@ -0,0 +1,131 @@
+# 响应存档
+#
+# 保存爬取到的每个响应，修改字段提取规则后可以离线重新解析，不必重新爬取：
+#
+#     scrapy reparse community_info -j 8 -s CITY=郑州
+#
+# 存档目录结构：
+#
+# - objects/ab/cdef...: 以 SHA-256 命名、zlib 压缩的响应内容，相同的内容只保存一份；
+# - index.sqlite3: 以请求指纹为键的索引，记录链接、状态码、响应头、请求（含 cb_kwargs）等元数据。
+#
+# 重新解析时，回调 `parse` 对应爬虫的 `parse_items` 方法：它只根据响应提取数据，
+# 不修改爬虫状态，也不产生新的请求。
+
+import json
+import pickle
+import sqlite3
+import zlib
+from hashlib import sha256
+from pathlib import Path
+from time import time
+
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.request import request_from_dict
+
+from project.cities import city_path
+
+ROOT_DIR = Path(__file__).parent / ".."
+
+
+class ResponseArchive:
+    """内容寻址的响应存档"""
+
+    def __init__(self, directory: str | Path, compress_level: int = 6):
+        self.directory = Path(directory)
+        self.objects = self.directory / "objects"
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self.compress_level = compress_level
+        self.connection = sqlite3.connect(self.directory / "index.sqlite3")
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                fingerprint TEXT PRIMARY KEY,
+                spider TEXT NOT NULL,
+                callback TEXT,
+                url TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                body TEXT NOT NULL,
+                request BLOB NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+            """
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_spider ON responses (spider)")
+        self.connection.commit()
+
+    @classmethod
+    def from_settings(cls, settings):
+        """根据 Scrapy 设置打开当前城市的存档，相对路径相对于项目根目录"""
+        return cls(city_path(settings, "ARCHIVE_DIR", "data/{city}/archive"), compress_level=settings.getint("ARCHIVE_COMPRESS_LEVEL", 6))
+
+    def object_path(self, digest: str):
+        return self.objects / digest[:2] / digest[2:]
+
+    def put_body(self, body: bytes):
+        """保存响应内容，返回其 SHA-256"""
+        digest = sha256(body).hexdigest()
+        path = self.object_path(digest)
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            temp_path = path.with_suffix(".tmp")
+            temp_path.write_bytes(zlib.compress(body, self.compress_level))
+            temp_path.replace(path)
+        return digest
+
+    def get_body(self, digest: str):
+        return zlib.decompress(self.object_path(digest).read_bytes())
+
+    def put(self, fingerprint: str, request, response, spider):
+        """保存一个响应，同一个请求指纹只保留最新的响应"""
+        headers = {
+            key.decode("latin1"): [x.decode("latin1") for x in values]
+            for key, values in response.headers.items()
+        }
+        callback = request.callback.__name__ if callable(request.callback) else None
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    fingerprint,
+                    spider.name,
+                    callback,
+                    response.url,
+                    response.status,
+                    json.dumps(headers),
+                    self.put_body(response.body),
+                    pickle.dumps(request.to_dict(spider=spider)),
+                    time()
+                )
+            )
+
+    def fingerprints(self, spider: str):
+        cursor = self.connection.execute("SELECT fingerprint FROM responses WHERE spider = ?", (spider,))
+        return [x for (x,) in cursor]
+
+    def load(self, fingerprint: str, spider):
+        """还原存档中的请求和响应
+
+        Returns:
+            tuple[str, scrapy.Request, scrapy.http.Response]: 回调名称、请求和响应
+        """
+        callback, url, status, headers, body, request = self.connection.execute(
+            "SELECT callback, url, status, headers, body, request FROM responses WHERE fingerprint = ?",
+            (fingerprint,)
+        ).fetchone()
+        request = request_from_dict(pickle.loads(request), spider=spider)
+        headers = Headers(json.loads(headers))
+        body = self.get_body(body)
+        response_cls = responsetypes.from_args(headers=headers, url=url, body=body)
+        response = response_cls(url=url, status=status, headers=headers, body=body, request=request)
+        return callback, request, response
+
+    def count(self, spider: str):
+        (count,) = self.connection.execute("SELECT COUNT(*) FROM responses WHERE spider = ?", (spider,)).fetchone()
+        return count
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,153 @@
+# 爬取进度的检查点
+#
+# 进度由两个文件组成：
+#
+# - progress.json: 快照，通过写临时文件再原子重命名的方式更新；
+# - progress.journal: 追加写入的日志，每行一条 (region_key, page, next) 记录。
+#
+# 恢复时先读取快照，再按顺序重放日志。每条记录都是区域的完整状态，
+# 重复重放不影响结果，所以即使在压缩过程中被强制结束（kill -9），进度仍然正确；
+# 最多丢失尚未写入日志的几条记录，这些页面会被重新爬取。
+#
+# 页面的数据由数据库分批提交（ITEM_STORE_BATCH_SIZE），与日志的写入互不相关。如果进度先于数据落盘，
+# 强制结束后这些页面被认为已完成、却没有数据，之后也不会重新爬取。因此 `wait_for_commit` 时记录先
+# 暂存，收到数据库的 `items_stored` 信号（记录之前输出的数据已经提交）后才进入缓冲区写入日志。
+
+import json
+import os
+from pathlib import Path
+from time import time
+
+
+class ProgressJournal:
+    """列表爬取进度的追加式日志。
+
+    记录先进入缓冲区，当缓冲的记录数达到 `flush_records` 或距离上次写入超过
+    `flush_seconds` 秒时才写入日志文件；日志累计 `compact_records` 条后压缩为快照。
+    `wait_for_commit` 时记录在 `confirm` 之后才进入缓冲区。
+    """
+
+    def __init__(
+        self,
+        directory: str | Path,
+        name: str = "progress",
+        flush_records: int = 20,
+        flush_seconds: float = 30.0,
+        compact_records: int = 1000,
+        wait_for_commit: bool = False
+    ):
+        """
+        Args:
+            directory (str | Path): 进度文件所在目录
+            name (str, optional): 进度文件名（不含扩展名）. Defaults to "progress".
+            flush_records (int, optional): 缓冲多少条记录后写入日志. Defaults to 20.
+            flush_seconds (float, optional): 缓冲最长时间（秒）. Defaults to 30.0.
+            compact_records (int, optional): 日志累计多少条记录后压缩为快照. Defaults to 1000.
+            wait_for_commit (bool, optional): 记录是否等到页面的数据提交到数据库之后才写入日志. Defaults to False.
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        self.snapshot_path = directory / f"{name}.json"
+        self.journal_path = directory / f"{name}.journal"
+        self.flush_records = flush_records
+        self.flush_seconds = flush_seconds
+        self.compact_records = compact_records
+        self.state: dict[str, dict[str, int | str | None]] = {}
+        self.buffer: list[str] = []
+        self.wait_for_commit = wait_for_commit
+        self.unconfirmed: list[str] = []  # 数据尚未提交的记录
+        self.journal_size = 0
+        self.last_flush = time()
+        torn = self.load()
+        self.journal = open(self.journal_path, "a", encoding="UTF-8")
+        if torn:
+            self.compact()  # 不在半行记录之后继续追加
+
+    def load(self):
+        """读取快照并重放日志
+
+        Returns:
+            bool: 日志最后一行是否不完整
+        """
+        if self.snapshot_path.exists():
+            self.state = json.loads(self.snapshot_path.read_text(encoding="UTF-8"))
+        if self.journal_path.exists():
+            with open(self.journal_path, encoding="UTF-8") as journal:
+                for line in journal:
+                    try:
+                        region_key, page, next_link = json.loads(line)
+                    except ValueError:
+                        return True  # 最后一行可能只写了一半
+                    self.state[region_key] = {"page": page, "next": next_link}
+                    self.journal_size += 1
+        return False
+
+    def get(self, region_key: str):
+        """获取区域的进度
+
+        Returns:
+            dict: 包含最后完成的页码 `page` 和下一页链接 `next`
+            None: 该区域还没有开始爬取
+        """
+        return self.state.get(region_key)
+
+    def record(self, region_key: str, page: int, next_link: str | None):
+        """记录某个区域已经完成第 `page` 页，下一页的链接为 `next_link`"""
+        self.state[region_key] = {"page": page, "next": next_link}
+        line = json.dumps([region_key, page, next_link], ensure_ascii=False) + "\n"
+        if self.wait_for_commit:
+            self.unconfirmed.append(line)
+            return
+        self.buffer.append(line)
+        self.flush_if_due()
+
+    def confirm(self, **kwargs):
+        """数据库提交之后调用：之前记录的页面的数据已经落盘，记录可以写入日志
+
+        作为 `items_stored` 信号的处理函数时忽略信号参数。
+        """
+        if len(self.unconfirmed) == 0:
+            return
+        self.buffer.extend(self.unconfirmed)
+        self.unconfirmed.clear()
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        if len(self.buffer) >= self.flush_records or time() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        """将缓冲区写入日志文件，必要时压缩"""
+        self.last_flush = time()
+        if len(self.buffer) == 0:
+            return
+        self.journal.write("".join(self.buffer))
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.journal_size += len(self.buffer)
+        self.buffer.clear()
+        if self.journal_size >= self.compact_records:
+            self.compact()
+
+    def compact(self):
+        """将当前状态写入快照，然后清空日志
+
+        快照先写入临时文件再原子重命名；重命名之后才清空日志，
+        两步之间被中断时重放旧日志也会得到同样的状态。
+        """
+        temp_path = self.snapshot_path.with_suffix(".json.tmp")
+        with open(temp_path, "w", encoding="UTF-8") as temp:
+            temp.write(json.dumps(self.state, ensure_ascii=False, indent=2))
+            temp.flush()
+            os.fsync(temp.fileno())
+        os.replace(temp_path, self.snapshot_path)
+        self.journal.close()
+        self.journal = open(self.journal_path, "w", encoding="UTF-8")
+        self.journal_size = 0
+
+    def close(self):
+        """在数据库关闭之后调用，此时所有数据都已提交"""
+        self.confirm()
+        self.flush()
+        self.compact()
+        self.journal.close()
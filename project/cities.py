@@ -0,0 +1,127 @@
+# 多城市爬取
+#
+# targets.csv 的每一行是某个城市某个区域的小区列表（新房或二手房），city 列为城市名称，
+# 高德地理编码也使用这个名称限定搜索范围。没有 city 列的旧版 targets.csv 视为 DEFAULT_CITY。
+#
+# 每次爬取只处理设置 CITY 指定的一个城市（例如 `scrapy crawl community_list -s CITY=洛阳`），
+# 数据库、进度、Parquet、小区地址和待爬取队列按城市分片：路径设置中的 `{city}` 替换为城市名称，
+# 例如 ITEM_STORE_PATH = "data/{city}/items.sqlite3"，单个文件的大小只与一个城市的数据量有关。
+#
+# 多个城市在同一个进程中并发爬取（`scrapy crawl_cities <spider>`，见 project.commands.crawl_cities），
+# 同一进程中的爬虫共享礼貌延迟的时间槽、全局速率预算 CRAWL_RATE_LIMIT 和高德 Key 的 QPS。
+
+import csv
+import re
+from dataclasses import dataclass
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent / ".."
+
+DEFAULT_CITY = "郑州"
+
+# 列表页链接的模式：二手房 /housing/14871__0_3_0_0_<页码>_0_0_0/，新房 /house/s/jinshui/b9<页码>/
+OLD_LIST_PATTERN = re.compile(r"^(?P<head>.+/housing/\d+__(?:\d+_){4})\d+(?P<tail>(?:_\d+){3}/?)$")
+NEW_LIST_PATTERN = re.compile(r"^(?P<head>.+/house/s/[^/]+/)(?:b9\d+/)?$")
+
+
+@dataclass(slots=True)
+class RegionTarget:
+    """targets.csv 中的一行：一个城市中一个区域的小区列表"""
+    city: str
+    region: str
+    url: str
+    en_name: str
+    page_nb: int
+    community_nb: int
+    type: str
+
+    @property
+    def key(self):
+        """区域的键，例如 "金水区_old"，用于进度和小区数据的 district 字段"""
+        return f"{self.region}_{self.type}"
+
+    def page_url(self, page: int):
+        """按链接模式生成第 `page` 页的链接
+
+        Returns:
+            str: 列表页链接
+            None: 链接不符合已知的模式，只能跟随“下一页”链接
+        """
+        match = OLD_LIST_PATTERN.match(self.url)
+        if match is not None:
+            return f"{match['head']}{page}{match['tail']}"
+        match = NEW_LIST_PATTERN.match(self.url)
+        if match is not None:
+            return match["head"] if page == 1 else f"{match['head']}b9{page}/"
+        return None
+
+    def expected_count(self, page: int, page_size: int):
+        """第 `page` 页应有的小区数量：最后一页是 community_nb 的余数，超出 page_nb 的页面未知（0）"""
+        if page < self.page_nb:
+            return page_size
+        if page == self.page_nb:
+            return min(page_size, max(1, self.community_nb - page_size * (self.page_nb - 1)))
+        return 0
+
+
+def current_city(settings):
+    return settings.get("CITY") or DEFAULT_CITY
+
+
+def project_path(value: str | Path):
+    """相对路径相对于项目根目录"""
+    path = Path(value)
+    if not path.is_absolute():
+        path = ROOT_DIR / path
+    return path
+
+
+def city_path(settings, name: str, default: str):
+    """读取路径设置，将其中的 `{city}` 替换为当前城市
+
+    Args:
+        settings: Scrapy 设置
+        name (str): 设置名称，例如 "ITEM_STORE_PATH"
+        default (str): 没有这项设置时使用的路径
+
+    Returns:
+        Path: 路径，相对路径相对于项目根目录
+    """
+    return project_path(str(settings.get(name) or default).format(city=current_city(settings)))
+
+
+def load_targets(path: str | Path, city: str | None = None):
+    """读取 targets.csv
+
+    Args:
+        path (str | Path): 文件路径
+        city (str | None, optional): 只返回这个城市的区域，None 表示全部城市. Defaults to None.
+
+    Returns:
+        list[RegionTarget]: 区域，顺序与文件中相同
+    """
+    targets = []
+    with open(path, encoding="UTF-8", newline="") as file:
+        for row in csv.DictReader(file):
+            target = RegionTarget(
+                city=(row.get("city") or DEFAULT_CITY).strip(),
+                region=row["region"].strip(),
+                url=row["url"].strip(),
+                en_name=row["en_name"].strip(),
+                page_nb=int(row["page_nb"]),
+                community_nb=int(row["community_nb"]),
+                type=row["type"].strip(),
+            )
+            if city is None or target.city == city:
+                targets.append(target)
+    return targets
+
+
+def targets_from_settings(settings, city: str | None = None):
+    """按设置 TARGETS_PATH 读取当前城市（或指定城市）的区域"""
+    return load_targets(project_path(settings.get("TARGETS_PATH") or "targets.csv"), city or current_city(settings))
+
+
+def list_cities(path: str | Path):
+    """targets.csv 中的全部城市，按第一次出现的顺序"""
+    return list(dict.fromkeys(x.city for x in load_targets(path)))
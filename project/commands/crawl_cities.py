@@ -0,0 +1,66 @@
+# 在同一个进程中并发爬取多个城市
+#
+#     scrapy crawl_cities community_list                        # targets.csv 中的全部城市
+#     scrapy crawl_cities community_info --cities 郑州,洛阳 -a window=4
+#     scrapy crawl_cities community_info --parallel 8 -s CRAWL_RATE_LIMIT=6
+#
+# 每个城市一个爬虫（设置 CITY 不同），数据、进度和待爬取队列按城市分片（见 project.cities）。
+# 同一进程中的爬虫共享礼貌延迟的时间槽、全局速率预算 CRAWL_RATE_LIMIT 和高德 Key 的 QPS，
+# 同时爬取的城市数量由 --parallel 限制，一个城市结束后开始下一个。
+
+from scrapy.commands import BaseRunSpiderCommand
+from scrapy.crawler import Crawler
+from scrapy.exceptions import UsageError
+
+from project.cities import list_cities, project_path
+
+
+class Command(BaseRunSpiderCommand):
+    requires_project = True
+
+    def syntax(self):
+        return "[options] <spider>"
+
+    def short_desc(self):
+        return "Run a spider for several cities of targets.csv concurrently, sharing the politeness budget"
+
+    def add_options(self, parser):
+        BaseRunSpiderCommand.add_options(self, parser)
+        parser.add_argument("--cities", help="comma-separated cities, defaults to all cities in targets.csv")
+        parser.add_argument("--parallel", type=int, default=0, help="cities crawled at the same time, 0 = all")
+
+    def run(self, args, opts):
+        if len(args) != 1:
+            raise UsageError()
+        spidercls = self.crawler_process.spider_loader.load(args[0])
+        known = list_cities(project_path(self.settings.get("TARGETS_PATH") or "targets.csv"))
+        cities = [x.strip() for x in opts.cities.split(",") if x.strip()] if opts.cities else known
+        unknown = [x for x in cities if x not in known]
+        if unknown:
+            raise UsageError(f"Cities not in targets.csv: {', '.join(unknown)}", print_help=False)
+        if len(cities) == 0:
+            raise UsageError("No cities to crawl", print_help=False)
+
+        pending = list(cities)
+        parallel = opts.parallel if opts.parallel > 0 else len(cities)
+        init_reactor = True  # 只有第一个爬虫安装 reactor
+
+        def start_next(result=None):
+            '''一个城市结束后开始下一个，返回原来的结果
+            '''
+            nonlocal init_reactor
+            if pending:
+                city = pending.pop(0)
+                settings = self.settings.copy()
+                settings.set("CITY", city, priority="cmdline")
+                crawler = Crawler(spidercls, settings, init_reactor=init_reactor)
+                init_reactor = False
+                print(f"{args[0]}: 开始爬取 {city}")
+                self.crawler_process.crawl(crawler, **opts.spargs).addBoth(start_next)
+            return result
+
+        for _ in range(min(parallel, len(cities))):
+            start_next()
+        self.crawler_process.start()
+        if self.crawler_process.bootstrap_failed:
+            self.exitcode = 1
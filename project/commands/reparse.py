@@ -0,0 +1,100 @@
+# 离线重新解析存档中的响应
+#
+#     scrapy reparse community_info -j 8 -s CITY=洛阳
+#     scrapy reparse community_list -O community_list.jsonl
+#
+# 存档中的响应被分块交给多个进程，每个进程调用爬虫的 `parse_items` 方法提取数据，
+# 结果默认写回数据库（覆盖同一个键的旧数据），也可以写入 jsonl 文件。
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+
+from itemadapter import ItemAdapter
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+from scrapy.settings import Settings
+from scrapy.spiderloader import SpiderLoader
+
+from project.archive import ResponseArchive
+from project.store import ItemStore
+
+
+def reparse_chunk(settings: dict, spider_name: str, fingerprints: list[str]):
+    """在子进程中重新解析一批响应
+
+    Returns:
+        list[dict]: 提取出的数据
+    """
+    settings = Settings(settings)
+    spidercls = SpiderLoader.from_settings(settings).load(spider_name)
+    spider = spidercls()
+    spider.settings = settings
+    archive = ResponseArchive.from_settings(settings)
+    items = []
+    try:
+        for fingerprint in fingerprints:
+            callback, request, response = archive.load(fingerprint, spider)
+            parse_items = getattr(spider, f"{callback}_items", None)
+            if parse_items is None:
+                continue
+            for item in parse_items(response, **request.cb_kwargs):
+                items.append(ItemAdapter(item).asdict())
+    finally:
+        archive.close()
+    return items
+
+
+class Command(ScrapyCommand):
+    requires_project = True
+    default_settings = {"LOG_ENABLED": False}
+
+    def syntax(self):
+        return "[options] <spider>"
+
+    def short_desc(self):
+        return "Re-run a spider's parse callbacks over the response archive, without network"
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+        parser.add_argument("--chunk-size", type=int, default=200, help="responses per worker task")
+        parser.add_argument("-O", "--output", help="write items to this jsonl file instead of the item store")
+
+    def run(self, args, opts):
+        if len(args) != 1:
+            raise UsageError()
+        spider_name = args[0]
+        spidercls = self.crawler_process.spider_loader.load(spider_name)
+        if not hasattr(spidercls, "parse_items"):
+            raise UsageError(f"Spider {spider_name} does not support re-parsing (no parse_items method)")
+
+        archive = ResponseArchive.from_settings(self.settings)
+        fingerprints = archive.fingerprints(spider_name)
+        archive.close()
+        chunks = [fingerprints[i:i + opts.chunk_size] for i in range(0, len(fingerprints), opts.chunk_size)]
+        print(f"{spider_name}: {len(fingerprints)} responses in archive, {len(chunks)} chunks, {opts.jobs} workers")
+
+        start = perf_counter()
+        count = 0
+        settings = self.settings.copy_to_dict()
+        if opts.output:
+            output = open(opts.output, "w", encoding="UTF-8")
+        else:
+            store = ItemStore.from_settings(self.settings)
+        with ProcessPoolExecutor(max_workers=opts.jobs) as executor:
+            futures = [executor.submit(reparse_chunk, settings, spider_name, chunk) for chunk in chunks]
+            for future in as_completed(futures):
+                for item in future.result():
+                    if opts.output:
+                        output.write(json.dumps(item, ensure_ascii=False) + "\n")
+                    else:
+                        store.put(spider_name, str(item[getattr(spidercls, "item_key", "link")]), item)
+                    count += 1
+        if opts.output:
+            output.close()
+        else:
+            store.close()
+        elapsed = perf_counter() - start
+        print(f"{count} items in {elapsed:.1f}s ({len(fingerprints) / max(elapsed, 1e-9):.0f} responses/s)")
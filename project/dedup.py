@@ -0,0 +1,85 @@
+# 跨列表的小区去重
+#
+# 同一个小区可能出现在多个区、多个列表页中。在爬取详情页之前按链接中的小区编号 cid
+# （get_url_house_detail 使用的编号）合并重复的小区，每组只爬取一个详情页。
+#
+# 只合并编号相同的小区。二手房（_old）和新房（_new）列表使用不同的编号，同一个小区在两个列表中
+# 各爬取一次：列表页中只有小区名称和链接，没有地址，而只按名称匹配会把同一个区中同名的一期、二期
+# 等不同的小区合并。每组保留的小区按以下顺序选择：
+# 已经爬取过的小区（不需要再爬取）、二手房列表中的小区（详情更完整）、链接排序靠前的小区。
+
+from dataclasses import dataclass, field
+from typing import Any, Callable, Generic, Iterable, TypeVar
+
+T = TypeVar("T")
+
+
+def community_cid(link: str):
+    """小区链接中的编号，例如 "/loupan/2510123456.htm" -> "2510123456" """
+    index_file = link.rstrip("/").split("/")[-1]
+    return index_file.split(".")[0]
+
+
+def fingerprints(link: str):
+    """小区的指纹
+
+    Args:
+        link (str): 小区链接
+
+    Returns:
+        list[str]: 指纹，任意一个相同即视为同一个小区；链接中没有编号时为空，不与其他小区合并
+    """
+    cid = community_cid(link)
+    return [f"cid:{cid}"] if cid.isdigit() else []
+
+
+@dataclass
+class DedupResult(Generic[T]):
+    """去重结果"""
+    kept: list[T] = field(default_factory=list)
+    duplicates: dict[str, str] = field(default_factory=dict)  # 重复小区的键 -> 保留小区的键
+    saved: int = 0  # 节省的请求数量，即尚未完成的重复目标数量
+
+
+def deduplicate(
+    targets: Iterable[T],
+    key: Callable[[T], str],
+    fingerprint: Callable[[T], list[str]],
+    finished: set[str] = frozenset(),
+    preference: Callable[[T], Any] = lambda x: 0
+):
+    """合并重复的目标
+
+    Args:
+        targets (Iterable[T]): 全部目标
+        key (Callable[[T], str]): 目标的唯一键，与 Frontier 相同
+        fingerprint (Callable[[T], list[str]]): 目标的指纹，任意一个指纹相同即视为重复
+        finished (set[str], optional): 已经完成的目标的键，优先保留. Defaults to frozenset().
+        preference (Callable[[T], Any], optional): 其他情况下的优先顺序，越小越优先. Defaults to lambda x: 0.
+
+    Returns:
+        DedupResult[T]: 保留的目标（保持原来的顺序）以及重复目标到保留目标的映射
+    """
+    targets = list(targets)
+    ranked = sorted(
+        range(len(targets)),
+        key=lambda i: (key(targets[i]) not in finished, preference(targets[i]), key(targets[i]))
+    )
+    owners: dict[str, str] = {}  # 指纹 -> 保留目标的键
+    kept_index: list[int] = []
+    result: DedupResult[T] = DedupResult()
+    for i in ranked:
+        target_key = key(targets[i])
+        keys = fingerprint(targets[i])
+        owner = next((owners[x] for x in keys if x in owners), None)
+        if owner is None:
+            owner = target_key
+            kept_index.append(i)
+        elif owner != target_key:
+            result.duplicates[target_key] = owner
+            if target_key not in finished:
+                result.saved += 1
+        for x in keys:
+            owners.setdefault(x, owner)
+    result.kept = [targets[i] for i in sorted(kept_index)]
+    return result
@@ -0,0 +1,223 @@
+# 小区详情页面的信息提取
+#
+# 二手房（_old）和新房（_new）详情页的布局不同，这里为每种布局提供提取函数，
+# 输入为 HTML 文本，输出为 {信息名称: 信息内容} 字典，重复的名称加后缀 "2"。
+# 提取函数只依赖 HTML 文本，爬虫、离线重新解析、解析进程池（project.offload）和性能测试
+# （bench/bench_extract.py）共用。列表页的提取函数是 `extract_list`。
+#
+# 新房页面有两个实现：
+#
+# - "bs4": 原始实现，BeautifulSoup + html.parser 解析整个文档，默认使用；
+# - "lxml": 使用 libxml2 解析并模拟 BeautifulSoup 的子节点和字符串语义，速度快得多。
+#
+# libxml2 同样能容错解析有错误的 HTML，但修复错误的方式与 html.parser 不同：例如 `<li>` 中未闭合的
+# `<div class="list-right">` 会把后面的 `<li>` 都包含进去，该字段的值变成后面所有字段拼接的文本。
+# 所以当 "lxml" 找不到信息区域、没有提取到任何信息，或者信息列表的结构异常（`<li>` 中嵌套 `<li>`）时，
+# 自动退回 "bs4"。在真实页面上逐字段核对两者一致之前（`python bench/bench_extract.py --archive`），
+# 默认使用 "bs4"（设置 HTML_EXTRACTOR）。
+
+import re
+
+from bs4 import BeautifulSoup
+from lxml import etree
+from parsel import Selector
+from parsel.csstranslator import HTMLTranslator
+
+WHITESPACE = re.compile(r"\s")
+KEY_IGNORED = re.compile(r"[\s\n：]")
+# BeautifulSoup 的 stripped_strings 不包含这些元素中的文本
+SKIPPED_TAGS = {"script", "style", "template"}
+
+
+def css_xpath(css: str):
+    """将 CSS 选择器（支持 parsel 的 ::text）编译为 XPath，与 response.css 的语义相同"""
+    return etree.XPath(HTMLTranslator().css_to_xpath(css), smart_strings=False)
+
+
+OLD_BLOCKS = css_xpath("div.village_info.base_info")
+OLD_ITEMS = css_xpath("li")
+OLD_KEY = css_xpath("li *:first-child::text")
+OLD_VALUE = css_xpath("li *:last-child *::text")
+
+
+def parse_html(html: str):
+    """与 parsel.Selector 相同的方式解析 HTML"""
+    body = html.strip().replace("\x00", "").encode("utf8") or b"<html/>"
+    parser = etree.HTMLParser(recover=True, encoding="utf8")
+    return etree.fromstring(body, parser=parser)
+
+
+def add_info(info_dict: dict[str, str], info_key: str, info_value: str):
+    if info_key in info_dict.keys():
+        info_key += "2"
+    info_dict[info_key] = info_value
+
+
+def extract_old(html: str):
+    """提取二手房小区详情（div.village_info.base_info 布局）"""
+    info_dict: dict[str, str] = {}
+    root = parse_html(html)
+    for part in OLD_BLOCKS(root):
+        for item in OLD_ITEMS(part):
+            keys = OLD_KEY(item)
+            if len(keys) == 0:
+                continue
+            info_key: str = WHITESPACE.subn("", keys[0])[0]
+            info_value: str = " ".join(OLD_VALUE(item))
+            add_info(info_dict, info_key, info_value)
+    return info_dict
+
+
+def extract_new_bs4(html: str):
+    """提取新房小区详情，原始的 BeautifulSoup 实现
+
+    Returns:
+        dict[str, str]: 小区信息
+        None: 页面中没有信息区域
+    """
+    info_dict: dict[str, str] = {}
+    soup = BeautifulSoup(html, "html.parser")
+    main_left = soup.find("div", class_="main-left")
+    if main_left is None:
+        return None
+    blocks = main_left.find_all("div", class_="main-item")
+    blocks_list = [x for x in [x.find("ul", class_="list") for x in blocks] if x is not None]
+    for block in blocks_list:
+        infos = block.find_all("li")
+        for item in infos:
+            children = list(item.children)
+            if len(children) < 2:
+                continue
+            key_elem, value_elem = children[:2]
+            info_key, _ = KEY_IGNORED.subn("", "".join(key_elem.stripped_strings))  # 将空白字符 (\s) 或者中文冒号 (：) 替换为空字符串
+            info_value = " ".join(value_elem.stripped_strings)  # 保留一个空格，以便于后期处理数据
+            add_info(info_dict, info_key, info_value)
+    return info_dict
+
+
+def has_class(element, name: str):
+    return name in (element.get("class") or "").split()
+
+
+def element_strings(element, root: bool = True):
+    """按 BeautifulSoup 的规则遍历元素中的文本：跳过注释以及 script/style/template 中的文本"""
+    if not isinstance(element.tag, str):
+        return  # 注释和处理指令
+    if root or element.tag not in SKIPPED_TAGS:
+        if element.text:
+            yield element.text
+        for child in element:
+            yield from element_strings(child, root=False)
+            if child.tail:
+                yield child.tail
+
+
+def node_stripped_strings(node):
+    if isinstance(node, str):
+        node = node.strip()
+        return [node] if node else []
+    return [x.strip() for x in element_strings(node) if x.strip()]
+
+
+def child_nodes(element):
+    """与 BeautifulSoup 的 Tag.children 相同，文本也是子节点"""
+    if element.text:
+        yield element.text
+    for child in element:
+        yield child
+        if child.tail:
+            yield child.tail
+
+
+def extract_new_lxml(html: str):
+    """提取新房小区详情，libxml2 实现
+
+    Returns:
+        dict[str, str]: 小区信息
+        None: 页面中没有信息区域，或者信息列表的结构异常，需要使用 BeautifulSoup 重新提取
+    """
+    info_dict: dict[str, str] = {}
+    root = parse_html(html)
+    main_left = next((x for x in root.iter("div") if has_class(x, "main-left")), None)
+    if main_left is None:
+        return None
+    for block in main_left.iter("div"):
+        if block is main_left or not has_class(block, "main-item"):
+            continue
+        ul = next((x for x in block.iter("ul") if has_class(x, "list")), None)
+        if ul is None:
+            continue
+        for item in ul.iter("li"):
+            if any(x is not item for x in item.iter("li")):
+                ''' 未闭合的标签被修复为嵌套的 <li>，与 html.parser 的结果不同
+                '''
+                return None
+            children = []
+            for node in child_nodes(item):
+                children.append(node)
+                if len(children) == 2:
+                    break
+            if len(children) < 2:
+                continue
+            key_elem, value_elem = children
+            info_key, _ = KEY_IGNORED.subn("", "".join(node_stripped_strings(key_elem)))
+            info_value = " ".join(node_stripped_strings(value_elem))
+            add_info(info_dict, info_key, info_value)
+    return info_dict
+
+
+NEW_EXTRACTORS = {
+    "bs4": extract_new_bs4,
+    "lxml": extract_new_lxml,
+}
+
+
+def extract_new(html: str, engine: str = "bs4"):
+    """提取新房小区详情，快速实现失败或者页面结构异常时退回 BeautifulSoup"""
+    info_dict = NEW_EXTRACTORS[engine](html)
+    if not info_dict and engine != "bs4":
+        info_dict = extract_new_bs4(html)
+    return info_dict or {}
+
+
+def extract_info(html: str, district: str, engine: str = "bs4"):
+    """根据小区所在区域的类型提取详情
+
+    Args:
+        html (str): 详情页面 HTML
+        district (str): 区域名称，以 "old" 或 "new" 结尾
+        engine (str, optional): 新房页面的解析实现，"bs4" 或 "lxml". Defaults to "bs4".
+
+    Returns:
+        dict[str, str]: 小区信息
+    """
+    if district.endswith("old"):
+        return extract_old(html)
+    elif district.endswith("new"):
+        return extract_new(html, engine)
+    return {}
+
+
+def extract_list(html: str, region_type: str):
+    """提取小区列表页中的小区和“下一页”链接
+
+    Args:
+        html (str): 列表页面 HTML
+        region_type (str): 区域类型，"old" 或 "new"
+
+    Returns:
+        tuple[list[tuple[str, str]], str | None]: 小区名称和链接，以及下一页的链接（没有下一页时为 None）
+    """
+    selector = Selector(text=html)
+    if region_type == "old":
+        house_list = selector.css("div.houseList a.plotTit")
+        pagers = selector.css("div.fanye a")
+    elif region_type == "new":
+        house_list = selector.css("div.nhouse_list div.nlcd_name a")
+        pagers = selector.css("div.page li.fr a")
+    else:
+        return [], None
+    communities = [(x.css("::text").get(), x.css("::attr(href)").get()) for x in house_list]
+    next_page = [p for p in pagers if len(p.re("下一页")) > 0]
+    next_link = next_page[0].css("::attr(href)").get() if len(next_page) > 0 else None
+    return communities, next_link
@@ -0,0 +1,96 @@
+# 待爬取目标队列（frontier）
+#
+# 替代原先在 pd.DataFrame 上用布尔掩码查找下一个目标的做法：
+# 目标只在加载时过滤一次，之后取出、完成、重新排队都是 O(1) 操作。
+
+from collections import OrderedDict
+from typing import Callable, Generic, Iterable, TypeVar
+
+T = TypeVar("T")
+
+
+class Frontier(Generic[T]):
+    """待爬取目标队列。
+
+    每个目标有一个唯一的键（小区链接或 uuid），目标处于以下三种状态之一：
+
+    - 等待（pending）：按加入顺序排队，`pop` 从队首取出；
+    - 在途（in flight）：已经发出请求、尚未返回；
+    - 完成（finished）：已经爬取，或者在恢复进度时从已有数据中读取。
+
+    响应乱序返回时，只需要按键调用 `done`，不依赖请求顺序。
+    """
+
+    def __init__(self, key: Callable[[T], str]):
+        """
+        Args:
+            key (Callable[[T], str]): 从目标中取出唯一键的函数
+        """
+        self.key = key
+        self.pending: OrderedDict[str, T] = OrderedDict()
+        self.in_flight: dict[str, T] = {}
+        self.finished: set[str] = set()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def __contains__(self, key: str):
+        return key in self.pending or key in self.in_flight
+
+    @property
+    def in_flight_count(self):
+        return len(self.in_flight)
+
+    def add(self, target: T):
+        """将目标加入队尾
+
+        Returns:
+            bool: 如果目标已完成或者已在队列中，返回 False
+        """
+        key = self.key(target)
+        if key in self.finished or key in self:
+            return False
+        self.pending[key] = target
+        return True
+
+    def extend(self, targets: Iterable[T]):
+        """批量加入目标
+
+        Returns:
+            int: 实际加入的目标数量
+        """
+        return sum(1 for target in targets if self.add(target))
+
+    def pop(self):
+        """取出队首目标并标记为在途
+
+        Returns:
+            T: 下一个目标
+            None: 没有等待中的目标时，返回 None
+        """
+        if len(self.pending) == 0:
+            return None
+        key, target = self.pending.popitem(last=False)
+        self.in_flight[key] = target
+        return target
+
+    def done(self, key: str):
+        """标记目标已完成，无论它处于等待还是在途状态"""
+        self.pending.pop(key, None)
+        self.in_flight.pop(key, None)
+        self.finished.add(key)
+
+    def requeue(self, key: str):
+        """将在途目标放回队尾，以便稍后重试"""
+        target = self.in_flight.pop(key, None)
+        if target is not None:
+            self.pending[key] = target
+
+    def drop(self, key: str):
+        """本次运行放弃目标：不再爬取，但不标记为完成，下次运行时重新加入"""
+        self.pending.pop(key, None)
+        self.in_flight.pop(key, None)
+
+    def close(self):
+        """爬虫结束时调用，共享队列（见 project.sharedfrontier）在这里释放未完成的目标"""
+        pass
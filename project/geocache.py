@@ -0,0 +1,132 @@
+# 地理编码结果的持久化缓存
+#
+# 以 (城市, 规范化地址) 为键保存高德的编码结果，重复运行、重新爬取的小区
+# 以及不同小区共用同一地址时，都不再消耗接口配额。
+#
+# 只有得到经纬度的结果长期有效。没有编码结果的地址（经纬度为空）只在 `negative_ttl` 内视为命中，
+# 默认不缓存，交给爬虫的失败重试；批量响应中缺失的结果不是接口的回答，爬虫不会写入缓存。
+
+import json
+import re
+import sqlite3
+import unicodedata
+from pathlib import Path
+from time import time
+from typing import Any
+
+# 规范化时删除的字符：空白和常见的中英文标点
+IGNORED_CHARS = re.compile(r"[\s,，.。、;；:：'\"‘’“”()（）\[\]【】<>《》\-—_·]")
+
+
+def normalize_address(address: str):
+    """规范化地址，使写法上只有细微差别的地址得到同一个键
+
+    全角字符转为半角，删除空白和标点，去掉结尾的“地图”字样。
+    """
+    address = unicodedata.normalize("NFKC", address)
+    address = re.sub(r"地图$", "", address.strip())
+    return IGNORED_CHARS.sub("", address).lower()
+
+
+class GeocodeCache:
+    """SQLite 地理编码缓存。
+
+    `ttl` 大于 0 时，超过 `ttl` 秒的结果视为过期。
+    没有编码结果的地址（经纬度为空）超过 `negative_ttl` 秒视为过期，`negative_ttl` 为 0 时不缓存。
+    """
+
+    def __init__(self, path: str | Path, ttl: float = 0, negative_ttl: float = 0):
+        """
+        Args:
+            path (str | Path): 数据库文件路径
+            ttl (float, optional): 结果有效期（秒），0 表示永不过期. Defaults to 0.
+            negative_ttl (float, optional): 没有编码结果的地址的有效期（秒），0 表示不缓存. Defaults to 0.
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS geocodes (
+                city TEXT NOT NULL,
+                address TEXT NOT NULL,
+                lon REAL,
+                lat REAL,
+                level TEXT,
+                raw TEXT,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (city, address)
+            ) WITHOUT ROWID
+            """
+        )
+        self.connection.commit()
+
+    @classmethod
+    def from_settings(cls, settings, root_dir: Path):
+        path = Path(settings.get("GEOCODE_CACHE_PATH", "geocache.sqlite3"))
+        if not path.is_absolute():
+            path = root_dir / path
+        return cls(
+            path,
+            ttl=settings.getfloat("GEOCODE_CACHE_TTL", 0) * 86400,
+            negative_ttl=settings.getfloat("GEOCODE_CACHE_NEGATIVE_TTL", 0) * 3600
+        )
+
+    def expired(self, lon: float | None, created_at: float):
+        """结果是否已过期，没有编码结果的地址使用 `negative_ttl`"""
+        if lon is None:
+            return created_at < time() - self.negative_ttl
+        return self.ttl > 0 and created_at < time() - self.ttl
+
+    def get(self, city: str, address: str):
+        """查询缓存
+
+        Returns:
+            dict: 包含 lon, lat, level, raw 的编码结果，没有编码结果时 lon 和 lat 为 None
+            None: 没有缓存或已过期
+        """
+        row = self.connection.execute(
+            "SELECT lon, lat, level, raw, created_at FROM geocodes WHERE city = ? AND address = ?",
+            (city, normalize_address(address))
+        ).fetchone()
+        if row is None or self.expired(row[0], row[4]):
+            self.misses += 1
+            return None
+        self.hits += 1
+        lon, lat, level, raw, _ = row
+        return {"lon": lon, "lat": lat, "level": level, "raw": json.loads(raw) if raw else None}
+
+    def put(self, city: str, address: str, lon: float | None, lat: float | None, level: str | None, raw: Any):
+        """保存编码结果，已有的结果会被覆盖；没有编码结果且 `negative_ttl` 为 0 时不保存"""
+        if lon is None and self.negative_ttl <= 0:
+            return
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (city, normalize_address(address), lon, lat, level, json.dumps(raw, ensure_ascii=False), time())
+            )
+
+    def evict_expired(self):
+        """删除过期的结果
+
+        Returns:
+            int: 删除的数量
+        """
+        now = time()
+        with self.connection:
+            cursor = self.connection.execute(
+                "DELETE FROM geocodes WHERE (lon IS NULL AND created_at < ?) OR (? > 0 AND created_at < ?)",
+                (now - self.negative_ttl, self.ttl, now - self.ttl)
+            )
+        return cursor.rowcount
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def close(self):
+        self.connection.close()
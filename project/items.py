@@ -10,11 +10,13 @@ class CommunityItem(scrapy.Item):
     # define the fields for your item here like:
     # name = scrapy.Field()
     # name小区名，link网页地址，type新房/旧房（这个在网页上没有显示，需要通过builtyear来加工），
-    # district行政区，address位置坐标，builtyear建成年份，carpark_type停车场类型, carpark_nb停车位数量
+    # city城市，district行政区，address位置坐标，builtyear建成年份，carpark_type停车场类型, carpark_nb停车位数量
     name = scrapy.Field()
     link = scrapy.Field()
     type = scrapy.Field()
+    city = scrapy.Field()
     district = scrapy.Field()
     info = scrapy.Field()
+    page_on_list = scrapy.Field()  # 小区在列表中的页码
     
     pass
@@ -0,0 +1,207 @@
+# 爬虫运行指标
+#
+# 以 Prometheus 文本格式输出吞吐量、下载延迟、回调耗时、礼貌等待时间等指标，
+# 用于判断爬虫的瓶颈在网络、解析还是礼貌规则（见 MetricsExporter）。
+#
+# 这里只实现需要的最小子集（counter、gauge、histogram），不依赖 prometheus_client。
+# 回调耗时由 `timed` 装饰器测量：生成器回调的代码在被迭代时才执行，
+# 所以累计每次 `next` 的耗时，回调结束后通过 `callback_timed` 信号上报一次；
+# 异步生成器回调（例如等待解析进程池的回调）只累计代码实际运行的时间，不包括等待的时间。
+
+import functools
+import inspect
+from bisect import bisect_left
+from time import perf_counter
+
+# 自定义信号，参数为 spider, callback（回调名称）, seconds（耗时）
+callback_timed = object()
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CALLBACK_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+WAIT_BUCKETS = (0.01, 0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def format_labels(names: tuple[str, ...], values: tuple, extra: str = ""):
+    pairs = [f'{name}="{escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def escape(value: str):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value: float):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: dict[tuple, float] = {}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{format_labels(self.labels, key)} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, *labels, value: float):
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    """累计分桶的直方图，每组标签保存各桶计数、总和与总数"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.counts: dict[tuple, list[int]] = {}
+        self.sums: dict[tuple, float] = {}
+
+    def observe(self, *labels, value: float):
+        counts = self.counts.get(labels)
+        if counts is None:
+            counts = self.counts[labels] = [0] * (len(self.buckets) + 1)
+            self.sums[labels] = 0.0
+        counts[bisect_left(self.buckets, value)] += 1
+        self.sums[labels] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, counts in sorted(self.counts.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = 'le="' + format_value(float(bound)) + '"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {format_value(self.sums[key])}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self, namespace: str = "crawl"):
+        self.namespace = namespace
+        self.metrics: dict[str, Metric] = {}
+
+    def add(self, metric: Metric):
+        metric.name = f"{self.namespace}_{metric.name}"
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        return self.add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        return self.add(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        return self.add(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        """Prometheus 文本格式"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class RunningTime:
+    """包装 awaitable，累计其代码实际运行的时间，不包括挂起等待的时间"""
+
+    def __init__(self, awaitable, elapsed: float = 0.0):
+        self.awaitable = awaitable
+        self.elapsed = elapsed
+
+    def __await__(self):
+        iterator = self.awaitable.__await__()
+        send, value = iterator.send, None
+        while True:
+            start = perf_counter()
+            try:
+                signal = send(value)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                self.elapsed += perf_counter() - start
+            try:
+                value, send = (yield signal), iterator.send
+            except BaseException as error:
+                value, send = error, iterator.throw
+
+
+def timed(callback):
+    """测量爬虫回调耗时的装饰器，回调结束后发送 `callback_timed` 信号
+
+    生成器回调只计入迭代本身的耗时，不包括下游处理 item 和请求的时间。
+    """
+    name = callback.__name__
+
+    def report(spider, seconds: float):
+        crawler = getattr(spider, "crawler", None)
+        if crawler is not None:
+            crawler.signals.send_catch_log(callback_timed, spider=spider, callback=name, seconds=seconds)
+
+    if inspect.isasyncgenfunction(callback):
+        @functools.wraps(callback)
+        async def wrapper(spider, *args, **kwargs):
+            elapsed = 0.0
+            iterator = callback(spider, *args, **kwargs)
+            try:
+                while True:
+                    step = RunningTime(iterator.__anext__(), elapsed)
+                    try:
+                        value = await step
+                    except StopAsyncIteration:
+                        break
+                    finally:
+                        elapsed = step.elapsed
+                    yield value
+            finally:
+                report(spider, elapsed)
+    elif inspect.isgeneratorfunction(callback):
+        @functools.wraps(callback)
+        def wrapper(spider, *args, **kwargs):
+            elapsed = 0.0
+            iterator = callback(spider, *args, **kwargs)
+            try:
+                while True:
+                    start = perf_counter()
+                    try:
+                        value = next(iterator)
+                    except StopIteration:
+                        break
+                    finally:
+                        elapsed += perf_counter() - start
+                    yield value
+            finally:
+                report(spider, elapsed)
+    else:
+        @functools.wraps(callback)
+        def wrapper(spider, *args, **kwargs):
+            start = perf_counter()
+            try:
+                return callback(spider, *args, **kwargs)
+            finally:
+                report(spider, perf_counter() - start)
+    return wrapper
@@ -3,11 +3,33 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import random
+from pathlib import Path
+from time import time
+
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.utils.defer import maybe_deferred_to_future
+from scrapy.utils.httpobj import urlparse_cached
+from twisted.internet import reactor
+from twisted.internet.error import CannotListenError
+from twisted.internet.task import LoopingCall, deferLater
+from twisted.web.resource import Resource
+from twisted.web.server import Site
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
+from project.archive import ResponseArchive
+from project.cities import current_city, project_path
+from project.frontier import Frontier
+from project.metrics import CALLBACK_BUCKETS, WAIT_BUCKETS, MetricsRegistry, callback_timed
+from project.proxypool import ProxyPool, request_slot
+from project.ratelimit import TokenBucket, shared_bucket
+from project.verification import HostGuard, Quarantine, VerificationRequired, VerificationRules, verification_detected
+
+ROOT_DIR = Path(__file__).parent / ".."
+
 
 class ProjectSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
@@ -101,3 +123,484 @@ class ProjectDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+class PolitenessDelayMiddleware:
+    """按主机施加随机礼貌延迟的下载中间件。
+
+    使用代理池时按“代理 + 主机”分别计算（见 `project.proxypool.request_slot`）。
+    时间槽在同一进程的所有爬虫之间共享，并发爬取多个城市（`scrapy crawl_cities`）时，
+    对同一个主机的请求间隔与只爬取一个城市时相同。
+
+    爬虫回调中的 `sleep` 会阻塞整个 reactor（包括下载、导出和统计），
+    这里改为在 `process_request` 中异步等待：每个主机维护一个“下次可发送时间”，
+    每个请求预约一个时间槽，槽与槽之间相隔 `delay + uniform(0, jitter)` 秒。
+
+    相关设置：
+
+    - `POLITENESS_DELAY`: 基础延迟（秒），默认 1.0
+    - `POLITENESS_JITTER`: 随机延迟上限（秒），默认 1.0
+    - `POLITENESS_HOST_DELAYS`: 按主机覆盖的 `[delay, jitter]`，例如 `{"restapi.amap.com": [0, 0]}`
+    """
+
+    next_slot: dict[str, float] = {}  # 时间槽的键 -> 下次可发送时间，所有实例共享
+
+    def __init__(self, delay: float = 1.0, jitter: float = 1.0, host_delays: dict | None = None):
+        self.delay = delay
+        self.jitter = jitter
+        self.host_delays: dict[str, tuple[float, float]] = {
+            host: tuple(value) for host, value in (host_delays or {}).items()
+        }
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = cls(
+            delay=crawler.settings.getfloat("POLITENESS_DELAY", 1.0),
+            jitter=crawler.settings.getfloat("POLITENESS_JITTER", 1.0),
+            host_delays=crawler.settings.getdict("POLITENESS_HOST_DELAYS"),
+        )
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        return s
+
+    def get_delay(self, host: str):
+        """生成某个主机下一次请求前的随机延迟"""
+        delay, jitter = self.host_delays.get(host, (self.delay, self.jitter))
+        return delay + random.uniform(0, jitter)
+
+    def reserve(self, host: str, slot: str | None = None):
+        """为主机预约下一个时间槽
+
+        Args:
+            host (str): 主机，用于确定延迟
+            slot (str | None, optional): 时间槽的键，默认与主机相同. Defaults to None.
+
+        Returns:
+            float: 需要等待的秒数
+        """
+        slot = slot or host
+        now = time()
+        start = max(now, self.next_slot.get(slot, 0.0))
+        self.next_slot[slot] = start + self.get_delay(host)
+        return start - now
+
+    async def process_request(self, request, spider):
+        host = urlparse_cached(request).hostname or ""
+        wait = self.reserve(host, request_slot(request))
+        request.meta["politeness_wait"] = wait
+        if wait > 0:
+            await maybe_deferred_to_future(deferLater(reactor, wait, lambda: None))
+        return None
+
+    def spider_opened(self, spider):
+        spider.logger.info("Politeness delay: %.1fs + uniform(0, %.1fs)", self.delay, self.jitter)
+
+
+class RateLimitMiddleware:
+    """按令牌桶限速的下载中间件。
+
+    - 爬虫定义了 `rate_limiter` 属性（见 `project.ratelimit.TokenBucket`）时，
+      `meta` 中带有 `rate_limit` 的请求在发送前异步等待令牌；
+    - 设置了 `CRAWL_RATE_LIMIT` 时，发往 `CRAWL_RATE_LIMIT_DOMAINS` 的请求还要等待全局预算的令牌，
+      全局预算由同一进程中的所有爬虫共享（见 `project.ratelimit.shared_bucket`）。
+    """
+
+    def __init__(self, budget: TokenBucket | None = None, domains: list[str] | None = None):
+        self.budget = budget
+        self.domains = domains or []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        rate = crawler.settings.getfloat("CRAWL_RATE_LIMIT", 0)
+        s = cls(
+            budget=shared_bucket("crawl", rate) if rate > 0 else None,
+            domains=crawler.settings.getlist("CRAWL_RATE_LIMIT_DOMAINS"),
+        )
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        return s
+
+    def in_budget(self, host: str):
+        return any(host == domain or host.endswith(f".{domain}") for domain in self.domains)
+
+    async def process_request(self, request, spider):
+        waits = []
+        rate_limiter = getattr(spider, "rate_limiter", None)
+        if rate_limiter is not None and request.meta.get("rate_limit"):
+            waits.append(rate_limiter.reserve())
+        if self.budget is not None and self.in_budget(urlparse_cached(request).hostname or ""):
+            waits.append(self.budget.reserve())
+        if len(waits) == 0:
+            return None
+        wait = max(waits)
+        request.meta["rate_limit_wait"] = wait
+        if wait > 0:
+            await maybe_deferred_to_future(deferLater(reactor, wait, lambda: None))
+        return None
+
+    def spider_opened(self, spider):
+        rate_limiter = getattr(spider, "rate_limiter", None)
+        if rate_limiter is not None and rate_limiter.rate > 0:
+            spider.logger.info("Rate limit: %.1f requests/s", rate_limiter.rate)
+        if self.budget is not None:
+            spider.logger.info("Global rate limit: %.1f requests/s to %s", self.budget.rate, ", ".join(self.domains))
+
+
+class ResponseArchiveMiddleware:
+    """将响应保存到存档（见 `project.archive`）的下载中间件。
+
+    只保存定义了 `parse_items` 方法、可以离线重新解析的爬虫的 200 响应。
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.archive = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("ARCHIVE_ENABLED"):
+            raise NotConfigured
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def process_response(self, request, response, spider):
+        if self.archive is not None and response.status == 200 and hasattr(spider, "parse_items"):
+            fingerprint = self.crawler.request_fingerprinter.fingerprint(request).hex()
+            self.archive.put(fingerprint, request, response, spider)
+            self.crawler.stats.inc_value("archive/stored")
+        return response
+
+    def spider_opened(self, spider):
+        self.archive = ResponseArchive.from_settings(self.crawler.settings)
+        spider.logger.info("Archiving responses to %s", self.archive.directory)
+
+    def spider_closed(self, spider):
+        if self.archive is not None:
+            self.archive.close()
+
+
+class VerificationMiddleware:
+    """识别验证页面（见 `project.verification`）的下载中间件。
+
+    只处理 `detect_verification` 属性为真的爬虫。识别到验证页面时：
+
+    - 统计 `verification/detected` 和 `verification/<原因>`，页面保存到隔离目录；
+    - 按 `HostGuard` 的规则暂停或放慢对该主机（使用代理池时为“代理 + 主机”）的请求；
+    - 抛出 `VerificationRequired`，请求的 errback 负责把目标放回队列，不会输出空数据。
+    """
+
+    def __init__(self, crawler, rules: VerificationRules, guard: HostGuard, quarantine: Quarantine | None):
+        self.crawler = crawler
+        self.rules = rules
+        self.guard = guard
+        self.quarantine = quarantine
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("VERIFICATION_ENABLED"):
+            raise NotConfigured
+        return cls(
+            crawler,
+            VerificationRules.from_settings(settings),
+            HostGuard.from_settings(settings),
+            Quarantine.from_settings(settings),
+        )
+
+    async def process_request(self, request, spider):
+        if not getattr(spider, "detect_verification", False):
+            return None
+        wait = self.guard.wait_time(request_slot(request))
+        if wait > 0:
+            await maybe_deferred_to_future(deferLater(reactor, wait, lambda: None))
+        return None
+
+    def process_response(self, request, response, spider):
+        if not getattr(spider, "detect_verification", False):
+            return response
+        host = request_slot(request)
+        reason = self.rules.detect(request, response)
+        pause = self.guard.record(host, reason is not None)
+        if reason is None:
+            return response
+        stats = self.crawler.stats
+        stats.inc_value("verification/detected")
+        stats.inc_value(f"verification/{reason}")
+        if self.quarantine is not None:
+            self.quarantine.put(spider.name, request, response, reason)
+        spider.logger.warning(
+            "请手动验证 (%s): %s，暂停 %s %.1f 秒，最近验证页面比例 %.0f%%",
+            reason, response.url, host, pause, self.guard.state(host).block_rate * 100
+        )
+        self.crawler.signals.send_catch_log(
+            verification_detected, request=request, response=response, reason=reason, spider=spider
+        )
+        raise VerificationRequired(reason, request.url)
+
+
+class ProxyPoolMiddleware:
+    """把请求分配给代理池（见 `project.proxypool`）中的（代理, 会话）组合的下载中间件。
+
+    组合通过 `proxy` 和 `cookiejar` meta 生效，由 Scrapy 的 HttpProxyMiddleware 和 CookiesMiddleware 处理，
+    所以优先级要小于 700。爬虫自己设置了 `proxy` 的请求不经过代理池。
+    请求结果通过信号记录：`response_received` 为成功（5xx 为错误），`verification_detected` 为遇到验证页面，
+    `process_exception` 为网络或代理错误。
+    """
+
+    def __init__(self, crawler, pool: ProxyPool):
+        self.crawler = crawler
+        self.pool = pool
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("PROXY_POOL_ENABLED"):
+            raise NotConfigured
+        s = cls(crawler, ProxyPool.from_settings(crawler.settings))
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(s.response_received, signal=signals.response_received)
+        crawler.signals.connect(s.verification_detected, signal=verification_detected)
+        return s
+
+    async def process_request(self, request, spider):
+        if request.meta.get("proxy") and not request.meta.get("pool_assigned"):
+            return None
+        member, wait = self.pool.acquire()
+        request.meta["pool_assigned"] = True
+        request.meta["pool_member"] = member.key
+        request.meta["cookiejar"] = member.key
+        if member.proxy is not None:
+            request.meta["proxy"] = member.proxy
+        else:
+            request.meta.pop("proxy", None)
+        if wait > 0:
+            self.crawler.stats.inc_value("proxypool/waited")
+            await maybe_deferred_to_future(deferLater(reactor, wait, lambda: None))
+        return None
+
+    def take_member(self, request):
+        """取出请求使用的组合，每个请求只记录一次结果"""
+        key = request.meta.pop("pool_member", None)
+        return self.pool.members.get(key) if key is not None else None
+
+    def bench_log(self, member, seconds: float, reason: str):
+        if seconds > 0:
+            self.crawler.stats.inc_value("proxypool/benched")
+            self.crawler.spider.logger.warning("停用 %s %.0f 秒 (%s)", member.key, seconds, reason)
+
+    def response_received(self, response, request, spider):
+        member = self.take_member(request)
+        if member is None:
+            return
+        if response.status >= 500:
+            self.crawler.stats.inc_value("proxypool/error")
+            self.bench_log(member, self.pool.error(member), f"status {response.status}")
+        else:
+            self.pool.success(member, request.meta.get("download_latency"))
+
+    def verification_detected(self, request, response, reason, spider):
+        member = self.take_member(request)
+        if member is not None:
+            self.crawler.stats.inc_value("proxypool/blocked")
+            self.bench_log(member, self.pool.blocked(member), reason)
+
+    def process_exception(self, request, exception, spider):
+        member = self.take_member(request)
+        if member is None:
+            return None
+        if isinstance(exception, IgnoreRequest):
+            self.pool.release(member)
+        else:
+            self.crawler.stats.inc_value("proxypool/error")
+            self.bench_log(member, self.pool.error(member), type(exception).__name__)
+        return None
+
+    def spider_opened(self, spider):
+        spider.logger.info("Proxy pool: %d members", len(self.pool))
+
+    def spider_closed(self, spider):
+        for summary in self.pool.summary():
+            spider.logger.info("Proxy pool member: %s", summary)
+
+
+class MetricsResource(Resource):
+    isLeaf = True
+
+    def __init__(self, render):
+        super().__init__()
+        self.render_metrics = render
+
+    def render_GET(self, request):
+        request.setHeader(b"Content-Type", b"text/plain; version=0.0.4; charset=utf-8")
+        return self.render_metrics().encode("UTF-8")
+
+
+class MetricsExporter:
+    """以 Prometheus 文本格式输出爬虫运行指标的扩展（见 `project.metrics`）。
+
+    每隔 `METRICS_INTERVAL` 秒更新速率和队列长度，写入 `METRICS_FILE`（其中的 `{spider}` 和 `{city}` 替换为爬虫名称和城市）；
+    设置了 `METRICS_PORT` 时还在 `http://METRICS_HOST:METRICS_PORT/metrics` 提供抓取接口。
+
+    主要指标（均带有 spider 标签）：
+
+    - `crawl_requests_total`、`crawl_requests_per_second`: 到达下载器的请求数及速率
+    - `crawl_download_latency_seconds{host}`: 下载延迟的直方图
+    - `crawl_wait_seconds{host, reason}`: 礼貌延迟（politeness）和限速（rate_limit）的等待时间
+    - `crawl_callback_seconds{callback}`: 回调耗时，由 `project.metrics.timed` 装饰器测量
+    - `crawl_items_total`、`crawl_items_per_second`: 输出的数据数量及速率
+    - `crawl_verification_pages_total`、`crawl_verification_pages_per_second`: 需要手动验证的页面数量及速率
+      （按 `verification_detected` 信号计数，与统计项 `verification/detected` 一致）
+    - `crawl_frontier_size{state}`: 爬虫待爬取队列（`Frontier`）中等待和在途的目标数量
+
+    网络是瓶颈时下载延迟高而等待时间短；礼貌规则是瓶颈时等待时间接近请求间隔；
+    解析是瓶颈时回调耗时之和接近运行时间。
+    """
+
+    def __init__(self, crawler, path: Path | None, interval: float, host: str, port: int | None):
+        self.crawler = crawler
+        self.path = path
+        self.interval = interval
+        self.host = host
+        self.port = port
+        self.spider_name = ""
+        self.loop: LoopingCall | None = None
+        self.listener = None
+        self.last_tick = time()
+        self.last_totals: dict[str, float] = {}
+        registry = self.registry = MetricsRegistry("crawl")
+        labels = ("spider",)
+        self.requests = registry.counter("requests_total", "Requests that reached the downloader", labels)
+        self.responses = registry.counter("responses_total", "Responses by host and status", ("spider", "host", "status"))
+        self.latency = registry.histogram("download_latency_seconds", "Download latency by host", ("spider", "host"))
+        self.wait = registry.histogram(
+            "wait_seconds", "Time requests waited for politeness delay or rate limit", ("spider", "host", "reason"),
+            WAIT_BUCKETS
+        )
+        self.callback = registry.histogram(
+            "callback_seconds", "Time spent in spider callbacks", ("spider", "callback"), CALLBACK_BUCKETS
+        )
+        self.items = registry.counter("items_total", "Items scraped", labels)
+        self.dropped = registry.counter("items_dropped_total", "Items dropped by pipelines", labels)
+        self.verification = registry.counter("verification_pages_total", "Pages asking for manual verification", labels)
+        self.rates = {
+            what: registry.gauge(f"{what}_per_second", f"{help} per second over the last export interval", labels)
+            for what, help in [("requests", "Requests"), ("items", "Items"), ("verification_pages", "Verification pages")]
+        }
+        self.frontier = registry.gauge("frontier_size", "Targets in the spider frontier", ("spider", "frontier", "state"))
+        self.queues = registry.gauge("queue_size", "Requests in the scheduler and downloader", ("spider", "queue"))
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("METRICS_ENABLED"):
+            raise NotConfigured
+        path = settings.get("METRICS_FILE")
+        port = settings.get("METRICS_PORT")
+        if not path and not port:
+            raise NotConfigured
+        if path:
+            path = project_path(path.format(spider=crawler.spidercls.name, city=current_city(settings)))
+        s = cls(
+            crawler,
+            path=path or None,
+            interval=settings.getfloat("METRICS_INTERVAL", 15.0),
+            host=settings.get("METRICS_HOST", "127.0.0.1"),
+            port=int(port) if port else None,
+        )
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(s.request_reached_downloader, signal=signals.request_reached_downloader)
+        crawler.signals.connect(s.response_received, signal=signals.response_received)
+        crawler.signals.connect(s.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(s.item_dropped, signal=signals.item_dropped)
+        crawler.signals.connect(s.callback_timed, signal=callback_timed)
+        crawler.signals.connect(s.verification_detected, signal=verification_detected)
+        return s
+
+    def request_reached_downloader(self, request, spider):
+        self.requests.inc(spider.name)
+        host = urlparse_cached(request).hostname or ""
+        for reason in ("politeness", "rate_limit"):
+            wait = request.meta.get(f"{reason}_wait")
+            if wait is not None:
+                self.wait.observe(spider.name, host, reason, value=wait)
+
+    def response_received(self, response, request, spider):
+        host = urlparse_cached(request).hostname or ""
+        self.responses.inc(spider.name, host, str(response.status))
+        latency = request.meta.get("download_latency")
+        if latency is not None:
+            self.latency.observe(spider.name, host, value=latency)
+
+    def item_scraped(self, item, response, spider):
+        self.items.inc(spider.name)
+
+    def item_dropped(self, item, response, exception, spider):
+        self.dropped.inc(spider.name)
+
+    def callback_timed(self, spider, callback, seconds):
+        self.callback.observe(spider.name, callback, value=seconds)
+
+    def verification_detected(self, request, response, reason, spider):
+        self.verification.inc(spider.name)
+
+    def sample(self):
+        """更新队列长度等需要采样的指标"""
+        spider = self.crawler.spider
+        name = self.spider_name
+        if spider is not None:
+            for attribute, value in vars(spider).items():
+                if isinstance(value, Frontier):
+                    self.frontier.set(name, attribute, "pending", value=len(value))
+                    self.frontier.set(name, attribute, "in_flight", value=value.in_flight_count)
+        engine = self.crawler.engine
+        if engine is not None and engine.slot is not None:
+            self.queues.set(name, "scheduler", value=len(engine.slot.scheduler))
+            self.queues.set(name, "downloader", value=len(engine.downloader.active))
+
+    def render(self):
+        self.sample()
+        return self.registry.render()
+
+    def export(self):
+        """计算上一个间隔内的速率，并写入指标文件"""
+        name = self.spider_name
+        totals = {
+            "requests": self.requests.values.get((name,), 0),
+            "items": self.items.values.get((name,), 0),
+            "verification_pages": self.verification.values.get((name,), 0),
+        }
+        now = time()
+        elapsed = now - self.last_tick
+        if elapsed > 0:
+            for what, total in totals.items():
+                self.rates[what].set(name, value=(total - self.last_totals.get(what, 0)) / elapsed)
+        self.last_tick = now
+        self.last_totals = totals
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            temp = self.path.with_name(self.path.name + ".tmp")
+            temp.write_text(self.render(), encoding="UTF-8")
+            temp.replace(self.path)
+
+    def spider_opened(self, spider):
+        self.spider_name = spider.name
+        self.last_tick = time()
+        self.loop = LoopingCall(self.export)
+        self.loop.start(self.interval, now=False)
+        if self.port is not None:
+            try:
+                self.listener = reactor.listenTCP(self.port, Site(MetricsResource(self.render)), interface=self.host)
+                spider.logger.info("Metrics on http://%s:%d/metrics", self.host, self.port)
+            except CannotListenError:
+                # 同一进程中爬取多个城市时，只有第一个爬虫能使用这个端口
+                spider.logger.warning("Metrics port %d is in use, metrics are only written to file", self.port)
+        if self.path is not None:
+            spider.logger.info("Metrics written to %s every %gs", self.path, self.interval)
+
+    def spider_closed(self, spider):
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+        self.export()
+        if self.listener is not None:
+            return self.listener.stopListening()
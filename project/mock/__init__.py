@@ -0,0 +1,3 @@
+# Local stand-in servers used to exercise the spiders offline.
+#
+# Each module can be run directly, e.g. `python -m project.mock.amap --port 8765`.
@@ -0,0 +1,186 @@
+# 高德地理编码接口（/v3/geocode/geo）的本地替身
+#
+# 用于离线测试 CommunityGeoLocator 的批量模式和吞吐量：
+#
+#     python -m project.mock.amap --port 8765 --qps 50
+#     scrapy crawl community_geolocator -a batch=10 -a base_url=http://127.0.0.1:8765/v3/geocode/geo
+#
+# 坐标由地址的哈希值确定，落在郑州市范围内，同一个地址总是得到同一个坐标。
+# `--reset-address 花园路13号` 时，包含这段文字的请求直接断开连接，模拟一直失败的地址。
+# `--truncate-rate 0.2` 时，这一比例的批量响应只返回前一半的编码结果，模拟被截断的响应。
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep, time
+from urllib.parse import parse_qs, urlparse
+
+ZHENGZHOU_BBOX = (113.45, 34.60, 113.95, 34.95)
+
+
+def fake_location(address: str):
+    """根据地址生成确定的坐标"""
+    digest = hashlib.md5(address.encode("UTF-8")).digest()
+    u = int.from_bytes(digest[:4], "little") / 2 ** 32
+    v = int.from_bytes(digest[4:8], "little") / 2 ** 32
+    min_lon, min_lat, max_lon, max_lat = ZHENGZHOU_BBOX
+    return f"{min_lon + u * (max_lon - min_lon):.6f},{min_lat + v * (max_lat - min_lat):.6f}"
+
+
+class FakeAmap:
+    """替身服务器的状态：QPS 限制、日配额和统计"""
+
+    def __init__(
+        self,
+        qps: float = 0,
+        daily_quota: int = 0,
+        fail_rate: float = 0.0,
+        latency: float = 0.0,
+        reset_address: str = "",
+        truncate_rate: float = 0.0
+    ):
+        self.qps = qps
+        self.daily_quota = daily_quota
+        self.fail_rate = fail_rate
+        self.latency = latency
+        self.reset_address = reset_address
+        self.truncate_rate = truncate_rate
+        self.lock = threading.Lock()
+        self.recent: deque[float] = deque()
+        self.requests = 0
+        self.addresses = 0
+        self.rejected = 0
+        self.resets = 0
+        self.truncated = 0
+
+    def admit(self):
+        """检查 QPS 和日配额
+
+        Returns:
+            str: 拒绝时返回高德的错误信息
+            None: 允许访问
+        """
+        with self.lock:
+            now = time()
+            if self.daily_quota > 0 and self.requests >= self.daily_quota:
+                self.rejected += 1
+                return "DAILY_QUERY_OVER_LIMIT"
+            while len(self.recent) > 0 and self.recent[0] <= now - 1.0:
+                self.recent.popleft()
+            if self.qps > 0 and len(self.recent) >= self.qps:
+                self.rejected += 1
+                return "CUQPS_HAS_EXCEEDED_THE_LIMIT"
+            self.recent.append(now)
+            self.requests += 1
+            return None
+
+    def should_reset(self, query: dict[str, list[str]]):
+        """请求的地址包含 `reset_address` 时断开连接"""
+        if self.reset_address and self.reset_address in query.get("address", [""])[0]:
+            with self.lock:
+                self.resets += 1
+            return True
+        return False
+
+    def geocode(self, address: str):
+        if address.strip() == "" or random.random() < self.fail_rate:
+            return {"formatted_address": [], "level": [], "location": []}
+        return {
+            "formatted_address": address,
+            "country": "中国",
+            "province": "河南省",
+            "city": "郑州市",
+            "level": "门址",
+            "location": fake_location(address)
+        }
+
+    def respond(self, query: dict[str, list[str]]):
+        if self.latency > 0:
+            sleep(self.latency)
+        error = self.admit()
+        if error is not None:
+            return {"status": "0", "info": error, "infocode": "10000"}
+        addresses = query.get("address", [""])[0]
+        if query.get("batch", ["false"])[0] == "true":
+            addresses = addresses.split("|")[:10]
+        else:
+            addresses = [addresses]
+        geocodes = [self.geocode(x) for x in addresses]
+        with self.lock:
+            self.addresses += len(addresses)
+        if len(geocodes) == 1 and geocodes[0]["location"] == []:
+            geocodes = []  # 单个地址编码失败时，高德返回空列表
+        elif len(geocodes) > 1 and random.random() < self.truncate_rate:
+            geocodes = geocodes[:len(geocodes) // 2]
+            with self.lock:
+                self.truncated += 1
+        return {
+            "status": "1",
+            "info": "OK",
+            "infocode": "10000",
+            "count": str(len([x for x in geocodes if x["location"] != []])),
+            "geocodes": geocodes
+        }
+
+
+def make_handler(amap: FakeAmap):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/stats":
+                body = {"requests": amap.requests, "addresses": amap.addresses, "rejected": amap.rejected, "resets": amap.resets, "truncated": amap.truncated}
+            elif url.path == "/v3/geocode/geo":
+                query = parse_qs(url.query)
+                if amap.should_reset(query):
+                    self.close_connection = True
+                    return
+                body = amap.respond(query)
+            else:
+                self.send_error(404)
+                return
+            data = json.dumps(body, ensure_ascii=False).encode("UTF-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json;charset=UTF-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(host: str = "127.0.0.1", port: int = 8765, **options):
+    amap = FakeAmap(**options)
+    server = ThreadingHTTPServer((host, port), make_handler(amap))
+    return server, amap
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="高德地理编码接口的本地替身")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--qps", type=float, default=0, help="每秒请求数上限，0 表示不限")
+    parser.add_argument("--daily-quota", type=int, default=0, help="日请求配额，0 表示不限")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="地址编码失败的比例")
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的延迟（秒）")
+    parser.add_argument("--reset-address", default="", help="地址包含这段文字的请求直接断开连接")
+    parser.add_argument("--truncate-rate", type=float, default=0.0, help="只返回前一半编码结果的批量响应的比例")
+    args = parser.parse_args()
+    server, amap = serve(
+        args.host, args.port,
+        qps=args.qps, daily_quota=args.daily_quota, fail_rate=args.fail_rate, latency=args.latency,
+        reset_address=args.reset_address, truncate_rate=args.truncate_rate
+    )
+    print(f"高德接口替身: http://{args.host}:{args.port}/v3/geocode/geo （统计: /stats）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"请求 {amap.requests} 次，编码地址 {amap.addresses} 个，拒绝 {amap.rejected} 次，断开连接 {amap.resets} 次")
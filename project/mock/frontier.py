@@ -0,0 +1,96 @@
+# 共享待爬取队列服务的本地替身
+#
+# 实现 project.sharedfrontier.HttpFrontier 使用的协议：`POST /<操作>`，请求体是参数的 JSON，
+# 响应为 {"result": ...}。操作有 add、claim、complete、release、renew、stats、reset，
+# 内部使用 SqliteFrontier，所以也可以当作一个简单的队列服务，让多台机器分担同一个城市：
+#
+#     python -m project.mock.frontier --port 8780 --db frontier.sqlite3
+#     scrapy crawl community_info -s FRONTIER_BACKEND=http -s FRONTIER_URL=http://10.0.0.2:8780
+#
+# 可以设置每个请求的额外延迟，模拟网络往返的开销。
+
+import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+
+from project.sharedfrontier import SqliteFrontier
+
+OPERATIONS = {"add", "claim", "complete", "release", "renew", "stats", "reset"}
+
+
+class FrontierService:
+    """替身服务器的状态：SQLite 后端和统计"""
+
+    def __init__(self, path: str, latency: float = 0.0):
+        self.backend = SqliteFrontier(path)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls: dict[str, int] = {}
+
+    def call(self, operation: str, params: dict):
+        if self.latency > 0:
+            sleep(self.latency)
+        with self.lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            return getattr(self.backend, operation)(**params)
+
+
+def make_handler(service: FrontierService):
+    class Handler(BaseHTTPRequestHandler):
+        def send_json(self, status: int, body):
+            data = json.dumps(body, ensure_ascii=False).encode("UTF-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json;charset=UTF-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self.send_json(200, {"calls": service.calls})
+            else:
+                self.send_error(404)
+
+        def do_POST(self):
+            operation = self.path.strip("/")
+            if operation not in OPERATIONS:
+                self.send_error(404)
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            params = json.loads(self.rfile.read(length) or b"{}")
+            try:
+                result = service.call(operation, params)
+            except (TypeError, ValueError) as error:
+                self.send_json(400, {"error": str(error)})
+                return
+            self.send_json(200, {"result": result})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(host: str = "127.0.0.1", port: int = 8780, **options):
+    service = FrontierService(**options)
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    return server, service
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="共享待爬取队列服务的本地替身")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8780)
+    parser.add_argument("--db", default="frontier.sqlite3", help="SQLite 文件")
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的额外延迟（秒）")
+    args = parser.parse_args()
+    server, service = serve(args.host, args.port, path=args.db, latency=args.latency)
+    print(f"队列服务替身: http://{args.host}:{args.port} （统计: GET /stats）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"调用次数: {service.calls}")
@@ -0,0 +1,159 @@
+# HTTP 代理的本地替身
+#
+# 用于离线测试 ProxyPoolMiddleware 的分配、健康评分和停用：
+#
+#     python -m project.mock.proxy --port 8800 --count 4 --rate 2 --fail-rate 0.05
+#     scrapy crawl community_info -s PROXY_POOL_ENABLED=1 -s PROXY_POOL_DIRECT=0 \
+#         -s PROXY_LIST=http://127.0.0.1:8800,http://127.0.0.1:8801,http://127.0.0.1:8802,http://127.0.0.1:8803
+#
+# 每个代理模拟一个出口 IP：转发 http:// 请求（不支持 CONNECT），可以设置额外延迟、失败比例，
+# 以及每秒请求数上限，超过上限时像房天下一样返回 403 验证页面。相对路径 /stats 返回统计。
+
+import argparse
+import http.client
+import json
+import random
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep, time
+from urllib.parse import urlsplit
+
+VERIFICATION_PAGE = "<html><head><title>访问验证-房天下</title></head><body>请输入验证码</body></html>".encode("UTF-8")
+HOP_HEADERS = {"connection", "proxy-connection", "keep-alive", "proxy-authorization", "transfer-encoding", "te", "upgrade"}
+
+
+class FakeProxy:
+    """一个代理的状态：限速、失败模拟和统计"""
+
+    def __init__(self, rate: float = 0, fail_rate: float = 0.0, latency: float = 0.0, timeout: float = 30.0):
+        self.rate = rate
+        self.fail_rate = fail_rate
+        self.latency = latency
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.recent: deque[float] = deque()
+        self.requests = 0
+        self.blocked = 0
+        self.failed = 0
+
+    def admit(self):
+        """
+        Returns:
+            str: "fail" 模拟代理故障，"block" 超过速率上限
+            None: 正常转发
+        """
+        with self.lock:
+            now = time()
+            self.requests += 1
+            if random.random() < self.fail_rate:
+                self.failed += 1
+                return "fail"
+            while len(self.recent) > 0 and self.recent[0] <= now - 1.0:
+                self.recent.popleft()
+            self.recent.append(now)
+            if self.rate > 0 and len(self.recent) > self.rate:
+                self.blocked += 1
+                return "block"
+            return None
+
+    def forward(self, method: str, url: str, headers: dict[str, str], body: bytes | None):
+        """转发请求
+
+        Returns:
+            tuple[int, list[tuple[str, str]], bytes]: 状态码、响应头和响应内容
+        """
+        parts = urlsplit(url)
+        connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=self.timeout)
+        try:
+            path = parts.path or "/"
+            if parts.query:
+                path += "?" + parts.query
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            data = response.read()
+            response_headers = [(k, v) for k, v in response.getheaders() if k.lower() not in HOP_HEADERS]
+            return response.status, response_headers, data
+        finally:
+            connection.close()
+
+
+def make_handler(proxy: FakeProxy):
+    class Handler(BaseHTTPRequestHandler):
+        def send(self, status: int, headers: list[tuple[str, str]], data: bytes):
+            self.send_response(status)
+            for key, value in headers:
+                if key.lower() != "content-length":
+                    self.send_header(key, value)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(data)
+
+        def handle_proxy(self):
+            if self.path == "/stats":
+                data = json.dumps({"requests": proxy.requests, "blocked": proxy.blocked, "failed": proxy.failed}).encode()
+                self.send(200, [("Content-Type", "application/json")], data)
+                return
+            if not self.path.startswith("http://"):
+                self.send_error(400, "only absolute http:// URLs are supported")
+                return
+            if proxy.latency > 0:
+                sleep(proxy.latency)
+            decision = proxy.admit()
+            if decision == "fail":
+                self.send(502, [("Content-Type", "text/plain")], b"Bad Gateway")
+                return
+            if decision == "block":
+                self.send(403, [("Content-Type", "text/html;charset=utf-8")], VERIFICATION_PAGE)
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length > 0 else None
+            headers = {k: v for k, v in self.headers.items() if k.lower() not in HOP_HEADERS}
+            try:
+                status, response_headers, data = proxy.forward(self.command, self.path, headers, body)
+            except OSError as error:
+                self.send(502, [("Content-Type", "text/plain")], str(error).encode())
+                return
+            self.send(status, response_headers, data)
+
+        do_GET = handle_proxy
+        do_HEAD = handle_proxy
+        do_POST = handle_proxy
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(host: str = "127.0.0.1", port: int = 8800, **options):
+    proxy = FakeProxy(**options)
+    server = ThreadingHTTPServer((host, port), make_handler(proxy))
+    return server, proxy
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP 代理的本地替身")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800, help="第一个代理的端口，其余代理依次加一")
+    parser.add_argument("--count", type=int, default=1, help="代理数量")
+    parser.add_argument("--rate", type=float, default=0, help="每个代理每秒请求数上限，超过时返回验证页面，0 表示不限")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="返回 502 的比例")
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的额外延迟（秒）")
+    args = parser.parse_args()
+    servers = []
+    for i in range(args.count):
+        server, proxy = serve(args.host, args.port + i, rate=args.rate, fail_rate=args.fail_rate, latency=args.latency)
+        servers.append((server, proxy))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    print("代理替身: " + ",".join(f"http://{args.host}:{args.port + i}" for i in range(args.count)))
+    try:
+        while True:
+            sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for i, (server, proxy) in enumerate(servers):
+            server.shutdown()
+            print(f"{args.port + i}: 请求 {proxy.requests} 次，验证页面 {proxy.blocked} 次，故障 {proxy.failed} 次")
@@ -0,0 +1,94 @@
+# 在进程池中提取页面数据
+#
+# 字段提取（lxml、BeautifulSoup、parsel）原先在 reactor 线程中运行，并发爬取时解析的 CPU 时间
+# 直接限制了每秒能处理的响应数量。设置 EXTRACT_PROCESSES 后，爬虫把响应内容交给进程池，
+# 由子进程调用与同步路径相同的提取函数（见 project.extract），回调异步等待结果后再输出数据。
+#
+# 背压：同时提交的任务最多 EXTRACT_MAX_PENDING 个，超过时回调等待空位。等待中的回调仍然占用
+# Scrapy scraper 的活动响应额度（SCRAPER_SLOT_MAX_ACTIVE_SIZE），额度用完后引擎暂停从下载器
+# 取出新的响应，所以解析跟不上下载时内存占用仍有上限。
+#
+# 子进程使用 spawn 方式启动，不复制 reactor 所在进程的线程和文件描述符。进程池意外退出时
+# 退回到在 reactor 线程中提取。
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable
+
+from w3lib.encoding import html_to_unicode
+
+
+def decode_body(body: bytes, encoding: str):
+    """与 TextResponse.text 相同的方式解码响应内容"""
+    return html_to_unicode(f"charset={encoding}", body)[1]
+
+
+def run_extract(function: Callable[..., Any], body: bytes, encoding: str, *args):
+    """在子进程中解码响应并调用提取函数 function(html, *args)"""
+    return function(decode_body(body, encoding), *args)
+
+
+class ExtractPool:
+    """提取函数的进程池，限制同时提交的任务数量"""
+
+    def __init__(self, processes: int, max_pending: int):
+        """
+        Args:
+            processes (int): 子进程数量
+            max_pending (int): 同时提交（排队和运行中）的任务数量上限
+        """
+        self.processes = processes
+        self.max_pending = max_pending
+        self.executor: ProcessPoolExecutor | None = ProcessPoolExecutor(
+            max_workers=processes, mp_context=multiprocessing.get_context("spawn")
+        )
+        self.semaphore = asyncio.Semaphore(max_pending)
+        self.pending = 0
+        self.submitted = 0
+        self.waited = 0  # 因为达到上限而等待空位的次数
+
+    @classmethod
+    def from_settings(cls, settings):
+        """
+        Returns:
+            ExtractPool: 进程池
+            None: 没有设置 EXTRACT_PROCESSES，在 reactor 线程中提取
+        """
+        processes = settings.getint("EXTRACT_PROCESSES", 0)
+        if processes <= 0:
+            return None
+        return cls(processes, settings.getint("EXTRACT_MAX_PENDING", 0) or processes * 4)
+
+    async def extract(self, function: Callable[..., Any], response, *args):
+        """在子进程中提取响应中的数据
+
+        Args:
+            function (Callable[..., Any]): 模块级的提取函数，第一个参数为 HTML 文本
+            response: Scrapy 响应
+            args: 提取函数的其他参数
+
+        Returns:
+            Any: 提取函数的返回值
+        """
+        if self.semaphore.locked():
+            self.waited += 1
+        async with self.semaphore:
+            if self.executor is None:
+                return function(response.text, *args)
+            self.pending += 1
+            self.submitted += 1
+            try:
+                future = self.executor.submit(run_extract, function, response.body, response.encoding, *args)
+                return await asyncio.wrap_future(future)
+            except BrokenProcessPool:
+                self.executor = None
+                return function(response.text, *args)
+            finally:
+                self.pending -= 1
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
@@ -4,10 +4,135 @@
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
 
+from pathlib import Path
+from time import strftime
+
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
+from scrapy.exceptions import NotConfigured
+
+from project.cities import city_path
+from project.store import ItemStore, items_stored
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+ROOT_DIR = Path(__file__).parent / ".."
+
+
+class ItemStorePipeline:
+    """将数据写入 SQLite 数据库（见 `project.store`）。
+
+    数据的唯一键由爬虫的 `item_key` 属性指定（例如 `link` 或 `uuid`），
+    同一个键再次爬取时覆盖旧数据。每次提交后发送 `items_stored` 信号。
+
+    爬虫定义了 `store` 属性且为 None 时，在爬取期间共用这个数据库连接：爬虫写入的其他记录
+    （例如 community_info 的检查结果）与数据进入同一个缓冲区，在同一个事务中提交。
+    """
+
+    store: ItemStore | None = None
+
+    def __init__(self, settings, signals=None):
+        self.settings = settings
+        self.signals = signals
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings, crawler.signals)
+
+    def open_spider(self, spider):
+        self.store = ItemStore.from_settings(self.settings)
+        if self.signals is not None:
+            self.store.on_flush = lambda: self.signals.send_catch_log(items_stored, spider=spider)
+        if hasattr(spider, "store") and spider.store is None:
+            spider.store = self.store
+
+    def close_spider(self, spider):
+        self.store.flush()
+        spider.logger.info("数据库中共有 %d 条 %s 数据", self.store.count(spider.name), spider.name)
+        self.store.close()
+        if getattr(spider, "store", None) is self.store:
+            spider.store = None
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        key = str(adapter[getattr(spider, "item_key", "link")])
+        self.store.put(spider.name, key, adapter.asdict())
+        return item
+
+
+class ParquetPipeline:
+    """在爬取时将数据展开为固定列，分批写入 Parquet 文件（见 `project.schema`）。
+
+    只处理定义了 `item_schema` 属性的爬虫。每次运行写出一个文件
+    `<PARQUET_DIR>/<爬虫名称>/<时间>.parquet`，每 `PARQUET_ROW_GROUP_SIZE` 条数据一个 row group；
+    文件写完后才从临时文件重命名，读取目录时不会读到不完整的文件。
+    多次运行可能包含同一个小区，读取时按 link 保留最新的一条。
+    """
+
+    writer = None
+
+    def __init__(self, directory: Path, row_group_size: int, compression: str):
+        self.directory = directory
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.buffer: list[dict] = []
+        self.count = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("PARQUET_ENABLED"):
+            raise NotConfigured
+        if pq is None:
+            raise NotConfigured("写出 Parquet 需要安装 pyarrow")
+        return cls(
+            city_path(settings, "PARQUET_DIR", "data/{city}/parquet"),
+            row_group_size=settings.getint("PARQUET_ROW_GROUP_SIZE", 5000),
+            compression=settings.get("PARQUET_COMPRESSION", "zstd")
+        )
+
+    def open_spider(self, spider):
+        self.schema = getattr(spider, "item_schema", None)
+        if self.schema is None:
+            return
+        directory = self.directory / spider.name
+        directory.mkdir(parents=True, exist_ok=True)
+        self.path = directory / f"{strftime('%Y%m%d-%H%M%S')}.parquet"
+        self.temp_path = self.path.with_suffix(".parquet.tmp")
+        self.arrow_schema = self.schema.arrow_schema()
+        self.writer = pq.ParquetWriter(
+            self.temp_path,
+            self.arrow_schema,
+            compression=self.compression,
+            use_dictionary=True
+        )
+
+    def flush(self):
+        if self.buffer:
+            table = pa.Table.from_pylist(self.buffer, schema=self.arrow_schema)
+            self.writer.write_table(table, row_group_size=self.row_group_size)
+            self.count += len(self.buffer)
+            self.buffer.clear()
 
+    def close_spider(self, spider):
+        if self.writer is None:
+            return
+        self.flush()
+        self.writer.close()
+        if self.count > 0:
+            self.temp_path.replace(self.path)
+            spider.logger.info("写出 %d 条数据到 %s", self.count, self.path)
+        else:
+            self.temp_path.unlink()
 
-class ProjectPipeline:
     def process_item(self, item, spider):
+        if self.writer is not None:
+            self.buffer.append(self.schema.normalize(ItemAdapter(item).asdict()))
+            if len(self.buffer) >= self.row_group_size:
+                self.flush()
         return item
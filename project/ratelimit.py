@@ -0,0 +1,82 @@
+# 令牌桶限速器
+#
+# 用于把请求速率限制在接口允许的 QPS 以内（例如高德 Key 的并发量上限）。
+# 限速器本身不等待，只计算每个请求需要等待多久，由 RateLimitMiddleware 异步等待。
+# 同一进程中的多个爬虫（例如并发爬取的多个城市）通过 `shared_bucket` 共用一个速率预算。
+
+from time import time
+
+
+class TokenBucket:
+    """令牌桶。
+
+    令牌以 `rate` 个每秒的速度补充，最多积累 `capacity` 个。每个请求预约一个令牌，
+    令牌不足时预约未来的令牌（令牌数可以为负），返回需要等待的时间，
+    所以并发请求会被均匀地排开，而不是同时等待后一起发出。
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        """
+        Args:
+            rate (float): 每秒补充的令牌数，0 表示不限速
+            capacity (float | None, optional): 令牌上限，即允许的突发请求数. Defaults to 1.
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else 1.0
+        self.tokens = self.capacity
+        self.updated_at = time()
+        self.paused_until = 0.0
+
+    def refill(self, now: float):
+        if now > self.updated_at:
+            if self.rate > 0:
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+    def reserve(self):
+        """预约一个令牌
+
+        Returns:
+            float: 需要等待的秒数
+        """
+        now = time()
+        self.refill(now)
+        if self.rate <= 0:
+            return max(0.0, self.paused_until - now)
+        self.tokens -= 1
+        deficit = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(0.0, self.updated_at - now) + deficit  # 暂停期间 updated_at 在未来
+
+    @property
+    def paused(self):
+        return time() < self.paused_until
+
+    def pause(self, seconds: float):
+        """暂停发放令牌，例如接口返回 QPS 超限时退避
+
+        暂停期间不补充令牌，恢复后按正常速度重新开始。
+        """
+        now = time()
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = min(self.tokens, 0.0)
+        self.updated_at = max(self.updated_at, self.paused_until)
+
+
+shared_buckets: dict[str, TokenBucket] = {}
+
+
+def shared_bucket(name: str, rate: float, capacity: float | None = None):
+    """按名称取得进程内共享的令牌桶，第一次取得时创建，之后忽略 rate 和 capacity
+
+    Args:
+        name (str): 预算的名称，例如 "amap"
+        rate (float): 每秒补充的令牌数，0 表示不限速
+        capacity (float | None, optional): 令牌上限. Defaults to None.
+
+    Returns:
+        TokenBucket: 令牌桶
+    """
+    bucket = shared_buckets.get(name)
+    if bucket is None:
+        bucket = shared_buckets[name] = TokenBucket(rate, capacity)
+    return bucket
@@ -0,0 +1,159 @@
+# 目标级的重试调度
+#
+# Scrapy 的 RetryMiddleware 只在一次请求内立即重试 RETRY_TIMES 次，之后失败交给爬虫的 errback。
+# community_info 原先只处理其中的 HttpError（并直接标记为完成，不再重试），DNS 错误、超时、
+# 连接中断等失败既不释放在途窗口也不发出下一个请求，按链式发请求的爬取就此停止。
+#
+# 这里按目标（小区链接）记录失败：
+#
+# - 失败次数和最近一次的原因保存在数据库的 failures 表中（见 ItemStore），中断后重新运行时继续累计；
+# - 第 n 次失败后等待 min(TARGET_RETRY_MAX_BACKOFF, TARGET_RETRY_BACKOFF * 2^(n-1)) 秒，
+#   其中后一半为随机抖动，避免同时失败的目标同时重试；到期后放回待爬取队列的队尾；
+# - 失败达到 TARGET_RETRY_MAX_ATTEMPTS 次，或者状态码属于 TARGET_RETRY_PERMANENT_STATUS（例如 404）的目标
+#   转入死信：本次不再爬取，之后的运行也跳过，直到使用 `-a retry_dead=1` 重新爬取；
+# - 多次遇到验证页面而放弃的小区同样记一次失败，本次不再爬取，下次运行时重新爬取；
+# - 成功爬取后清除记录。
+#
+# 失败记录可以用 `python -m project.store failures community_info` 查看。
+#
+# 地理编码爬虫（community_geolocator）同样按小区记录失败次数和死信，没有编码结果的地址也算一次失败；
+# 退避由令牌桶的暂停实现，失败的小区立即放回队尾（`schedule=False`）。
+
+import heapq
+import random
+from time import time
+
+from scrapy.spidermiddlewares.httperror import HttpError
+from twisted.internet.error import ConnectError, ConnectionLost, DNSLookupError, TimeoutError
+from twisted.python.failure import Failure
+from twisted.web.client import ResponseFailed, ResponseNeverReceived
+
+from project.store import ItemStore
+
+
+def failure_reason(failure: Failure):
+    """失败的简短原因，用于日志、统计和失败记录，例如 "http_503"、"dns"、"timeout" """
+    if failure.check(HttpError):
+        return f"http_{failure.value.response.status}"
+    if failure.check(DNSLookupError):
+        return "dns"
+    if failure.check(TimeoutError):
+        return "timeout"
+    if failure.check(ConnectError, ConnectionLost, ResponseFailed, ResponseNeverReceived):
+        return "connection"
+    return type(failure.value).__name__
+
+
+class RetryScheduler:
+    """按目标记录失败次数，安排退避重试和死信"""
+
+    def __init__(
+        self,
+        store: ItemStore,
+        spider: str,
+        max_attempts: int = 5,
+        backoff: float = 30.0,
+        max_backoff: float = 1800.0,
+        permanent_status: list[int] | None = None
+    ):
+        """
+        Args:
+            store (ItemStore): 保存失败记录的数据库
+            spider (str): 爬虫名称
+            max_attempts (int, optional): 失败多少次后转入死信. Defaults to 5.
+            backoff (float, optional): 第一次失败后的等待时间（秒）. Defaults to 30.0.
+            max_backoff (float, optional): 等待时间的上限（秒）. Defaults to 1800.0.
+            permanent_status (list[int] | None, optional): 不重试、直接转入死信的状态码. Defaults to None.
+        """
+        self.store = store
+        self.spider = spider
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.permanent_status = set(permanent_status or [])
+        self.records = store.failures(spider)
+        self.waiting: list[tuple[float, str]] = []  # (到期时间, 键) 的最小堆
+
+    @classmethod
+    def from_settings(cls, settings, store: ItemStore, spider: str):
+        return cls(
+            store,
+            spider,
+            max_attempts=settings.getint("TARGET_RETRY_MAX_ATTEMPTS", 5),
+            backoff=settings.getfloat("TARGET_RETRY_BACKOFF", 30.0),
+            max_backoff=settings.getfloat("TARGET_RETRY_MAX_BACKOFF", 1800.0),
+            permanent_status=[int(x) for x in settings.getlist("TARGET_RETRY_PERMANENT_STATUS", [404, 410])]
+        )
+
+    def __len__(self):
+        """等待重试的目标数量"""
+        return len(self.waiting)
+
+    def dead(self):
+        """已转入死信的目标的键"""
+        return [key for key, record in self.records.items() if record["dead"]]
+
+    def revive(self):
+        """将死信中的目标恢复为可以爬取，失败次数清零
+
+        Returns:
+            list[str]: 恢复的目标的键
+        """
+        revived = self.dead()
+        for key in revived:
+            record = self.records[key]
+            record["attempts"] = 0
+            record["dead"] = False
+            self.store.put_failure(self.spider, key, 0, record["reason"], False)
+        return revived
+
+    def delay(self, attempts: int):
+        """第 `attempts` 次失败后的等待时间：指数退避，后一半随机"""
+        ceiling = min(self.max_backoff, self.backoff * 2 ** (attempts - 1))
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+    def fail(self, key: str, failure: Failure | str, schedule: bool = True):
+        """记录一次失败，安排重试或者转入死信
+
+        Args:
+            key (str): 目标的键
+            failure (Failure | str): 请求的失败，或者响应正常但没有结果时的失败原因
+            schedule (bool, optional): 是否按退避时间等待，False 时只记录失败，由调用方立即重新排队. Defaults to True.
+
+        Returns:
+            tuple[str, float | None]: 失败原因，以及重试前的等待时间（秒）；转入死信时等待时间为 None
+        """
+        if isinstance(failure, str):
+            reason, permanent = failure, False
+        else:
+            reason = failure_reason(failure)
+            permanent = failure.check(HttpError) and failure.value.response.status in self.permanent_status
+        record = self.records.get(key)
+        attempts = (record["attempts"] if record is not None else 0) + 1
+        dead = bool(permanent) or attempts >= self.max_attempts
+        self.records[key] = {"attempts": attempts, "reason": reason, "dead": dead, "updated_at": time()}
+        self.store.put_failure(self.spider, key, attempts, reason, dead)
+        if dead:
+            return (reason, None)
+        if not schedule:
+            return (reason, 0.0)
+        wait = self.delay(attempts)
+        heapq.heappush(self.waiting, (time() + wait, key))
+        return (reason, wait)
+
+    def succeed(self, key: str):
+        """目标爬取成功，清除失败记录"""
+        if self.records.pop(key, None) is not None:
+            self.store.clear_failure(self.spider, key)
+
+    def due(self):
+        """取出等待时间已到的目标
+
+        Returns:
+            list[str]: 可以放回队尾的目标的键，按到期时间排序
+        """
+        now = time()
+        keys = []
+        while self.waiting and self.waiting[0][0] <= now:
+            keys.append(heapq.heappop(self.waiting)[1])
+        return keys
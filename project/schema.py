@@ -0,0 +1,178 @@
+# 小区详情的列式数据结构
+#
+# 详情页中的信息名称是自由的中文文本，重复出现的名称带有后缀 "2"（见 project.extract.add_info）。
+# 这里将它们映射到固定的英文列名和类型，ParquetPipeline 在爬取时按此写出扁平的 Parquet 文件：
+#
+# - "category": 取值有限的文本（区域、建筑类型等），在 Parquet 中字典编码，pandas 读取为 Categorical；
+# - "int" / "float": 取文本中的第一个数字，例如 "2253户" -> 2253，"35%" -> 35.0，没有数字时为空；
+#   先去掉千位分隔符，"1,280户" -> 1280，"12,345.6元/㎡" -> 12345.6；
+# - "text": 原样保存。
+#
+# 不在映射中的信息保存在 `extra` 列（JSON 对象），不会丢失。原始文本仍以 ItemStore 中的数据为准。
+
+import json
+import re
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any
+
+NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+THOUSANDS_SEPARATOR = re.compile(r"(?<=\d),(?=\d{3}(?!\d))")
+DUPLICATE_SUFFIX = "2"
+
+
+@dataclass(frozen=True, slots=True)
+class Column:
+    name: str
+    kind: str = "text"
+    source: str | None = None  # 详情中的信息名称
+
+
+def parse_number(value: Any, kind: str):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    match = NUMBER.search(THOUSANDS_SEPARATOR.sub("", str(value)))
+    if match is None:
+        return None
+    number = float(match.group())
+    return int(number) if kind == "int" else number
+
+
+class Schema:
+    """将 item 展开为固定列的一行数据：item 的字段、详情中的各项信息，最后是 extra 和 crawled_at"""
+
+    def __init__(self, item_columns: list[Column], info_columns: list[Column]):
+        self.item_columns = item_columns
+        self.columns = [*item_columns, *info_columns, Column("extra"), Column("crawled_at", "timestamp")]
+        self.by_source = {x.source: x for x in info_columns}
+
+    @property
+    def names(self):
+        return [x.name for x in self.columns]
+
+    def normalize_key(self, key: str):
+        """详情中的信息名称对应的列，没有对应的列时返回 None"""
+        return self.by_source.get(key)
+
+    def convert(self, column: Column, value: Any):
+        if column.kind in ("int", "float"):
+            return parse_number(value, column.kind)
+        return value if value is None else str(value)
+
+    def normalize(self, item: dict[str, Any], info_field: str = "info"):
+        """
+        Args:
+            item (dict[str, Any]): 爬虫输出的数据
+            info_field (str, optional): 详情所在的字段. Defaults to "info".
+
+        Returns:
+            dict[str, Any]: 以列名为键的一行数据
+        """
+        row: dict[str, Any] = dict.fromkeys(self.names)
+        for column in self.item_columns:
+            row[column.name] = self.convert(column, item.get(column.name))
+        extra = {}
+        for key, value in (item.get(info_field) or {}).items():
+            column = self.normalize_key(key)
+            if column is None:
+                extra[key] = value
+            else:
+                row[column.name] = self.convert(column, value)
+        row["extra"] = json.dumps(extra, ensure_ascii=False) if extra else None
+        row["crawled_at"] = datetime.now(timezone.utc)
+        return row
+
+    def arrow_schema(self):
+        import pyarrow as pa
+
+        types = {
+            "text": pa.string(),
+            "category": pa.dictionary(pa.int32(), pa.string()),
+            "int": pa.int64(),
+            "float": pa.float64(),
+            "timestamp": pa.timestamp("ms", tz="UTC"),
+        }
+        return pa.schema([(x.name, types[x.kind]) for x in self.columns])
+
+
+def info_columns(fields: list[tuple[str, str, str]], duplicated: set[str]):
+    """由 (信息名称, 列名, 类型) 生成列；`duplicated` 中的信息名称还会生成带 "2" 后缀的列"""
+    columns = [Column(name, kind, source) for source, name, kind in fields]
+    columns += [
+        Column(f"{name}_2", kind, source + DUPLICATE_SUFFIX) for source, name, kind in fields if source in duplicated
+    ]
+    return columns
+
+
+COMMUNITY_INFO_FIELDS = [
+    ("物业类别", "property_category", "category"),
+    ("物业类型", "property_type", "category"),
+    ("建筑类别", "building_category", "category"),
+    ("建筑类型", "building_type", "category"),
+    ("项目特色", "features", "text"),
+    ("装修状况", "decoration", "category"),
+    ("装修标准", "decoration_standard", "text"),
+    ("产权年限", "tenure", "category"),
+    ("产权描述", "tenure_desc", "category"),
+    ("环线位置", "ring_road", "category"),
+    ("所属区域", "region", "category"),
+    ("开发商", "developer", "text"),
+    ("物业公司", "property_company", "text"),
+    ("楼盘地址", "project_address", "text"),
+    ("小区地址", "address", "text"),
+    ("销售状态", "sale_status", "category"),
+    ("开盘时间", "opening_date", "text"),
+    ("交房时间", "delivery_date", "text"),
+    ("竣工时间", "completion_date", "text"),
+    ("建筑年代", "built_year", "int"),
+    ("售楼地址", "sales_address", "text"),
+    ("咨询电话", "consult_phone", "text"),
+    ("售楼电话", "sales_phone", "text"),
+    ("主力户型", "main_layouts", "text"),
+    ("预售许可证", "presale_license", "text"),
+    ("占地面积", "land_area", "float"),
+    ("建筑面积", "floor_area", "float"),
+    ("容积率", "plot_ratio", "float"),
+    ("绿化率", "green_ratio", "float"),
+    ("楼栋总数", "building_count", "int"),
+    ("总户数", "households", "int"),
+    ("房屋总数", "houses", "int"),
+    ("本月均价", "average_price", "float"),
+    ("物业费", "property_fee", "float"),
+    ("物业费描述", "property_fee_desc", "text"),
+    ("停车位", "parking", "text"),
+    ("停车位描述", "parking_desc", "text"),
+    ("楼层状况", "floor_desc", "text"),
+    ("总层数", "total_floors", "int"),
+    ("标准层面积", "standard_floor_area", "float"),
+    ("开间面积", "bay_area", "text"),
+    ("层高", "floor_height", "float"),
+    ("电梯数量", "elevator_count", "text"),
+    ("供暖", "heating", "category"),
+    ("供电", "power", "category"),
+    ("供水", "water", "category"),
+    ("供气", "gas", "category"),
+    ("通讯设备", "telecom", "text"),
+    ("安全管理", "security", "text"),
+    ("卫生服务", "sanitation", "text"),
+    ("小区入口", "entrance", "text"),
+    ("附加信息", "additional_info", "text"),
+]
+
+# 页面中出现过两次的信息（第二次带 "2" 后缀）
+COMMUNITY_INFO_DUPLICATED = {
+    "物业类型", "建筑类型", "装修状况", "环线位置", "所属区域", "开发商", "物业公司", "小区地址", "竣工时间",
+    "占地面积", "建筑面积", "容积率", "绿化率", "物业费", "停车位", "总层数", "标准层面积", "开间面积", "层高", "供暖",
+}
+
+COMMUNITY_INFO = Schema(
+    [
+        Column("link"),
+        Column("name"),
+        Column("city", "category"),
+        Column("district", "category"),
+        Column("type", "category"),
+        Column("page_on_list", "int"),
+    ],
+    info_columns(COMMUNITY_INFO_FIELDS, COMMUNITY_INFO_DUPLICATED)
+)
@@ -0,0 +1,395 @@
+# 多个进程、多台机器共享的待爬取队列
+#
+# Frontier 只在一个进程内有效，两个进程爬取同一个城市时会重复请求相同的页面。
+# 这里把目标保存在共享的后端中，每个进程（worker）按租约领取目标：
+#
+# - 领取（claim）：把等待中的目标，或者租约已经过期的目标，租给当前 worker `lease` 秒；
+# - 完成（complete）：标记目标已完成，其他 worker 不会再领取；
+# - 释放（release）：放回等待状态，例如遇到验证页面需要稍后重试，或者 worker 正常退出；
+# - 续约（renew）：延长当前 worker 持有的租约。worker 崩溃后不再续约，租约过期后目标由其他 worker 领取。
+#
+# 后端有两种：
+#
+# - SqliteFrontier: 同一台机器上的多个进程共享一个 SQLite 文件；
+# - HttpFrontier: 通过 HTTP 访问远程的队列服务，协议见 project.mock.frontier（本地替身，内部使用 SqliteFrontier）。
+#
+# 目标以 JSON 保存（dataclass 的字段），领取时重新构造。同一次爬取的所有 worker 使用相同的队列名称
+# `<爬虫名称>:<城市>:<FRONTIER_RUN>`；需要重新爬取已完成的目标时（例如增量刷新），使用新的 FRONTIER_RUN。
+#
+#     python -m project.sharedfrontier stats community_info:郑州:default
+#     python -m project.sharedfrontier reset community_info:郑州:default
+
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import urllib.request
+from dataclasses import asdict
+from pathlib import Path
+from time import time
+from typing import Callable, Iterable, TypeVar
+
+from project.cities import current_city
+from project.frontier import Frontier
+from project.store import items_stored
+
+ROOT_DIR = Path(__file__).parent / ".."
+
+T = TypeVar("T")
+
+PENDING = 0
+LEASED = 1
+DONE = 2
+STATE_NAMES = {PENDING: "pending", LEASED: "leased", DONE: "done"}
+
+
+class SqliteFrontier:
+    """SQLite 后端，使用 `BEGIN IMMEDIATE` 保证多个进程不会领取到同一个目标"""
+
+    def __init__(self, path: str | Path, timeout: float = 30.0):
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS targets (
+                frontier TEXT NOT NULL,
+                key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                state INTEGER NOT NULL DEFAULT 0,
+                owner TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                seq INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (frontier, key)
+            ) WITHOUT ROWID
+            """
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS targets_state ON targets (frontier, state, seq)")
+
+    def transaction(self):
+        connection = self.connection
+
+        class Transaction:
+            def __enter__(self):
+                connection.execute("BEGIN IMMEDIATE")
+                return connection
+
+            def __exit__(self, exc_type, exc, tb):
+                connection.execute("COMMIT" if exc_type is None else "ROLLBACK")
+
+        return Transaction()
+
+    def add(self, frontier: str, items: list[tuple[str, str, bool]]):
+        """加入目标，已有的目标保持原来的状态和顺序，`done` 为真的目标直接标记为完成
+
+        Args:
+            frontier (str): 队列名称
+            items (list[tuple[str, str, bool]]): (键, JSON, 是否已完成)
+
+        Returns:
+            int: 新加入的等待中目标数量
+        """
+        now = time()
+        with self.transaction() as connection:
+            seq = connection.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM targets WHERE frontier = ?", (frontier,)
+            ).fetchone()[0]
+            before = self.count(frontier, PENDING)
+            connection.executemany(
+                """
+                INSERT INTO targets (frontier, key, payload, state, seq, updated_at) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (frontier, key) DO UPDATE SET state = excluded.state, owner = NULL, lease_until = NULL
+                WHERE excluded.state = 2
+                """,
+                [(frontier, key, payload, DONE if done else PENDING, seq + i + 1, now) for i, (key, payload, done) in enumerate(items)]
+            )
+            return self.count(frontier, PENDING) - before
+
+    def count(self, frontier: str, state: int):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM targets WHERE frontier = ? AND state = ?", (frontier, state)
+        ).fetchone()[0]
+
+    def claim(self, frontier: str, worker: str, n: int, lease: float):
+        """领取最多 n 个目标：先领取租约过期的目标，再按加入顺序领取等待中的目标
+
+        Returns:
+            list[tuple[str, str]]: (键, JSON)
+        """
+        now = time()
+        with self.transaction() as connection:
+            rows = connection.execute(
+                "SELECT key, payload FROM targets WHERE frontier = ? AND state = 1 AND lease_until < ? ORDER BY seq LIMIT ?",
+                (frontier, now, n)
+            ).fetchall()
+            if len(rows) < n:
+                rows += connection.execute(
+                    "SELECT key, payload FROM targets WHERE frontier = ? AND state = 0 ORDER BY seq LIMIT ?",
+                    (frontier, n - len(rows))
+                ).fetchall()
+            connection.executemany(
+                """
+                UPDATE targets SET state = 1, owner = ?, lease_until = ?, attempts = attempts + 1, updated_at = ?
+                WHERE frontier = ? AND key = ?
+                """,
+                [(worker, now + lease, now, frontier, key) for key, _ in rows]
+            )
+        return rows
+
+    def complete(self, frontier: str, keys: list[str]):
+        now = time()
+        with self.transaction() as connection:
+            connection.executemany(
+                "UPDATE targets SET state = 2, owner = NULL, lease_until = NULL, updated_at = ? WHERE frontier = ? AND key = ?",
+                [(now, frontier, key) for key in keys]
+            )
+
+    def release(self, frontier: str, worker: str, keys: list[str]):
+        """把当前 worker 持有的目标放回等待状态，排到队尾"""
+        now = time()
+        with self.transaction() as connection:
+            seq = connection.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM targets WHERE frontier = ?", (frontier,)
+            ).fetchone()[0]
+            connection.executemany(
+                """
+                UPDATE targets SET state = 0, owner = NULL, lease_until = NULL, seq = ?, updated_at = ?
+                WHERE frontier = ? AND key = ? AND state = 1 AND owner = ?
+                """,
+                [(seq + i + 1, now, frontier, key, worker) for i, key in enumerate(keys)]
+            )
+
+    def renew(self, frontier: str, worker: str, keys: list[str], lease: float):
+        now = time()
+        with self.transaction() as connection:
+            connection.executemany(
+                "UPDATE targets SET lease_until = ? WHERE frontier = ? AND key = ? AND state = 1 AND owner = ?",
+                [(now + lease, frontier, key, worker) for key in keys]
+            )
+
+    def stats(self, frontier: str):
+        rows = self.connection.execute(
+            "SELECT state, COUNT(*) FROM targets WHERE frontier = ? GROUP BY state", (frontier,)
+        ).fetchall()
+        counts = {name: 0 for name in STATE_NAMES.values()}
+        counts.update({STATE_NAMES[state]: n for state, n in rows})
+        counts["expired"] = self.connection.execute(
+            "SELECT COUNT(*) FROM targets WHERE frontier = ? AND state = 1 AND lease_until < ?", (frontier, time())
+        ).fetchone()[0]
+        return counts
+
+    def reset(self, frontier: str):
+        with self.transaction() as connection:
+            return connection.execute("DELETE FROM targets WHERE frontier = ?", (frontier,)).rowcount
+
+    def close(self):
+        self.connection.close()
+
+
+class HttpFrontier:
+    """HTTP 后端：每个操作是一个 `POST <url>/<操作>` 请求，请求和响应都是 JSON，参数与 SqliteFrontier 相同
+
+    请求在 reactor 线程中同步发出，领取和完成都是批量操作，每批只需要一次往返。
+    """
+
+    def __init__(self, url: str, timeout: float = 10.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def call(self, operation: str, **params):
+        request = urllib.request.Request(
+            f"{self.url}/{operation}",
+            data=json.dumps(params, ensure_ascii=False).encode("UTF-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())["result"]
+
+    def add(self, frontier: str, items: list[tuple[str, str, bool]]):
+        return self.call("add", frontier=frontier, items=items)
+
+    def claim(self, frontier: str, worker: str, n: int, lease: float):
+        return [tuple(x) for x in self.call("claim", frontier=frontier, worker=worker, n=n, lease=lease)]
+
+    def complete(self, frontier: str, keys: list[str]):
+        return self.call("complete", frontier=frontier, keys=keys)
+
+    def release(self, frontier: str, worker: str, keys: list[str]):
+        return self.call("release", frontier=frontier, worker=worker, keys=keys)
+
+    def renew(self, frontier: str, worker: str, keys: list[str], lease: float):
+        return self.call("renew", frontier=frontier, worker=worker, keys=keys, lease=lease)
+
+    def stats(self, frontier: str):
+        return self.call("stats", frontier=frontier)
+
+    def reset(self, frontier: str):
+        return self.call("reset", frontier=frontier)
+
+    def close(self):
+        pass
+
+
+class LeasedFrontier(Frontier[T]):
+    """接口与 Frontier 相同、目标保存在共享后端中的队列。
+
+    `pop` 时按批领取目标，缓存在本地的 `pending` 中。`done` 的目标在 `flush` 时才提交：
+    `open_frontier` 把 `flush` 连接到 `items_stored` 信号，数据写入数据库之后才标记完成，
+    worker 崩溃时缓冲区中尚未写入的数据对应的目标仍然持有租约，过期后由其他 worker 重新爬取。
+    在 `extend` 之前调用 `done` 的目标（已经爬取过的目标）在加入时直接标记为完成。
+    """
+
+    def __init__(
+        self,
+        key: Callable[[T], str],
+        factory: Callable[..., T],
+        backend: SqliteFrontier | HttpFrontier,
+        name: str,
+        worker: str,
+        lease: float = 600.0,
+        batch: int = 8
+    ):
+        """
+        Args:
+            key (Callable[[T], str]): 从目标中取出唯一键的函数
+            factory (Callable[..., T]): 由 JSON 中的字段构造目标，通常是目标的 dataclass
+            backend (SqliteFrontier | HttpFrontier): 共享后端
+            name (str): 队列名称
+            worker (str): 当前 worker 的名称，在所有 worker 中唯一
+            lease (float, optional): 租约时长（秒）. Defaults to 600.0.
+            batch (int, optional): 每次领取的目标数量. Defaults to 8.
+        """
+        super().__init__(key)
+        self.factory = factory
+        self.backend = backend
+        self.name = name
+        self.worker = worker
+        self.lease = lease
+        self.batch = max(1, batch)
+        self.completed: list[str] = []
+        self.dropped: list[str] = []
+        self.renewed_at = time()
+
+    def add(self, target: T):
+        return self.extend([target]) > 0
+
+    def extend(self, targets: Iterable[T]):
+        items = []
+        for target in targets:
+            key = self.key(target)
+            items.append((key, json.dumps(asdict(target), ensure_ascii=False), key in self.finished))
+        return self.backend.add(self.name, items)
+
+    def pop(self):
+        if len(self.pending) == 0:
+            for key, payload in self.backend.claim(self.name, self.worker, self.batch, self.lease):
+                self.pending[key] = self.factory(**json.loads(payload))
+        self.renew_if_due()
+        return super().pop()
+
+    def done(self, key: str):
+        if key in self.pending or key in self.in_flight:
+            self.completed.append(key)
+        super().done(key)
+
+    def requeue(self, key: str):
+        """放回共享队列，可能由其他 worker 重新领取"""
+        if self.in_flight.pop(key, None) is not None:
+            self.backend.release(self.name, self.worker, [key])
+
+    def drop(self, key: str):
+        """不再续约，`close` 时释放：当前 worker 不再领取，租约过期后其他 worker 可以领取，下次运行时重新爬取"""
+        if self.in_flight.pop(key, None) is not None or self.pending.pop(key, None) is not None:
+            self.dropped.append(key)
+
+    def flush(self, **kwargs):
+        """提交已完成的目标，作为 `items_stored` 信号的处理函数时忽略信号参数"""
+        if self.completed:
+            self.backend.complete(self.name, self.completed)
+            self.completed = []
+
+    def renew_if_due(self):
+        """每过租约时长的三分之一续约一次"""
+        if time() - self.renewed_at < self.lease / 3:
+            return
+        held = [*self.pending, *self.in_flight, *self.completed]
+        if held:
+            self.backend.renew(self.name, self.worker, held, self.lease)
+        self.renewed_at = time()
+
+    def stats(self):
+        return self.backend.stats(self.name)
+
+    def close(self):
+        """提交完成的目标，释放尚未完成的目标和放弃的目标"""
+        self.flush()
+        held = [*self.pending, *self.in_flight, *self.dropped]
+        if held:
+            self.backend.release(self.name, self.worker, held)
+        self.pending.clear()
+        self.in_flight.clear()
+        self.dropped.clear()
+        self.backend.close()
+
+
+def default_worker():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def open_backend(settings):
+    """根据 FRONTIER_BACKEND 打开共享后端，"local" 时返回 None"""
+    backend = settings.get("FRONTIER_BACKEND", "local")
+    if backend == "local":
+        return None
+    if backend == "sqlite":
+        path = Path(settings.get("FRONTIER_SQLITE_PATH", "frontier.sqlite3"))
+        if not path.is_absolute():
+            path = ROOT_DIR / path
+        return SqliteFrontier(path)
+    if backend == "http":
+        return HttpFrontier(settings.get("FRONTIER_URL", "http://127.0.0.1:8780"))
+    raise ValueError(f"未知的 FRONTIER_BACKEND: {backend}")
+
+
+def open_frontier(crawler, spider_name: str, key: Callable[[T], str], factory: Callable[..., T]) -> Frontier[T]:
+    """按设置创建爬虫的待爬取队列：本进程内的 Frontier，或者共享的 LeasedFrontier
+
+    Args:
+        crawler: Scrapy Crawler，读取设置并连接 `items_stored` 信号
+        spider_name (str): 爬虫名称，与城市和 FRONTIER_RUN 一起组成队列名称
+        key (Callable[[T], str]): 从目标中取出唯一键的函数
+        factory (Callable[..., T]): 由 JSON 中的字段构造目标
+    """
+    settings = crawler.settings
+    backend = open_backend(settings)
+    if backend is None:
+        return Frontier(key)
+    frontier = LeasedFrontier(
+        key,
+        factory,
+        backend,
+        name=f"{spider_name}:{current_city(settings)}:{settings.get('FRONTIER_RUN', 'default')}",
+        worker=settings.get("FRONTIER_WORKER") or default_worker(),
+        lease=settings.getfloat("FRONTIER_LEASE_SECONDS", 600.0),
+        batch=settings.getint("FRONTIER_CLAIM_BATCH", 8),
+    )
+    crawler.signals.connect(frontier.flush, signal=items_stored)
+    return frontier
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="共享待爬取队列的管理")
+    parser.add_argument("command", choices=["stats", "reset"])
+    parser.add_argument("frontier", help="队列名称，例如 community_info:郑州:default")
+    parser.add_argument("--db", type=Path, default=ROOT_DIR / "frontier.sqlite3")
+    parser.add_argument("--url", help="HTTP 后端地址，设置时不使用 --db")
+    args = parser.parse_args()
+    backend = HttpFrontier(args.url) if args.url else SqliteFrontier(args.db)
+    if args.command == "stats":
+        print(json.dumps(backend.stats(args.frontier), ensure_ascii=False))
+    else:
+        print(f"删除了 {backend.reset(args.frontier)} 个目标")
+    backend.close()
@@ -1,45 +1,57 @@
-import random
-from time import sleep
 import scrapy
 import scrapy.http
 import scrapy.utils
 import scrapy.utils.url
 from project.items import CommunityItem
-from scrapy import Spider
-import pandas as pd
+from project.cities import current_city, targets_from_settings
+from project.frontier import Frontier
+from project.sharedfrontier import open_frontier
+from project.store import ItemStore, content_hash
+from project.extract import extract_info
+from project.schema import COMMUNITY_INFO
+from project.dedup import deduplicate, fingerprints
+from project.metrics import timed
+from project.offload import ExtractPool
+from project.verification import VerificationRequired
+from project.retry import RetryScheduler
+from scrapy import Spider, signals
+from scrapy.exceptions import DontCloseSpider
 from pathlib import Path
 from dataclasses import dataclass
-from bs4 import BeautifulSoup
-import re
+from time import time
 from twisted.python.failure import Failure
-from scrapy.spidermiddlewares.httperror import HttpError
 
 ROOT_DIR = Path(__file__).parent / ".." / ".."
 
-@dataclass
+@dataclass(slots=True)
 class CommunityTarget:
     """小区目标类。
-    为了便于后面获取数据，这个类可以通过字典创建。
+    加载时就计算好详情链接，爬取过程中不再修改。
     """
     name: str
     link: str
     district: str
-    page_on_list: str
-    undone: bool
     detail_link: str
 
 class CommunityInfoSpider(Spider):
     name = "community_info"
-    custom_settings = {
-        "FEEDS":{
-            "community_info.jsonl":{
-                "format":"jsonl",
-                "overwrite": False
-            }
-        }
-    }
+    item_key = "link"  # 数据库中数据的唯一键，见 ItemStorePipeline
+    item_schema = COMMUNITY_INFO  # 写出 Parquet 时的列，见 ParquetPipeline
     regions: dict[str, str] = {}
-    community_list: pd.DataFrame = pd.DataFrame()
+    frontier: Frontier[CommunityTarget] = Frontier(lambda x: x.link)
+    window: int = 1  # 同时在途的详情页请求数量，可通过 `-a window=8` 设置
+    dedup: int = 1  # 是否合并重复的小区（见 project.dedup），可通过 `-a dedup=0` 关闭
+    refresh: int = 0  # 增量刷新已爬取的小区，只输出有变化的数据，可通过 `-a refresh=1` 开启
+    refresh_age: float = 0  # 增量刷新时跳过最近多少天内检查过的小区，可通过 `-a refresh_age=25` 设置
+    store: ItemStore | None = None
+    validators: dict[str, dict] = {}  # 小区链接 -> 上次检查的 ETag、Last-Modified 和内容哈希
+    content_hashes: dict[str, str] = {}  # 小区链接 -> 数据库中数据的内容哈希
+    detect_verification = True  # 由 VerificationMiddleware 识别验证页面
+    verification_retries: int = 3  # 遇到验证页面或空页面时最多重新排队的次数，可通过 `-a verification_retries=5` 设置
+    blocked_attempts: dict[str, int] = {}  # 小区链接 -> 遇到验证页面或空页面的次数
+    extract_pool: ExtractPool | None = None  # 解析进程池，见 EXTRACT_PROCESSES
+    retries: RetryScheduler | None = None  # 请求失败的小区的退避重试和死信，见 project.retry
+    retry_dead: int = 0  # 重新爬取已转入死信的小区，可通过 `-a retry_dead=1` 开启
 
     def get_url_house_detail(self, url: str):
         """获取小区详情的链接
@@ -56,73 +68,275 @@ class CommunityInfoSpider(Spider):
         url_parts.extend([cid, "housedetail.htm"])
         return "/".join(url_parts)  # 将 url 各个部分重新组合后返回
 
-    def find_next(self):
-        """查找下一个需要爬取的小区
+    def make_target(self, community: dict[str, str]):
+        """根据列表中的一条记录创建小区目标，跳过写字楼和商铺
+
+        Args:
+            community (dict[str, str]): 小区列表中的一行
 
         Returns:
-            CommunityTarget: 下一个小区的信息
-            None: 当没有下一个小区时，返回 None
+            CommunityTarget: 小区目标
+            None: 当小区不需要爬取时，返回 None
         """
-        undone = self.community_list.loc[self.community_list["undone"], :]
-        # print("undone", undone.head(1))
-        if undone.shape[0] > 0:
-            for irow in range(undone.shape[0]):
-                community: dict[str, str] = undone.iloc[irow, :].to_dict()
-                if community["district"].strip().endswith("_old"):
-                    community_link: str = community["link"]
-                    if community_link.startswith("/loupan/office") or community_link.startswith("/loupan/shop"):
-                        self.community_list.loc[community_link, "undone"] = False
-                        continue
-                    region_url = self.regions[community["district"]]
-                    full_link = f"{region_url}{community_link}"
-                    community["detail_link"] = self.get_url_house_detail(full_link)
-                elif community["district"].strip().endswith("_new"):
-                    community["detail_link"] = self.get_url_house_detail(community["link"])
-                return CommunityTarget(**community)
+        district = community["district"].strip()
+        community_link: str = community["link"]
+        if district.endswith("_old"):
+            if community_link.startswith("/loupan/office") or community_link.startswith("/loupan/shop"):
+                return None
+            region_url = self.regions[community["district"]]
+            detail_link = self.get_url_house_detail(f"{region_url}{community_link}")
+        elif district.endswith("_new"):
+            detail_link = self.get_url_house_detail(community_link)
         else:
-            self.logger.info("注意：所有数据已爬取完毕")
             return None
+        return CommunityTarget(
+            name=community["name"],
+            link=community_link,
+            district=community["district"],
+            detail_link=detail_link
+        )
+
+    def load_targets(self, store: ItemStore):
+        """读取小区列表，只在加载时过滤一次
+
+        Yields:
+            CommunityTarget: 需要爬取的小区
+        """
+        for community in store.items("community_list"):
+            target = self.make_target(community)
+            if target is not None:
+                yield target
+
+    def next_requests(self):
+        """补足在途请求窗口
+
+        响应可能乱序返回，因此进度按照小区链接记录，而不是按照请求顺序。
+
+        等待退避重试的小区仍然在途，但不占用窗口；等待时间已到的小区先放回队尾。
+
+        Yields:
+            scrapy.Request: 下一批小区详情请求，直到在途数量达到 `window`
+        """
+        for link in self.retries.due():
+            self.frontier.requeue(link)
+        while self.frontier.in_flight_count - len(self.retries) < self.window:
+            next_community = self.frontier.pop()
+            if next_community is None:
+                if self.frontier.in_flight_count == 0:
+                    self.logger.info("注意：所有数据已爬取完毕")
+                break
+            headers = self.conditional_headers(next_community.link)
+            yield scrapy.Request(
+                url=next_community.detail_link,
+                callback=self.parse,
+                errback=self.error_back,
+                headers=headers,
+                meta={"handle_httpstatus_list": [304]} if headers else {},
+                dont_filter=True,  # 遇到验证页面重新排队时链接与之前相同
+                cb_kwargs={
+                    "community": next_community
+                }
+            )
+
+    def conditional_headers(self, link: str):
+        """增量刷新时根据上次的检查结果设置条件请求头"""
+        validator = self.validators.get(link)
+        headers = {}
+        if validator is not None:
+            if validator["etag"]:
+                headers["If-None-Match"] = validator["etag"]
+            if validator["last_modified"]:
+                headers["If-Modified-Since"] = validator["last_modified"]
+        return headers
+
+    def plan_refresh(self, store: ItemStore, targets):
+        """安排增量刷新
+
+        跳过 `refresh_age` 天内检查过的小区，其余小区按从未爬取、最久未检查的顺序排队。
+        检查记录中的内容哈希与数据库中的数据一致时才使用其中的 ETag 和 Last-Modified，
+        否则（例如上次写入数据前被中断）重新完整地爬取。
+
+        Returns:
+            list[CommunityTarget]: 排好顺序的小区
+        """
+        validators = store.validators(self.name)
+        self.content_hashes = {item["link"]: content_hash(item["info"]) for item in store.items(self.name)}
+        checked_after = time() - float(self.refresh_age) * 86400
+        planned = []
+        skipped = 0
+        for target in targets:
+            known_hash = self.content_hashes.get(target.link)
+            validator = validators.get(target.link)
+            checked_at = 0.0
+            if validator is not None and validator["content_hash"] == known_hash:
+                if validator["checked_at"] >= checked_after:
+                    self.frontier.done(target.link)
+                    skipped += 1
+                    continue
+                self.validators[target.link] = validator
+                checked_at = validator["checked_at"]
+            planned.append((known_hash is not None, checked_at, target))
+        planned.sort(key=lambda x: x[:2])
+        self.logger.info("增量刷新：跳过最近检查过的小区 %d 个", skipped)
+        return [target for _, _, target in planned]
+
+    def record_check(self, response: scrapy.http.Response, link: str, info_hash: str):
+        """记录小区的检查结果，下次增量刷新时使用
+
+        304 响应可能不包含 ETag 和 Last-Modified，此时沿用上次的值。
+        """
+        previous = self.validators.get(link, {}) if response.status == 304 else {}
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        self.store.put_validator(
+            self.name,
+            link,
+            etag.decode("latin1") if etag else previous.get("etag"),
+            last_modified.decode("latin1") if last_modified else previous.get("last_modified"),
+            info_hash
+        )
+
+    def retry_blocked(self, community: CommunityTarget, reason: str):
+        """遇到验证页面或空页面时将小区放回队尾，稍后重新爬取
+
+        超过 `verification_retries` 次后放弃，本次不再爬取，也不写入数据，记为一次失败（见 project.retry），
+        下次运行时重新爬取；多次运行都放弃的小区转入死信。
+        """
+        attempts = self.blocked_attempts.get(community.link, 0) + 1
+        self.blocked_attempts[community.link] = attempts
+        if attempts > int(self.verification_retries):
+            self.logger.error("多次遇到验证页面，放弃 %s (%s)", community.link, reason)
+            self.crawler.stats.inc_value("verification/gave_up")
+            _, wait = self.retries.fail(community.link, f"verification_{reason}", schedule=False)
+            if wait is None:
+                self.crawler.stats.inc_value("retry/dead_letter")
+                self.frontier.done(community.link)
+            else:
+                self.frontier.drop(community.link)
+        else:
+            self.crawler.stats.inc_value("verification/requeued")
+            self.frontier.requeue(community.link)
+
+    def retry_failed(self, community: CommunityTarget, failure: Failure):
+        """请求失败（HTTP 错误、DNS 错误、超时、连接中断等）时退避后重试，多次失败后转入死信
+
+        死信中的小区本次和之后的运行都不再爬取，直到使用 `-a retry_dead=1` 运行。
+        """
+        reason, wait = self.retries.fail(community.link, failure)
+        self.crawler.stats.inc_value(f"retry/reason/{reason}")
+        if wait is None:
+            self.logger.error("请求失败，转入死信 %s (%s)", community.detail_link, reason)
+            self.crawler.stats.inc_value("retry/dead_letter")
+            self.frontier.done(community.link)
+        else:
+            self.logger.warning("请求失败 %s (%s)，%.0f 秒后重试", community.detail_link, reason, wait)
+            self.crawler.stats.inc_value("retry/scheduled")
+
+    def finish(self, community: CommunityTarget):
+        """标记小区已爬取，并释放其在途窗口，清除失败记录
+        """
+        self.frontier.done(community.link)
+        self.retries.succeed(community.link)
+
+    def spider_idle(self):
+        """还有等待退避重试的小区时不关闭爬虫，每次空闲（约 5 秒）检查一次是否到期"""
+        if self.retries is None or len(self.retries) == 0:
+            return
+        for request in self.next_requests():
+            self.crawler.engine.crawl(request)
+        raise DontCloseSpider
   
     def start_requests(self):
         """爬虫启动准备
         """
-        '''提取每个区 URL 的协议和域名，因为获取的小区链接中只有路径，没有协议和域名
+        self.window = max(1, int(self.window))
+        self.extract_pool = ExtractPool.from_settings(self.settings)
+        self.frontier = open_frontier(self.crawler, self.name, lambda x: x.link, CommunityTarget)
+        '''提取当前城市每个区 URL 的协议和域名，因为获取的小区链接中只有路径，没有协议和域名
         '''
-        targets = pd.read_csv(ROOT_DIR / "targets.csv")
-        for row in targets.itertuples():
-            region_key = f"{row.region}_{row.type}"
+        self.regions = {}
+        for row in targets_from_settings(self.settings):
             url_com = scrapy.utils.url.urlparse(row.url)  # 将 URL 解析称为不同部分，提取协议和域名
             region_url = f"{url_com.scheme}://{url_com.netloc}"
-            self.regions[region_key] = region_url
-        '''读取小区列表，设置一列表示是否已经爬取的信息，以便于记录进度
-        '''
-        self.community_list = pd.read_json(ROOT_DIR / "community_list.jsonl", lines=True).set_index("link", drop=False)
-        if "undone" not in self.community_list.columns:
-            self.community_list["undone"] = True
-        '''读取已爬取数据
+            self.regions[row.key] = region_url
+        self.validators = {}
+        self.content_hashes = {}
+        self.blocked_attempts = {}
+        if self.store is None:
+            '''通常由 ItemStorePipeline 提供，检查结果与数据在同一个事务中提交；没有启用管道时自己打开
+            '''
+            self.store = ItemStore.from_settings(self.settings)
+        store = self.store  # 爬取过程中保持打开，记录每个小区的检查结果
+        self.retries = RetryScheduler.from_settings(self.settings, store, self.name)
+        self.crawler.signals.connect(self.spider_idle, signal=signals.spider_idle)
+        '''读取已爬取数据的键，死信中的小区同样不再爬取
         '''
-        community_info_file = ROOT_DIR / "community_info.jsonl"
-        if community_info_file.exists():  # 如果文件存在，读取文件
-            community_info = pd.read_json(community_info_file, lines=True)
-            if community_info.shape[0] > 0:  # 如果文件有内容，将对应小区设置为已爬取
-                self.community_list.loc[community_info["link"].tolist(), "undone"] = False
-        '''获取下一个要爬取的小区
+        known = set(store.keys(self.name))
+        if int(self.retry_dead):
+            self.logger.info("重新爬取死信中的小区 %d 个", len(self.retries.revive()))
+        else:
+            dead = self.retries.dead()
+            for link in dead:
+                self.frontier.done(link)
+            self.logger.info("跳过死信中的小区 %d 个", len(dead))
+        '''读取小区列表，加入待爬取队列
         '''
-        next_community = self.find_next()
-        if next_community is not None:
-            yield scrapy.Request(
-                url=next_community.detail_link,
-                callback=self.parse,
-                errback=self.error_back,
-                cb_kwargs={
-                    "community": next_community
-                }
+        targets = self.load_targets(store)
+        if int(self.dedup):
+            '''合并重复的小区，重复小区与保留小区的对应关系保存在 community_alias 中
+            列表中没有地址，只按链接中的小区编号合并，同名的小区不合并
+            '''
+            result = deduplicate(
+                targets,
+                key=lambda x: x.link,
+                fingerprint=lambda x: fingerprints(x.link),
+                finished=known,
+                preference=lambda x: not x.district.endswith("_old")
             )
-        
+            for link, canonical in result.duplicates.items():
+                store.put("community_alias", link, {"link": link, "canonical": canonical})
+            targets = result.kept
+            self.crawler.stats.set_value("dedup/duplicates", len(result.duplicates))
+            self.crawler.stats.set_value("dedup/saved_requests", result.saved)
+            self.logger.info("合并重复小区 %d 个，节省详情页请求 %d 个", len(result.duplicates), result.saved)
+        if int(self.refresh):
+            targets = self.plan_refresh(store, targets)
+        else:
+            '''已爬取的小区设置为已爬取
+            '''
+            for link in known:
+                self.frontier.done(link)
+        added = self.frontier.extend(targets)
+        self.logger.info("待爬取小区 %d 个", added)
+        '''获取下一批要爬取的小区
+        '''
+        yield from self.next_requests()
+
+
+    def parse_items(self, response: scrapy.http.Response, community: CommunityTarget):
+        """从小区详情页面中提取数据，不修改爬虫状态，离线重新解析时也使用这个方法
+
+        Yields:
+            CommunityItem: 小区数据
+        """
+        info_dict = extract_info(response.text, community.district, self.settings.get("HTML_EXTRACTOR", "bs4"))
+        yield self.make_item(community, info_dict)
 
-    def parse(self, response: scrapy.http.Response, community: CommunityTarget):
+    def make_item(self, community: CommunityTarget, info_dict: dict[str, str]):
+        return CommunityItem(
+            name=community.name.strip(),
+            link=community.link,
+            city=current_city(self.settings),
+            district=community.district.split("_")[0],
+            info=info_dict
+        )
+
+    @timed
+    async def parse(self, response: scrapy.http.Response, community: CommunityTarget):
         """解析小区详情页面
 
+        设置了 EXTRACT_PROCESSES 时在进程池中提取详情（见 project.offload），等待期间不占用 reactor 线程。
+
         Args:
             response (scrapy.http.Response): HTTP 响应
             community (CommunityTarget): 小区其他信息
@@ -131,75 +345,66 @@ class CommunityInfoSpider(Spider):
             CommunityItem: 小区数据
             scrapy.http.Request: 下一个请求
         """
-        if re.search("...", response.text) is not None:
-            self.logger.error("请手动验证")
+        if response.status == 304:
+            '''页面没有变化
+            '''
+            self.crawler.stats.inc_value("refresh/not_modified")
+            self.record_check(response, community.link, self.validators[community.link]["content_hash"])
+            self.finish(community)
+            for request in self.next_requests():
+                yield request
             return
-        info_dict: dict[str, str] = {}
-        if community.district.endswith("old"):
-            village_info = response.css("div.village_info.base_info")
-            for part in village_info:
-                info = part.css("li")
-                for item in info:
-                    info_key: str = item.css("li *:first-child::text").get()
-                    info_key = re.subn(r"\s", "", info_key)[0]
-                    info_value: str = " ".join(item.css("li *:last-child *::text").getall())
-                    if info_key in info_dict.keys():
-                        info_key += "2"
-                    info_dict[info_key] = info_value
-        elif community.district.endswith("new"):
-            '''由于HTML原始数据中有错误，所以只能使用更强大的 BeautifulSoup 库进行解析。
+        engine = self.settings.get("HTML_EXTRACTOR", "bs4")
+        if self.extract_pool is not None:
+            info_dict = await self.extract_pool.extract(extract_info, response, community.district, engine)
+        else:
+            info_dict = extract_info(response.text, community.district, engine)
+        item = self.make_item(community, info_dict)
+        if not item["info"]:
+            '''没有找到任何信息，可能是没有识别出的验证页面，不输出空数据
             '''
-            soup = BeautifulSoup(response.text, "html.parser")
-            blocks = soup.find("div", class_="main-left").find_all("div", class_="main-item")
-            blocks_list = [x for x in [x.find("ul", class_="list") for x in blocks] if x is not None]
-            for block in blocks_list:
-                infos = block.find_all("li")
-                for item in infos:
-                    key_elem, value_elem = list(item.children)[:2]
-                    if key_elem is None:
-                        continue
-                    info_key, _ = re.subn(r"[\s\n：]", "", "".join(key_elem.stripped_strings))  # 使用正则表达式，将空白字符 (\s) 或者中文冒号 (：) 替换为空字符串
-                    if value_elem is None:
-                        continue
-                    info_value = " ".join(value_elem.stripped_strings)  # 保留一个空格，以便于后期处理数据
-                    if info_key in info_dict.keys():
-                        info_key += "2"
-                    info_dict[info_key] = info_value
-        '''如果没有找到任何信息，表示可能需要进行验证
-        '''
-        yield CommunityItem(
-            name=community.name.strip(),
-            link=community.link,
-            district=community.district.split("_")[0],
-            info=info_dict
-        )
-        self.community_list.loc[community.link, "undone"] = False
+            self.crawler.stats.inc_value("verification/empty_info")
+            self.retry_blocked(community, "empty_info")
+            for request in self.next_requests():
+                yield request
+            return
+        info_hash = content_hash(item["info"])
+        self.record_check(response, community.link, info_hash)
+        known_hash = self.content_hashes.get(community.link)
+        if known_hash is None:
+            if int(self.refresh):
+                self.crawler.stats.inc_value("refresh/new")
+            yield item
+        elif known_hash == info_hash:
+            '''内容没有变化，不输出数据
+            '''
+            self.crawler.stats.inc_value("refresh/unchanged")
+        else:
+            self.crawler.stats.inc_value("refresh/changed")
+            yield item
+        self.finish(community)
         '''获取下一页链接
         '''
-        next_community = self.find_next()
-        if next_community is not None:
-            sleep(1 + random.uniform(0, 1))
-            yield response.follow(url=next_community.detail_link, callback=self.parse, errback=self.error_back, cb_kwargs={
-                "community": next_community
-            })
+        for request in self.next_requests():
+            yield request
     
-    def error_back(self, failure):
-        self.logger.error(failure)
-        if failure.check(HttpError):
-            response: scrapy.http.HtmlResponse = failure.value.response
-            self.logger.error("HttpError on %s", response.url)
-            community: CommunityTarget = failure.request.cb_kwargs["community"]
-            self.community_list.loc[community.link, "undone"] = False
-            next_community = self.find_next()
-            if next_community is not None:
-                sleep(1 + random.uniform(0, 1))
-                yield response.follow(
-                    url=next_community.detail_link,
-                    callback=self.parse,
-                    errback=self.error_back,
-                    cb_kwargs={
-                        "community": next_community
-                    }
-                )
-            
-                        
+    @timed
+    def error_back(self, failure: Failure):
+        """请求失败：验证页面重新排队，其他错误退避后重试，然后补足在途窗口"""
+        community: CommunityTarget = failure.request.cb_kwargs["community"]
+        if failure.check(VerificationRequired):
+            self.retry_blocked(community, failure.value.reason)
+        else:
+            self.retry_failed(community, failure)
+        yield from self.next_requests()
+
+    def closed(self, reason):
+        self.frontier.close()
+        if self.extract_pool is not None:
+            self.logger.info(
+                "进程池解析 %d 个页面，达到上限 %d 而等待 %d 次",
+                self.extract_pool.submitted, self.extract_pool.max_pending, self.extract_pool.waited
+            )
+            self.extract_pool.close()
+        if self.store is not None:
+            self.store.close()
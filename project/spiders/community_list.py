@@ -1,123 +1,257 @@
-import random
-from time import sleep
 from typing import Iterable
 from scrapy.http import response
 import scrapy
 import scrapy.utils
 import scrapy.utils.url
 from project.items import CommunityItem
+from project.checkpoint import ProgressJournal
+from project.cities import RegionTarget, city_path, current_city, targets_from_settings
+from project.extract import extract_list
+from project.metrics import timed
+from project.offload import ExtractPool
+from project.store import ItemStore, items_stored
 from scrapy import Spider
-import pandas as pd
-import json
 from pathlib import Path
 
+ROOT_DIR = Path(__file__).parent / ".." / ".."
+
 class CommunityListSpider(Spider):
     name = "community_list"
-    custom_settings = {
-        "FEEDS":{
-            "community_list.jsonl":{
-                "format":"jsonl",
-                "overwrite": False
-            }
-        }
-    }
-    progress: dict[str, int] = {}
-    targets: None | pd.DataFrame = None
-
-    def save_progress(self):
-        Path("progress.json").write_text(json.dumps(self.progress, ensure_ascii=False, indent=2), encoding="UTF-8")
+    item_key = "link"  # 数据库中数据的唯一键，见 ItemStorePipeline
+    progress: ProgressJournal | None = None
+    targets: list[RegionTarget] = []
+    fanout: int = 0  # 按页码直接生成所有列表页的链接并同时请求，可通过 `-a fanout=1` 开启
+    page_size: int = 20  # 每个列表页的小区数量，用于发现不完整的页面
+    refetch: int = 2  # 列表页的小区数量不足时最多重新请求的次数，可通过 `-a refetch=3` 设置
+    page_counts: dict[tuple[str, int], int] = {}  # (区域, 页码) -> 已获取的小区数量
+    page_attempts: dict[tuple[str, int], int] = {}  # (区域, 页码) -> 重新请求的次数
+    extract_pool: ExtractPool | None = None  # 解析进程池，见 EXTRACT_PROCESSES
+
+    def resume_point(self, target: RegionTarget):
+        """按进度查找区域中下一个需要爬取的列表页
+
+        Returns:
+            tuple[str, int]: 列表页链接和页码
+            None: 该区域已爬取完毕
+        """
+        region_progress = self.progress.get(target.key)
+        if region_progress is None:
+            return (target.url, 1)
+        elif region_progress["page"] >= target.page_nb or region_progress["next"] is None:
+            return None
+        else:
+            next_path = region_progress["next"]
+            base_url = scrapy.utils.url.urlparse(target.url)
+            url = f"{base_url.scheme}://{base_url.netloc}{next_path}"
+            return (url, region_progress["page"] + 1)
 
     def find_next_target(self):
-        for target in self.targets.itertuples():
-            region_name = target[1]
-            region_url = target[2]
-            region_type = target[6]
-            region_key = f"{region_name}_{region_type}"
-            region_pages = target[4]
-            if region_key in self.progress.keys():
-                region_progress = self.progress[region_key]
-                if region_progress["page"] >= region_pages:
-                    print(f"注意： {region_key} 已经爬取完毕")
-                else:
-                    self.progress[region_key]["page"] += 1
-                    next_path = region_progress["next"]
-                    base_url = scrapy.utils.url.urlparse(region_url)
-                    url = f"{base_url.scheme}://{base_url.netloc}{next_path}"
-                    if url is None:
-                        return (region_key, region_url)
-                    else:
-                        return (region_key, url)
-            else:
-                self.progress[region_key] = {
-                    "page": 1,
-                    "next": None
-                }
-                return (region_key, region_url)
+        """查找下一个需要爬取的列表页
+
+        Returns:
+            tuple[str, str, int]: 区域名称、列表页链接和页码
+            None: 当所有区域都已爬取完毕时，返回 None
+        """
+        for target in self.targets:
+            resume = self.resume_point(target)
+            if resume is not None:
+                return (target.key, *resume)
         return None
-  
+
     def start_requests(self):
         '''
-        爬取所有目标网址
+        爬取当前城市（设置 CITY）的所有目标网址，进度保存在这个城市的目录中
         '''
-        progress_file = Path("progress.json")
-        if progress_file.exists():
-            self.progress = json.loads(progress_file.read_text(encoding="UTF-8"))
-        self.targets = pd.read_csv(r"/Users/yigong/Code/test/fangtianxia/targets.csv")  # r后面是文件的绝对路径，右键copy path获取路径
+        self.targets = targets_from_settings(self.settings)
+        if len(self.targets) == 0:
+            self.logger.error("targets.csv 中没有城市 %s 的区域", current_city(self.settings))
+            return
+        self.extract_pool = ExtractPool.from_settings(self.settings)
+        self.progress = ProgressJournal(
+            city_path(self.settings, "CITY_DIR", "data/{city}"),
+            flush_records=self.settings.getint("PROGRESS_FLUSH_RECORDS", 20),
+            flush_seconds=self.settings.getfloat("PROGRESS_FLUSH_SECONDS", 30.0),
+            compact_records=self.settings.getint("PROGRESS_COMPACT_RECORDS", 1000),
+            wait_for_commit=True
+        )
+        self.crawler.signals.connect(self.progress.confirm, signal=items_stored)
+        if int(self.fanout):
+            yield from self.fanout_requests()
+            return
         next_target = self.find_next_target()
         if next_target:
-            region_key, url = next_target
+            region_key, url, page = next_target
             yield scrapy.Request(url=url, callback=self.parse, cb_kwargs={
-                "region_key": region_key
+                "region_key": region_key,
+                "page": page
             })
         else:
             print(f"注意：所有区域已爬取完毕")
 
-    def parse(self, response: scrapy.http.Response, region_key: str):
+    def load_page_counts(self):
+        """从数据库中统计每个列表页已获取的小区数量"""
+        counts: dict[tuple[str, int], int] = {}
+        with ItemStore.from_settings(self.settings) as store:
+            for item in store.items(self.name):
+                key = (item.get("district"), item.get("page_on_list"))
+                counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def page_request(self, target: RegionTarget, page: int):
+        """按链接模式请求区域的第 `page` 页"""
+        return scrapy.Request(
+            url=target.page_url(page),
+            callback=self.parse,
+            cb_kwargs={"region_key": target.key, "page": page},
+            meta={"fanout": True},
+            dont_filter=True  # 重新请求不完整的页面时链接与之前相同
+        )
+
+    def fanout_requests(self):
+        """同时请求所有区域中不完整的列表页
+
+        链接符合已知模式的区域直接生成第 1 页到第 `page_nb` 页的链接，已获取的小区数量足够的页面跳过；
+        其他区域仍然从进度中的位置开始跟随“下一页”链接，各个区域之间同时进行。
+
+        Yields:
+            scrapy.Request: 列表页请求
+        """
+        self.page_counts = self.load_page_counts()
+        self.page_attempts = {}
+        pages = 0
+        for target in self.targets:
+            if target.page_url(1) is None:
+                resume = self.resume_point(target)
+                if resume is not None:
+                    url, page = resume
+                    yield scrapy.Request(url=url, callback=self.parse, cb_kwargs={
+                        "region_key": target.key,
+                        "page": page
+                    })
+                continue
+            for page in range(1, target.page_nb + 1):
+                if self.page_counts.get((target.key, page), 0) < target.expected_count(page, int(self.page_size)):
+                    pages += 1
+                    yield self.page_request(target, page)
+        self.logger.info("同时请求列表页 %d 个", pages)
+
+    def closed(self, reason):
+        if self.progress is not None:
+            self.progress.close()
+        if self.extract_pool is not None:
+            self.extract_pool.close()
+        if int(self.fanout):
+            self.check_regions()
+
+    def check_regions(self):
+        """对比每个区域获取的小区数量与 targets.csv 中的 community_nb"""
+        for target in self.targets:
+            if target.page_url(1) is None:
+                continue
+            harvested = sum(n for (region_key, _), n in self.page_counts.items() if region_key == target.key)
+            if harvested < target.community_nb:
+                self.crawler.stats.inc_value("list/short_regions")
+                self.logger.warning(
+                    "%s 获取小区 %d 个，少于 targets.csv 中的 %d 个", target.key, harvested, target.community_nb
+                )
+
+    def parse_items(self, response: scrapy.http.Response, region_key: str, page: int):
+        """从列表页中提取小区，不修改爬虫状态，离线重新解析时也使用这个方法
+
+        Yields:
+            CommunityItem: 小区名称和链接
+        """
         _, region_type = region_key.split("_")
-        if region_type == "old":
-            house_list = response.css("div.houseList a.plotTit")
-        elif region_type == "new":
-            house_list = response.css("div.nhouse_list div.nlcd_name a")
+        communities, _ = extract_list(response.text, region_type)
+        yield from self.make_items(communities, region_key, page)
+
+    def make_items(self, communities: list[tuple[str, str]], region_key: str, page: int):
+        for name, link in communities:
+            yield CommunityItem(
+                name=name,
+                link=link,
+                city=current_city(self.settings),
+                district=region_key,
+                page_on_list=page
+            )
+
+    def check_page(
+        self,
+        response: scrapy.http.Response,
+        region_key: str,
+        page: int,
+        count: int,
+        next_page_link: str | None
+    ):
+        """检查按链接模式请求的列表页是否完整
+
+        小区数量少于应有数量的页面重新请求，最多 `refetch` 次；
+        页码达到 targets.csv 中的页数、但仍有下一页时，继续跟随“下一页”链接。
+
+        Yields:
+            scrapy.Request: 重新请求或下一页的请求
+        """
+        target = next(x for x in self.targets if x.key == region_key)
+        key = (region_key, page)
+        self.page_counts[key] = max(self.page_counts.get(key, 0), count)
+        if count < target.expected_count(page, int(self.page_size)):
+            attempts = self.page_attempts.get(key, 0) + 1
+            self.page_attempts[key] = attempts
+            if attempts <= int(self.refetch):
+                self.crawler.stats.inc_value("list/refetched")
+                yield self.page_request(target, page)
+                return
+            self.crawler.stats.inc_value("list/short_pages")
+            self.logger.warning("%s 第 %d 页只有 %d 个小区", region_key, page, count)
+        if page >= target.page_nb and count > 0:
+            if next_page_link is not None:
+                yield response.follow(next_page_link, callback=self.parse, cb_kwargs={
+                    "region_key": region_key,
+                    "page": page + 1
+                }, meta={"fanout": True})
+
+    @timed
+    async def parse(self, response: scrapy.http.Response, region_key: str, page: int):
+        _, region_type = region_key.split("_")
+        if self.extract_pool is not None:
+            communities, next_page_link = await self.extract_pool.extract(extract_list, response, region_type)
         else:
-            house_list = []
+            communities, next_page_link = extract_list(response.text, region_type)
+        house_list = list(self.make_items(communities, region_key, page))
+        if response.meta.get("fanout"):
+            ''' 按链接模式请求的页面，不记录逐页的进度
+            '''
+            for item in house_list:
+                yield item
+            for request in self.check_page(response, region_key, page, len(house_list), next_page_link):
+                yield request
+            return
         if len(house_list) > 0:
             ''' 如果能获取到列表，表示正常情况，可以继续获取数据。
             '''
             for item in house_list:
-                yield CommunityItem(
-                    name=item.css("::text").get(),
-                    link=item.css("::attr(href)").get(),
-                    district=region_key,
-                    page_on_list=self.progress[region_key]["page"]
-                )
-            ''' 获取下一页的链接
-            '''
-            next_page_link = None
-            if region_type == "old":
-                pagers: list = response.css("div.fanye a")
-            else:
-                pagers: list = response.css("div.page li.fr a")
-            next_page = [p for p in pagers if len(p.re("下一页")) > 0]
-            if len(next_page) > 0:
-                next_page_link = next_page[0].css("::attr(href)").get()
-            ''' 保存进度
+                yield item
+            ''' 保存进度，这一页的数据提交到数据库之后才写入日志
             '''
-            self.progress[region_key]["next"] = next_page_link
-            self.save_progress()
-            self.progress[region_key]["page"] = self.progress[region_key]["page"] + 1
+            self.progress.record(region_key, page, next_page_link)
             ''' 进入下一页
             '''
-            sleep(1 + random.uniform(0, 1))
             if next_page_link is not None:
                 yield response.follow(next_page_link, callback=self.parse, cb_kwargs={
-                    "region_key": region_key
+                    "region_key": region_key,
+                    "page": page + 1
                 })
+            elif int(self.fanout):
+                ''' 同时爬取的区域各自结束，不转到下一个区域
+                '''
+                return
             else:
                 next_target = self.find_next_target()
                 if next_target:
-                    region_key, url = next_target
+                    region_key, url, page = next_target
                     yield response.follow(url=url, callback=self.parse, cb_kwargs={
-                        "region_key": region_key
+                        "region_key": region_key,
+                        "page": page
                     })
                 else:
                     print(f"注意：所有区域已爬取完毕")
@@ -1,126 +1,331 @@
+import csv
+import json
+from datetime import datetime, timedelta, timezone
 from typing import Any, Iterable
 from scrapy import Spider, Request
-import pandas as pd
 from scrapy.http import Request, TextResponse
 from urllib.parse import urlencode
 from pathlib import Path
 from dataclasses import dataclass
 from time import sleep
+from twisted.python.failure import Failure
+from project.frontier import Frontier
+from project.sharedfrontier import open_frontier
+from project.store import ItemStore
+from project.geocache import GeocodeCache
+from project.ratelimit import shared_bucket
+from project.cities import city_path, current_city
+from project.metrics import timed
+from project.retry import RetryScheduler, failure_reason
 
 ROOT_DIR = Path(__file__).parent / ".." / ".."
 
-@dataclass
+QPS_ERRORS = ["CQPS_HAS_EXCEEDED_THE_LIMIT", "CKQPS_HAS_EXCEEDED_THE_LIMIT", "CUQPS_HAS_EXCEEDED_THE_LIMIT", "ACCESS_TOO_FREQUENT"]
+QUOTA_ERRORS = ["QUOTA_PLAN_RUN_OUT", "DAILY_QUERY_OVER_LIMIT", "ABROAD_DAILY_QUERY_OVER_LIMIT"]
+CHINA_TZ = timezone(timedelta(hours=8))  # 高德日配额按北京时间零点重置
+
+@dataclass(slots=True)
 class CommunityTarget:
     # index: int
     uuid: str
     name: str
     address: str
-    waiting: bool
     lon: None | float = None
     lat: None | float = None
+    level: None | str = None
 
 
 class CommunityGeoLocator(Spider):
     name = "community_geolocator"
-    custom_settings = {
-        "FEEDS":{
-            "community_geolocation.jsonl":{
-                "format":"jsonl",
-                "overwrite": False
-            }
-        }
-    }
+    item_key = "uuid"  # 数据库中数据的唯一键，见 ItemStorePipeline
 
-    base_url: str = "https://restapi.amap.com/v3/geocode/geo"
+    base_url: str = "https://restapi.amap.com/v3/geocode/geo"  # 离线测试时可以指向 project.mock.amap
     key: str = ""
-    communities: pd.DataFrame = pd.DataFrame()
+    communities: Frontier[CommunityTarget] = Frontier(lambda x: x.uuid)
+    batch: int = 1  # 每个请求编码的地址数量，高德批量接口最多 10 个，可通过 `-a batch=10` 设置
+    city: str = ""  # 高德接口限定的城市，即设置 CITY
+    cache: GeocodeCache | None = None
+    qps: float = 0  # Key 的 QPS 上限，0 表示不限速且逐个请求，可通过 `-a qps=3` 设置
+    concurrency: int = 0  # 同时在途的请求数量，默认等于 qps（向上取整）
+    requests_in_flight: int = 0
+    backoff: float = 0.0
+    exhausted: bool = False
+    store: ItemStore | None = None
+    retries: RetryScheduler | None = None  # 请求失败的地址的失败次数和死信，见 project.retry
+    retry_dead: int = 0  # 重新编码已转入死信的地址，可通过 `-a retry_dead=1` 开启
+    isolated: list[CommunityTarget] = []  # 之前请求失败过、需要单独请求的小区
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.qps = float(self.qps)
+        self.concurrency = int(self.concurrency) or max(1, int(-(-self.qps // 1)))
+        self.rate_limiter = shared_bucket("amap", self.qps)  # 由 RateLimitMiddleware 使用，同一进程中的城市共用 Key 的 QPS
 
-    def get_url(self, target: CommunityTarget):
+    def get_url(self, targets: list[CommunityTarget]):
         params = {
             "key": self.key,
-            "city": "郑州",
-            "address": target.address
+            "city": self.city,
+            "address": "|".join([x.address.replace("|", " ") for x in targets])  # 批量模式下地址以 | 分隔
         }
-        query_string = "&".join([f"{k}={v}" for k, v in params.items()])
-        return f"{self.base_url}?{query_string}"
+        if len(targets) > 1:
+            params["batch"] = "true"
+        '''地址中可能有 &、#、+、= 等字符，必须编码，否则请求的参数被截断或者改变
+        '''
+        return f"{self.base_url}?{urlencode(params)}"
 
     def find_next(self):
-        waiting = self.communities.loc[self.communities["waiting"] == True, :]
-        if waiting.shape[0] > 0:
-            for irow in range(waiting.shape[0]):
-                info = waiting.iloc[irow, :].to_dict()
-                if len(info["address"]) > 4:
-                    item = CommunityTarget(**info)
-                    return (self.get_url(item), item)
-                else:
-                    self.logger.error("地址太短，无法解析: %s", info["name"])
-                    self.communities.loc[info["uuid"], "waiting"] = False
+        """取出下一批需要编码的小区，缓存中已有结果的小区直接完成
+
+        Returns:
+            tuple[str, list[CommunityTarget], list[CommunityTarget]]: 请求链接、这一批小区和命中缓存的小区
+            tuple[None, None, list[CommunityTarget]]: 所有地址已编码完毕
+        """
+        if self.isolated:
+            item = self.isolated.pop(0)
+            return (self.get_url([item]), [item], [])
+        items: list[CommunityTarget] = []
+        cached: list[CommunityTarget] = []
+        while len(items) < self.batch:
+            item = self.communities.pop()
+            if item is None:
+                break
+            result = self.cache.get(self.city, item.address) if self.cache is not None else None
+            if result is None:
+                if self.batch > 1 and item.uuid in self.retries.records:
+                    '''请求失败过的小区单独请求，一直失败的地址不会连累同一批的其他地址转入死信
+                    '''
+                    self.isolated.append(item)
+                    continue
+                items.append(item)
+                continue
+            self.crawler.stats.inc_value("geocache/hit")
+            self.communities.done(item.uuid)
+            if result["lon"] is not None:
+                item.lon, item.lat, item.level = result["lon"], result["lat"], result["level"]
+                cached.append(item)
+        if len(items) == 0 and self.isolated:
+            items.append(self.isolated.pop(0))
+        if len(items) > 0:
+            return (self.get_url(items), items, cached)
+        else:
+            if self.requests_in_flight == 0:
+                self.logger.info("所有地址已编码完毕")
+            return (None, None, cached)
+
+    def next_requests(self):
+        """补足在途请求，命中缓存的小区直接输出
+
+        Yields:
+            CommunityTarget: 命中缓存的小区
+            Request: 编码请求，直到在途数量达到 `concurrency`
+        """
+        while not self.exhausted and self.requests_in_flight < self.concurrency:
+            target, communities, cached = self.find_next()
+            yield from cached
+            if target is None:
+                break
+            self.requests_in_flight += 1
+            self.crawler.stats.inc_value("geocache/miss", len(communities))
+            yield Request(
+                url=target,
+                callback=self.parse,
+                errback=self.error_back,
+                cb_kwargs={"communities": communities},
+                meta={"rate_limit": True},
+                dont_filter=True  # 重试时链接与之前相同
+            )
+
+    def retry_later(self, communities: list[CommunityTarget], reason: str):
+        """超过 QPS：将小区放回队尾，并退避"""
+        for community in communities:
+            self.communities.requeue(community.uuid)
+        self.crawler.stats.inc_value(f"geocoder/retry/{reason}")
+        self.back_off(reason)
+
+    def retry_failed(self, communities: list[CommunityTarget], failure: Failure):
+        """网络错误：按小区记录失败次数，放回队尾并退避
+
+        退避由令牌桶的暂停实现（见 `back_off`），小区立即放回队尾。
+        """
+        for community in communities:
+            self.record_failure(community, failure)
+        self.back_off(failure_reason(failure))
+
+    def record_failure(self, community: CommunityTarget, failure: Failure | str):
+        """记录小区的一次失败，放回队尾，失败 TARGET_RETRY_MAX_ATTEMPTS 次的小区转入死信
+
+        死信中的小区本次和之后的运行都不再编码，直到使用 `-a retry_dead=1` 运行。
+        """
+        reason, wait = self.retries.fail(community.uuid, failure, schedule=False)
+        self.crawler.stats.inc_value(f"geocoder/retry/{reason}")
+        if wait is None:
+            self.logger.error("多次编码失败，转入死信: %s (%s)", community.name, reason)
+            self.crawler.stats.inc_value("geocoder/dead_letter")
+            self.communities.done(community.uuid)
         else:
-            self.logger.info("所有地址已编码完毕")
-            return (None, None)
+            self.communities.requeue(community.uuid)
+
+    def back_off(self, reason: str):
+        """按指数退避暂停发放令牌
+
+        同一次暂停期间返回的其他错误不再加倍退避时间；
+        每次退避同时将速率降低 10%，使 `qps` 设置过高时逐渐收敛到接口的实际上限。
+        """
+        if self.rate_limiter.paused:
+            return
+        self.backoff = min(max(1.0, self.backoff * 2), 60.0)
+        self.rate_limiter.pause(self.backoff)
+        if self.rate_limiter.rate > 0:
+            self.rate_limiter.rate = max(0.5, self.rate_limiter.rate * 0.9)
+        self.logger.warning(
+            "%s，%.0f 秒后重试，速率降为 %.2f 次/秒", reason, self.backoff, self.rate_limiter.rate
+        )
+
+    def pause_for_quota(self, communities: list[CommunityTarget], reason: str):
+        """配额耗尽：保存暂停状态并停止爬虫，在途的小区下次运行时重新编码"""
+        for community in communities:
+            self.communities.requeue(community.uuid)
+        if self.exhausted:
+            return
+        self.exhausted = True
+        tomorrow = datetime.now(CHINA_TZ).date() + timedelta(days=1)
+        paused_until = datetime.combine(tomorrow, datetime.min.time(), CHINA_TZ)
+        self.state_file.write_text(json.dumps({
+            "reason": reason,
+            "paused_until": paused_until.isoformat()
+        }), encoding="UTF-8")
+        self.logger.error("%s，暂停到 %s", reason, paused_until.isoformat())
+        self.crawler.engine.close_spider(self, "quota_exhausted")
+
+    @property
+    def state_file(self):
+        """配额属于 Key，所有城市共用一个暂停状态"""
+        return ROOT_DIR / "geocoder_state.json"
+
+    @property
+    def community_file(self):
+        """post/etl.py 输出的当前城市的小区地址"""
+        return city_path(self.settings, "CITY_DIR", "data/{city}") / "community.csv"
+
+    def load_targets(self):
+        """读取小区地址，地址太短的小区在加载时跳过
+
+        Yields:
+            CommunityTarget: 需要编码的小区
+        """
+        with open(self.community_file, encoding="UTF-8", newline="") as community_file:
+            for row in csv.DictReader(community_file):
+                address = row["address"]
+                if len(address) > 4:
+                    yield CommunityTarget(uuid=row["uuid"], name=row["name"], address=address)
+                elif row["uuid"] not in self.communities.finished:
+                    self.logger.error("地址太短，无法解析: %s", row["name"])
 
     def start_requests(self) -> Iterable[Request]:
+        self.batch = min(max(1, int(self.batch)), 10)
+        self.city = current_city(self.settings)
         if (ROOT_DIR / "key.txt").exists():
             self.key = (ROOT_DIR / "key.txt").read_text().strip()
         else:
             self.logger.error("无法读取秘钥")
             return
 
-        if (ROOT_DIR / "community.csv").exists():
-            self.communities = pd.read_csv(ROOT_DIR / "community.csv", index_col=0).set_index("uuid", drop=False)
-            self.communities["waiting"] = True
+        if self.state_file.exists():
+            state = json.loads(self.state_file.read_text(encoding="UTF-8"))
+            if datetime.fromisoformat(state["paused_until"]) > datetime.now(CHINA_TZ):
+                self.logger.error("配额已耗尽（%s），暂停到 %s", state["reason"], state["paused_until"])
+                return
+            self.state_file.unlink()
+
+        self.communities = open_frontier(self.crawler, self.name, lambda x: x.uuid, CommunityTarget)
+        self.requests_in_flight = 0
+        self.isolated = []
+        self.cache = GeocodeCache.from_settings(self.settings, ROOT_DIR)
+        evicted = self.cache.evict_expired()
+        if evicted > 0:
+            self.logger.info("删除过期的编码缓存 %d 条", evicted)
+        if self.store is None:
+            self.store = ItemStore.from_settings(self.settings)  # 爬取过程中保持打开，记录失败的地址；通常由 ItemStorePipeline 提供
+        for uuid in self.store.keys(self.name):
+            self.communities.done(uuid)
+        self.retries = RetryScheduler.from_settings(self.settings, self.store, self.name)
+        if int(self.retry_dead):
+            self.logger.info("重新编码死信中的小区 %d 个", len(self.retries.revive()))
+        else:
+            for uuid in self.retries.dead():
+                self.communities.done(uuid)
+
+        if self.community_file.exists():
+            self.communities.extend(self.load_targets())
         else:
             self.logger.error("无法读取小区数据")
             return
-        
-        if (ROOT_DIR / "community_geolocation.jsonl").exists():
-            finished = pd.read_json(ROOT_DIR / "community_geolocation.jsonl", lines=True)
-            self.communities.loc[finished.uuid, "waiting"] = False
-        
-        target, community = self.find_next()
-        if target is not None:
-            yield Request(
-                url=target,
-                callback=self.parse,
-                cb_kwargs={"community": community}
-            )
+
+        yield from self.next_requests()
     
-    def parse(self, response: TextResponse, community: CommunityTarget) -> Any:
+    @timed
+    def parse(self, response: TextResponse, communities: list[CommunityTarget]) -> Any:
+        self.requests_in_flight -= 1
         data = response.json()
         if data["status"] == "1":
-            count = int(data["count"])
-            geocodes = data["geocodes"]
-            if count > 0:
-                location: str = geocodes[0]["location"]
-                lon, lat = location.split(",")
-                community.lon = float(lon)
-                community.lat = float(lat)
-                yield community
-            else:
-                self.logger.error("没有编码结果")
+            self.backoff = 0.0
+            '''批量模式下，编码结果与地址一一对应，编码失败的地址 location 为空；单个地址编码失败时返回空列表。
+            批量响应被截断时缺少的结果不是接口的回答，不写入缓存，和没有结果的地址一样单独重试
+            '''
+            geocodes: list[dict] = data["geocodes"] or []
+            for index, community in enumerate(communities):
+                geocode = geocodes[index] if index < len(geocodes) else None
+                location = geocode.get("location") if geocode else None
+                if isinstance(location, str) and "," in location:
+                    lon, lat = location.split(",")
+                    community.lon = float(lon)
+                    community.lat = float(lat)
+                    community.level = geocode.get("level") or None
+                    self.cache.put(self.city, community.address, community.lon, community.lat, community.level, geocode)
+                    self.retries.succeed(community.uuid)
+                    yield community
+                    self.communities.done(community.uuid)
+                elif geocode is None and len(communities) > 1:
+                    self.logger.error("批量响应中缺少编码结果: %s", community.name)
+                    self.record_failure(community, "truncated")
+                else:
+                    self.logger.error("没有编码结果: %s", community.name)
+                    self.cache.put(self.city, community.address, None, None, None, geocode)  # 仅在设置了 GEOCODE_CACHE_NEGATIVE_TTL 时保存
+                    self.record_failure(community, "no_result")
+            yield from self.next_requests()
+            return
         else:
             error_info = data["info"]
-            if error_info == "QUOTA_PLAN_RUN_OUT":
-                self.logger.error("余额耗尽")
+            if error_info in QUOTA_ERRORS:
+                self.pause_for_quota(communities, error_info)
                 return
-            elif error_info in ["ABROAD_DAILY_QUERY_OVER_LIMIT", "CQPS_HAS_EXCEEDED_THE_LIMIT", "CKQPS_HAS_EXCEEDED_THE_LIMIT", "CUQPS_HAS_EXCEEDED_THE_LIMIT"]:
-                self.logger.error("QPS超出限制")
-                return
-            elif error_info == "DAILY_QUERY_OVER_LIMIT":
-                self.logger.error("访问已超出日访问量")
-                return
-            elif error_info == "ACCESS_TOO_FREQUENT":
-                self.logger.error("单位时间内访问过于频繁")
+            elif error_info in QPS_ERRORS:
+                self.retry_later(communities, error_info)
+                yield from self.next_requests()
                 return
             else:
                 self.logger.error("服务器返回错误: %s", error_info)
         '''Next
         '''
-        self.communities.loc[community.uuid, "waiting"] = False
-        next_target, next_community = self.find_next()
-        if next_target is not None:
-            yield response.follow(
-                url=next_target,
-                callback=self.parse,
-                cb_kwargs={"community": next_community}
+        for community in communities:
+            self.communities.done(community.uuid)
+        yield from self.next_requests()
+
+    @timed
+    def error_back(self, failure: Failure):
+        """网络错误：退避后重试，多次失败后放弃"""
+        self.logger.error(failure)
+        self.requests_in_flight -= 1
+        self.retry_failed(failure.request.cb_kwargs["communities"], failure)
+        yield from self.next_requests()
+
+    def closed(self, reason):
+        self.communities.close()
+        if self.store is not None:
+            self.store.close()
+        if self.cache is not None:
+            self.logger.info(
+                "编码缓存命中 %d 次，未命中 %d 次，命中率 %.1f%%",
+                self.cache.hits, self.cache.misses, self.cache.hit_rate * 100
             )
+            self.cache.close()
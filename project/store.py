@@ -0,0 +1,259 @@
+# 基于 SQLite 的数据存储
+#
+# 一个城市所有爬虫的数据都写入同一个数据库（按城市分片，见 project.cities），按 (爬虫名称, 键) 唯一索引，
+# 重复爬取时覆盖旧数据而不是追加。恢复进度时只需要读取键，不需要解析全部历史数据。
+#
+# 导出为 jsonl（供 post/ 中的笔记本使用）：
+#     python -m project.store --city 郑州 export community_info community_info.jsonl
+# 导入旧版 jsonl 数据：
+#     python -m project.store import community_list community_list.jsonl link
+#
+# 每次提交后发送 `items_stored` 信号（由 ItemStorePipeline 发送），共享的待爬取队列
+# （见 project.sharedfrontier）在数据写入数据库之后才把目标标记为完成。
+#
+# validators 表记录每条数据最近一次检查时的 ETag、Last-Modified 和内容哈希，
+# 供增量刷新（CommunityInfoSpider 的 refresh 模式）判断页面是否变化。
+#
+# failures 表记录请求失败的目标的失败次数、最近一次的原因和是否已转入死信（见 project.retry）：
+#     python -m project.store failures community_info --dead
+
+import argparse
+import hashlib
+import json
+import sqlite3
+from pathlib import Path
+from time import time
+from typing import Any, Callable, Iterator
+
+from project.cities import DEFAULT_CITY, city_path
+
+ROOT_DIR = Path(__file__).parent / ".."
+
+# 自定义信号，ItemStorePipeline 的数据提交到数据库后发送，参数为 spider
+items_stored = object()
+
+
+class ItemStore:
+    """SQLite 数据存储。
+
+    写入先进入缓冲区，每 `batch_size` 条在一个事务中批量提交。
+    """
+
+    def __init__(self, path: str | Path, batch_size: int = 200):
+        """
+        Args:
+            path (str | Path): 数据库文件路径
+            batch_size (int, optional): 每个事务提交的数据条数. Defaults to 200.
+        """
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self.buffer: list[tuple[str, str, str, float]] = []
+        self.validator_buffer: list[tuple[str, str, str | None, str | None, str, float]] = []
+        self.on_flush: Callable[[], Any] | None = None  # 每次提交后调用
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS items (
+                spider TEXT NOT NULL,
+                key TEXT NOT NULL,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (spider, key)
+            ) WITHOUT ROWID
+            """
+        )
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS validators (
+                spider TEXT NOT NULL,
+                key TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT NOT NULL,
+                checked_at REAL NOT NULL,
+                PRIMARY KEY (spider, key)
+            ) WITHOUT ROWID
+            """
+        )
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS failures (
+                spider TEXT NOT NULL,
+                key TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                reason TEXT NOT NULL,
+                dead INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (spider, key)
+            ) WITHOUT ROWID
+            """
+        )
+        self.connection.commit()
+
+    @classmethod
+    def from_settings(cls, settings):
+        """根据 Scrapy 设置打开当前城市的数据库，相对路径相对于项目根目录"""
+        path = city_path(settings, "ITEM_STORE_PATH", "data/{city}/items.sqlite3")
+        return cls(path, batch_size=settings.getint("ITEM_STORE_BATCH_SIZE", 200))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def put(self, spider: str, key: str, data: dict[str, Any]):
+        """写入一条数据，键已存在时覆盖"""
+        self.buffer.append((spider, key, json.dumps(data, ensure_ascii=False), time()))
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def put_validator(self, spider: str, key: str, etag: str | None, last_modified: str | None, content_hash: str):
+        """记录一条数据的检查结果，键已存在时覆盖"""
+        self.validator_buffer.append((spider, key, etag, last_modified, content_hash, time()))
+        if len(self.validator_buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """在一个事务中提交缓冲区中的数据"""
+        if len(self.buffer) == 0 and len(self.validator_buffer) == 0:
+            return
+        with self.connection:
+            self.connection.executemany(
+                """
+                INSERT INTO items (spider, key, data, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (spider, key) DO UPDATE SET
+                    data = excluded.data,
+                    updated_at = excluded.updated_at
+                """,
+                self.buffer
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO validators VALUES (?, ?, ?, ?, ?, ?)",
+                self.validator_buffer
+            )
+        self.buffer.clear()
+        self.validator_buffer.clear()
+        if self.on_flush is not None:
+            self.on_flush()
+
+    def keys(self, spider: str) -> Iterator[str]:
+        """遍历某个爬虫已保存数据的键，只读取索引"""
+        cursor = self.connection.execute("SELECT key FROM items WHERE spider = ?", (spider,))
+        for (key,) in cursor:
+            yield key
+
+    def items(self, spider: str) -> Iterator[dict[str, Any]]:
+        """按写入顺序遍历某个爬虫保存的数据"""
+        cursor = self.connection.execute(
+            "SELECT data FROM items WHERE spider = ? ORDER BY updated_at", (spider,)
+        )
+        for (data,) in cursor:
+            yield json.loads(data)
+
+    def validators(self, spider: str):
+        """读取某个爬虫全部数据的检查记录
+
+        Returns:
+            dict[str, dict[str, Any]]: 键 -> 包含 etag, last_modified, content_hash, checked_at 的记录
+        """
+        cursor = self.connection.execute(
+            "SELECT key, etag, last_modified, content_hash, checked_at FROM validators WHERE spider = ?", (spider,)
+        )
+        return {
+            key: {"etag": etag, "last_modified": last_modified, "content_hash": content_hash, "checked_at": checked_at}
+            for key, etag, last_modified, content_hash, checked_at in cursor
+        }
+
+    def put_failure(self, spider: str, key: str, attempts: int, reason: str, dead: bool):
+        """记录一个目标的失败次数和最近一次的原因（见 project.retry），立即提交"""
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO failures VALUES (?, ?, ?, ?, ?, ?)",
+                (spider, key, attempts, reason, int(dead), time())
+            )
+
+    def clear_failure(self, spider: str, key: str):
+        """目标爬取成功后删除其失败记录"""
+        with self.connection:
+            self.connection.execute("DELETE FROM failures WHERE spider = ? AND key = ?", (spider, key))
+
+    def failures(self, spider: str):
+        """读取某个爬虫全部目标的失败记录
+
+        Returns:
+            dict[str, dict[str, Any]]: 键 -> 包含 attempts, reason, dead, updated_at 的记录
+        """
+        cursor = self.connection.execute(
+            "SELECT key, attempts, reason, dead, updated_at FROM failures WHERE spider = ?", (spider,)
+        )
+        return {
+            key: {"attempts": attempts, "reason": reason, "dead": bool(dead), "updated_at": updated_at}
+            for key, attempts, reason, dead, updated_at in cursor
+        }
+
+    def count(self, spider: str):
+        (count,) = self.connection.execute("SELECT COUNT(*) FROM items WHERE spider = ?", (spider,)).fetchone()
+        return count
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
+def content_hash(data: Any):
+    """数据内容的哈希，与键的顺序无关"""
+    text = json.dumps(data, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(text.encode("UTF-8")).hexdigest()
+
+
+def export_jsonl(store: ItemStore, spider: str, output: Path):
+    """将某个爬虫的数据导出为 jsonl 文件"""
+    with open(output, "w", encoding="UTF-8") as file:
+        for item in store.items(spider):
+            file.write(json.dumps(item, ensure_ascii=False) + "\n")
+
+
+def import_jsonl(store: ItemStore, spider: str, source: Path, key: str):
+    """将旧版 FEEDS 导出的 jsonl 文件导入数据库，重复的键只保留最后一条"""
+    with open(source, encoding="UTF-8") as file:
+        for line in file:
+            if line.strip() != "":
+                item = json.loads(line)
+                store.put(spider, str(item[key]), item)
+    store.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="爬虫数据库的导入导出工具")
+    parser.add_argument("--city", default=DEFAULT_CITY, help="城市，数据库为 data/<城市>/items.sqlite3")
+    parser.add_argument("--db", help="数据库文件路径，指定时忽略 --city")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="导出为 jsonl")
+    export_parser.add_argument("spider")
+    export_parser.add_argument("output", type=Path)
+    import_parser = commands.add_parser("import", help="导入 jsonl")
+    import_parser.add_argument("spider")
+    import_parser.add_argument("source", type=Path)
+    import_parser.add_argument("key", help="数据的唯一键，例如 link 或 uuid")
+    failures_parser = commands.add_parser("failures", help="列出失败的目标（见 project.retry）")
+    failures_parser.add_argument("spider")
+    failures_parser.add_argument("--dead", action="store_true", help="只列出死信")
+    args = parser.parse_args()
+    with ItemStore(args.db or ROOT_DIR / "data" / args.city / "items.sqlite3") as store:
+        if args.command == "failures":
+            failures = store.failures(args.spider)
+            for key, record in failures.items():
+                if record["dead"] or not args.dead:
+                    print(key, record["attempts"], record["reason"], "dead" if record["dead"] else "retry", sep="\t")
+            dead = sum(1 for x in failures.values() if x["dead"])
+            print(f"{args.spider}: {len(failures)} 个失败的目标，其中死信 {dead} 个")
+        else:
+            if args.command == "export":
+                export_jsonl(store, args.spider, args.output)
+            else:
+                import_jsonl(store, args.spider, args.source, args.key)
+            print(f"{args.spider}: {store.count(args.spider)} 条数据")
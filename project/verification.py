@@ -0,0 +1,188 @@
+# 验证页面（验证码、反爬页面）的识别
+#
+# 房天下在访问过于频繁时返回验证码页面：状态码 403/429、重定向到 captcha 链接，
+# 或者返回很短的、标题为“访问验证”之类的页面。这类页面解析不出任何信息，
+# 以前会被当作空数据写入，再在 notebook 中过滤掉。
+#
+# 这里只使用便宜的信号（状态码、重定向、响应大小、页面开头的标志文字）判断，
+# 不解析 HTML。识别到验证页面后由 VerificationMiddleware 隔离页面、暂停或放慢对该主机的请求，
+# 爬虫在 errback 中将目标放回队列。
+
+import hashlib
+import json
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from time import time
+
+from scrapy.exceptions import IgnoreRequest
+
+ROOT_DIR = Path(__file__).parent / ".."
+
+# 自定义信号，识别到验证页面时发送，参数为 request, response, reason, spider
+verification_detected = object()
+
+
+class VerificationRequired(IgnoreRequest):
+    """响应是验证页面，请求被丢弃，目标需要稍后重新爬取"""
+
+    def __init__(self, reason: str, url: str):
+        super().__init__(f"verification page ({reason}): {url}")
+        self.reason = reason
+        self.url = url
+
+
+@dataclass
+class VerificationRules:
+    status: frozenset[int] = frozenset({403, 405, 429})
+    url_patterns: tuple[str, ...] = ("captcha", "verify")
+    markers: tuple[str, ...] = ("请输入验证码", "访问验证", "安全验证", "滑动验证", "人机验证", "访问过于频繁")
+    min_size: int = 2048  # 小于这个字节数的 HTML 页面视为验证页面，0 表示不检查
+    scan_chars: int = 4096  # 只在页面开头的这些字符中查找标志文字
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            status=frozenset(int(x) for x in settings.getlist("VERIFICATION_STATUS", [403, 405, 429])),
+            url_patterns=tuple(settings.getlist("VERIFICATION_URL_PATTERNS", cls.url_patterns)),
+            markers=tuple(settings.getlist("VERIFICATION_MARKERS", cls.markers)),
+            min_size=settings.getint("VERIFICATION_MIN_SIZE", cls.min_size),
+            scan_chars=settings.getint("VERIFICATION_SCAN_CHARS", cls.scan_chars),
+        )
+
+    def detect(self, request, response):
+        """判断响应是否为验证页面
+
+        按从便宜到昂贵的顺序检查，命中任意一项即返回。
+
+        Returns:
+            str: 识别的原因，例如 "status_403"、"redirect"、"size"、"marker"
+            None: 不是验证页面
+        """
+        if response.status in self.status:
+            return f"status_{response.status}"
+        urls = [response.url, *request.meta.get("redirect_urls", [])]
+        location = response.headers.get("Location")
+        if location is not None:
+            urls.append(location.decode("latin1"))
+        if any(pattern in url.lower() for url in urls for pattern in self.url_patterns):
+            return "redirect"
+        if response.status != 200 or not hasattr(response, "text"):
+            return None
+        if len(response.body) < self.min_size:
+            return "size"
+        head = response.text[:self.scan_chars]
+        if any(marker in head for marker in self.markers):
+            return "marker"
+        return None
+
+
+@dataclass
+class HostState:
+    """一个主机最近的响应是否为验证页面，以及暂停到什么时候"""
+    window: deque = field(default_factory=lambda: deque(maxlen=20))
+    consecutive: int = 0
+    paused_until: float = 0.0
+
+    @property
+    def block_rate(self):
+        return sum(self.window) / len(self.window) if self.window else 0.0
+
+
+class HostGuard:
+    """按主机统计验证页面的比例，决定暂停和放慢请求
+
+    - 每识别到一个验证页面，暂停对该主机的请求 `pause` 秒，连续出现时加倍，最多 `max_pause` 秒；
+    - 最近 `window` 个响应中验证页面的比例不低于 `slow_rate` 时，每个请求额外等待 `slow_delay` 秒。
+    """
+
+    def __init__(
+        self,
+        window: int = 20,
+        pause: float = 60.0,
+        max_pause: float = 1800.0,
+        slow_rate: float = 0.2,
+        slow_delay: float = 5.0
+    ):
+        self.window = window
+        self.pause = pause
+        self.max_pause = max_pause
+        self.slow_rate = slow_rate
+        self.slow_delay = slow_delay
+        self.hosts: dict[str, HostState] = {}
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            window=settings.getint("VERIFICATION_WINDOW", 20),
+            pause=settings.getfloat("VERIFICATION_PAUSE", 60.0),
+            max_pause=settings.getfloat("VERIFICATION_MAX_PAUSE", 1800.0),
+            slow_rate=settings.getfloat("VERIFICATION_SLOW_RATE", 0.2),
+            slow_delay=settings.getfloat("VERIFICATION_SLOW_DELAY", 5.0),
+        )
+
+    def state(self, host: str):
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = HostState(window=deque(maxlen=self.window))
+        return state
+
+    def record(self, host: str, blocked: bool):
+        """记录一个响应
+
+        Returns:
+            float: 因此开始的暂停时长（秒），没有暂停时为 0
+        """
+        state = self.state(host)
+        state.window.append(blocked)
+        if not blocked:
+            state.consecutive = 0
+            return 0.0
+        state.consecutive += 1
+        pause = min(self.pause * 2 ** (state.consecutive - 1), self.max_pause)
+        state.paused_until = max(state.paused_until, time() + pause)
+        return pause
+
+    def wait_time(self, host: str):
+        """下一个请求发送前需要等待的秒数"""
+        state = self.hosts.get(host)
+        if state is None:
+            return 0.0
+        wait = max(0.0, state.paused_until - time())
+        if state.block_rate >= self.slow_rate:
+            wait += self.slow_delay
+        return wait
+
+
+class Quarantine:
+    """保存验证页面供人工检查：`<目录>/<爬虫>/<链接哈希>.html`，以及索引 `index.jsonl`"""
+
+    def __init__(self, directory: str | Path):
+        self.directory = Path(directory)
+
+    @classmethod
+    def from_settings(cls, settings):
+        """相对路径相对于项目根目录，设置为空时不保存"""
+        path = settings.get("VERIFICATION_QUARANTINE_DIR")
+        if not path:
+            return None
+        path = Path(path)
+        if not path.is_absolute():
+            path = ROOT_DIR / path
+        return cls(path)
+
+    def put(self, spider: str, request, response, reason: str):
+        directory = self.directory / spider
+        directory.mkdir(parents=True, exist_ok=True)
+        name = hashlib.sha1(response.url.encode("UTF-8")).hexdigest()
+        (directory / f"{name}.html").write_bytes(response.body)
+        record = {
+            "url": request.url,
+            "response_url": response.url,
+            "status": response.status,
+            "reason": reason,
+            "file": f"{name}.html",
+            "time": time(),
+        }
+        with open(directory / "index.jsonl", "a", encoding="UTF-8") as index:
+            index.write(json.dumps(record, ensure_ascii=False) + "\n")